@@ -101,6 +101,7 @@ import tempfile
 import inspect
 from typing import Dict, List, Tuple, Optional, Any
 from pathlib import Path
+from dataclasses import dataclass
 from zoneinfo import ZoneInfo
 import html
 import sys as _sys, os as _os
@@ -310,7 +311,7 @@ FACT_INDEX: Dict[str, Any] = {}
 ANSWER_CACHE: Dict[str, str] = {}
 GENERAL_HISTORY: Dict[int, List[Dict[str, str]]] = {}
 SUPPLY_EVENTS: Dict[str, List[Dict[str, Any]]] = {}
-TASKS_CACHE: Dict[int, List[Dict[str, Any]]] = {}
+TASKS_CACHE: Dict[int, List["TaskView"]] = {}
 WAREHOUSE_CB_MAP: Dict[str, Tuple[str,str]] = {}
 LAST_PURGE_TS: Dict[int, float] = {}
 
@@ -406,11 +407,12 @@ def bold(txt:str)->str:
     return f"§§B§§{txt}§§EB§§"
 
 def build_html(lines:List[str])->str:
-    text="\n".join(lines)
-    text=html.escape(text)
+    text=html.escape("\n".join(lines))
+    if "§§" not in text: return text
     text=text.replace("§§B§§","<b>").replace("§§EB§§","</b>")
-    text=text.replace("§§I§§","<i>").replace("§§EI§§","</i>")
-    text=text.replace("§§U§§","<u>").replace("§§EU§§","</u>")
+    # Курсив/подчёркивание почти не используются — не гоняем лишние проходы по строке
+    if "I§§" in text: text=text.replace("§§I§§","<i>").replace("§§EI§§","</i>")
+    if "U§§" in text: text=text.replace("§§U§§","<u>").replace("§§EU§§","</u>")
     return text
 
 def _atomic_write(path:Path, text:str):
@@ -1478,20 +1480,40 @@ async def fetch_tasks_for_chat(chat_id:int)->List[Dict[str,Any]]:
     if recent: return []
     return fallback_tasks_from_events(chat_id)
 
-def build_tasks_list_text(tasks:List[Dict[str,Any]])->str:
+@dataclass(slots=True)
+class TaskView:
+    """Снимок задачи для отрисовки: поля считаются один раз при загрузке списка."""
+    id:str
+    emoji:str
+    stage:str
+    qty:int
+    date:str
+    slot:str
+    wh:str
+    sku:Any
+    sku_list:Optional[list]
+    last_error:str
+
+def task_view(t:Dict[str,Any])->TaskView:
+    em,stage=classify_task_stage(t)
+    date=t.get("date") or (t.get("desired_from_iso","")[:10] if t.get("desired_from_iso") else "-")
+    sl=t.get("sku_list")
+    return TaskView(id=t.get("id") or "-",emoji=em,stage=stage,qty=_sum_qty(t),date=date,
+                    slot=_first_time_or_dash(t),wh=_task_warehouse_name(t),sku=_first_sku(t) or "-",
+                    sku_list=sl if isinstance(sl,list) else None,last_error=t.get("last_error") or "")
+
+_TASK_LINE_FMT="{}) {} {} | {} шт | {} {} | Склад: {} | SKU {} | Task {}".format
+
+def build_tasks_list_text(tasks:List[TaskView])->str:
     if not tasks:
         return build_html(["§§B§§Заявки (0)§§EB§§",SEP_THIN,"Активных задач нет.","","Кнопки ниже: обновить / закрыть."])
-    lines=[f"§§B§§Заявки ({len(tasks)})§§EB§§",SEP_THIN]
+    n=len(tasks)
+    lines=[""]*(n+4)
+    lines[0]=f"§§B§§Заявки ({n})§§EB§§"; lines[1]=SEP_THIN
+    fmt=_TASK_LINE_FMT
     for i,t in enumerate(tasks,1):
-        em,stage=classify_task_stage(t)
-        qty=_sum_qty(t)
-        date=t.get("date") or (t.get("desired_from_iso","")[:10] if t.get("desired_from_iso") else "-")
-        slot=_first_time_or_dash(t)
-        sku=_first_sku(t) or "-"
-        tid=t.get("id") or "-"
-        wh=_task_warehouse_name(t)
-        lines.append(f"{i}) {em} {stage} | {qty} шт | {date} {slot} | Склад: {wh} | SKU {sku} | Task {tid}")
-    lines.append(""); lines.append("Нажмите номер для деталей. Ниже — обновить / удалить все / закрыть.")
+        lines[i+1]=fmt(i,t.emoji,t.stage,t.qty,t.date,t.slot,t.wh,t.sku,t.id)
+    lines[n+3]="Нажмите номер для деталей. Ниже — обновить / удалить все / закрыть."
     return build_html(lines)
 
 def build_tasks_kb(n:int)->InlineKeyboardMarkup:
@@ -1508,7 +1530,7 @@ def build_tasks_kb(n:int)->InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 async def render_tasks_list(chat_id:int, edit_message:Optional[Message]=None):
-    tasks=await fetch_tasks_for_chat(chat_id)
+    tasks=[task_view(t) for t in await fetch_tasks_for_chat(chat_id)]
     TASKS_CACHE[chat_id]=tasks
     text=build_tasks_list_text(tasks)
     kb=build_tasks_kb(len(tasks))
@@ -1519,26 +1541,23 @@ async def render_tasks_list(chat_id:int, edit_message:Optional[Message]=None):
         except Exception: pass
     await send_safe_message(chat_id,text,parse_mode="HTML",reply_markup=kb,disable_web_page_preview=True)
 
-def build_task_detail_text(t:Dict[str,Any])->str:
-    em,stage=classify_task_stage(t); qty=_sum_qty(t)
-    date=t.get("date") or (t.get("desired_from_iso","")[:10] if t.get("desired_from_iso") else "-")
-    slot=_first_time_or_dash(t); tid=t.get("id") or "-"; wh=_task_warehouse_name(t)
+def build_task_detail_text(t:TaskView)->str:
     lines=["§§B§§Детали заявки§§EB§§",
-           f"ID: {tid}",
-           f"Стадия: {em} {stage}",
-           f"Дата: {date} | Окно: {slot}",
-           f"Склад поставки: {wh}",
-           f"Итого: {qty} шт",
+           f"ID: {t.id}",
+           f"Стадия: {t.emoji} {t.stage}",
+           f"Дата: {t.date} | Окно: {t.slot}",
+           f"Склад поставки: {t.wh}",
+           f"Итого: {t.qty} шт",
            ""]
-    sl=t.get("sku_list")
-    if isinstance(sl,list):
+    sl=t.sku_list
+    if sl is not None:
         lines.append("Позиции:")
         for i,it in enumerate(sl,1):
             sku=it.get("sku"); q=it.get("total_qty") or it.get("qty") or 0
             name_w=it.get("warehouse_name") or "-"
             lines.append(f"{i}. SKU {sku} — {q} шт | {name_w}")
         lines.append("")
-    if t.get("last_error"): lines.append(f"Ошибка: {t['last_error']}")
+    if t.last_error: lines.append(f"Ошибка: {t.last_error}")
     return build_html(lines)
 
 def task_detail_kb()->InlineKeyboardMarkup:
@@ -1660,7 +1679,6 @@ def cluster_view_kb(cname:str, short:bool)->InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=rows)
 
 # ===== Callbacks (filters etc.) remain same except ensure_fact_index where needed =====
-@dp.callback_query(F.data.startswith("stockpage:"))
 async def cb_stock_page(c:CallbackQuery):
     ensure_admin(c.from_user.id)
     try: page=int(c.data.split(":")[1])
@@ -1691,26 +1709,15 @@ async def cb_stock_page(c:CallbackQuery):
     except Exception: await c.message.answer("Товары:",reply_markup=kb)
     await c.answer()
 
-@dp.callback_query(F.data=="noop")
 async def cb_noop(c:CallbackQuery): await c.answer()
 
-@dp.callback_query(F.data=="action:reanalyze")
 async def cb_reanalyze(c:CallbackQuery):
     ensure_admin(c.from_user.id)
     await handle_analyze(c.message.chat.id, verbose=False)
     await c.answer()
 
-@dp.callback_query(F.data.startswith("filter:"))
-async def cb_filter(c:CallbackQuery):
-    ensure_admin(c.from_user.id)
-    mode=c.data.split(":")[1]
-    cache=LAST_DEFICIT_CACHE.get(c.message.chat.id)
-    if not cache:
-        await c.answer("Анализ..."); await handle_analyze(c.message.chat.id, verbose=False); return
-    flat=cache["flat"]
-    if not flat:
-        await c.message.answer(f"{EMOJI_OK} Дефициты не найдены."); await c.answer(); return
-    view_mode=BOT_STATE.get("view_mode",DEFAULT_VIEW_MODE); full=view_mode=="FULL"
+def _build_filtered_deficit_text(flat:List[dict], mode:str, view_mode:str)->str:
+    full=view_mode=="FULL"
     def pick(lst,mode):
         if mode=="crit": return [d for d in lst if d["coverage"]<0.5]
         if mode=="mid": return [d for d in lst if 0.5<=d["coverage"]<0.8]
@@ -1740,6 +1747,23 @@ async def cb_filter(c:CallbackQuery):
             lines.append(SEP_THIN)
         lines.append(f"{EMOJI_TARGET} Показано товаров={len(per)}, строк={len(f2)}, режим={view_mode}")
         rep=build_html(lines)
+    return rep
+
+async def cb_filter(c:CallbackQuery):
+    ensure_admin(c.from_user.id)
+    mode=c.data.split(":")[1]
+    cache=LAST_DEFICIT_CACHE.get(c.message.chat.id)
+    if not cache:
+        await c.answer("Анализ..."); await handle_analyze(c.message.chat.id, verbose=False); return
+    flat=cache["flat"]
+    if not flat:
+        await c.message.answer(f"{EMOJI_OK} Дефициты не найдены."); await c.answer(); return
+    view_mode=BOT_STATE.get("view_mode",DEFAULT_VIEW_MODE)
+    # Кэш живёт внутри записи анализа: новый анализ = новая запись, старые тексты уходят вместе с ней
+    renders=cache.setdefault("renders",{})
+    rep=renders.get((mode,view_mode))
+    if rep is None:
+        rep=renders[(mode,view_mode)]=_build_filtered_deficit_text(flat,mode,view_mode)
     kb=InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="Все",callback_data="filter:all"),
          InlineKeyboardButton(text="Критично",callback_data="filter:crit"),
@@ -1750,7 +1774,6 @@ async def cb_filter(c:CallbackQuery):
     await send_long(c.message.chat.id, rep, kb=kb)
     await c.answer()
 
-@dp.callback_query(F.data.startswith("sku:"))
 async def cb_sku(c:CallbackQuery):
     ensure_admin(c.from_user.id)
     try: sku=int(c.data.split(":")[1])
@@ -1777,7 +1800,6 @@ async def cb_sku(c:CallbackQuery):
     await send_long(c.message.chat.id, build_html(lines))
     await c.answer()
 
-@dp.callback_query(F.data.startswith("whid:"))
 async def cb_whid(c:CallbackQuery):
     ensure_admin(c.from_user.id)
     hid=c.data.split(":",1)[1]
@@ -1815,7 +1837,6 @@ async def cb_whid(c:CallbackQuery):
     await send_long(c.message.chat.id, build_html(lines))
     await c.answer()
 
-@dp.callback_query(F.data.startswith("cluster:"))
 async def cb_cluster(c:CallbackQuery):
     ensure_admin(c.from_user.id)
     cname=c.data.split(":",1)[1]
@@ -1830,7 +1851,6 @@ async def cb_cluster(c:CallbackQuery):
     await send_long(c.message.chat.id, rep, kb=kb)
     await c.answer()
 
-@dp.callback_query(F.data.startswith("cluster_view:"))
 async def cb_cluster_view(c:CallbackQuery):
     ensure_admin(c.from_user.id)
     try:
@@ -1848,13 +1868,11 @@ async def cb_cluster_view(c:CallbackQuery):
         await send_long(c.message.chat.id, rep, kb=kb)
     await c.answer("Режим изменён")
 
-@dp.callback_query(F.data=="clusters:list")
 async def cb_clusters_list(c:CallbackQuery):
     ensure_admin(c.from_user.id)
     await cmd_clusters(c.message)
     await c.answer()
 
-@dp.callback_query(F.data=="chatmode:toggle")
 async def cb_chatmode_toggle(c:CallbackQuery):
     ensure_admin(c.from_user.id)
     current=BOT_STATE.get("chat_mode","fact")
@@ -2310,13 +2328,11 @@ async def text_buttons(m:Message,state:FSMContext):
         elif key=="cmd_refresh": await cmd_refresh(m)
 
 # ===== Task callbacks =====
-@dp.callback_query(F.data=="tasks:refresh")
 async def cb_tasks_refresh(c:CallbackQuery):
     ensure_admin(c.from_user.id)
     await render_tasks_list(c.message.chat.id, edit_message=c.message)
     await c.answer("Обновлено")
 
-@dp.callback_query(F.data=="tasks:close")
 async def cb_tasks_close(c:CallbackQuery):
     ensure_admin(c.from_user.id)
     try:
@@ -2326,7 +2342,6 @@ async def cb_tasks_close(c:CallbackQuery):
         pass
     await c.answer()
 
-@dp.callback_query(F.data=="tasks:purge_all")
 async def cb_tasks_purge_all(c:CallbackQuery):
     ensure_admin(c.from_user.id)
     chat_id=c.message.chat.id; done=False; msg="Удалено."
@@ -2347,7 +2362,6 @@ async def cb_tasks_purge_all(c:CallbackQuery):
     await render_tasks_list(chat_id, edit_message=c.message)
     await c.answer(msg, show_alert=not done)
 
-@dp.callback_query(F.data.startswith("tasks:detail:"))
 async def cb_tasks_detail(c:CallbackQuery):
     ensure_admin(c.from_user.id)
     try: idx=int(c.data.rsplit(":",1)[1])-1
@@ -2362,6 +2376,40 @@ async def cb_tasks_detail(c:CallbackQuery):
         await send_safe_message(c.message.chat.id,text,parse_mode="HTML",reply_markup=kb,disable_web_page_preview=True)
     await c.answer()
 
+# ===== Callback routing =====
+# Один обработчик вместо цепочки F.data-фильтров: точное совпадение, затем префикс по первому сегменту
+_CB_EXACT={
+    "noop":cb_noop,
+    "action:reanalyze":cb_reanalyze,
+    "clusters:list":cb_clusters_list,
+    "chatmode:toggle":cb_chatmode_toggle,
+    "tasks:refresh":cb_tasks_refresh,
+    "tasks:close":cb_tasks_close,
+    "tasks:purge_all":cb_tasks_purge_all,
+}
+_CB_PREFIX={
+    "stockpage":("stockpage:",cb_stock_page),
+    "filter":("filter:",cb_filter),
+    "sku":("sku:",cb_sku),
+    "whid":("whid:",cb_whid),
+    "cluster":("cluster:",cb_cluster),
+    "cluster_view":("cluster_view:",cb_cluster_view),
+    "tasks":("tasks:detail:",cb_tasks_detail),
+}
+
+def _cb_route(c:CallbackQuery):
+    data=c.data or ""
+    h=_CB_EXACT.get(data)
+    if h is None:
+        p=_CB_PREFIX.get(data.split(":",1)[0])
+        if p and data.startswith(p[0]): h=p[1]
+    # Чужие callback'и (например, menu_autobook) пропускаем дальше в подключённые роутеры
+    return {"cb_handler":h} if h else False
+
+@dp.callback_query(_cb_route)
+async def cb_dispatch(c:CallbackQuery, cb_handler):
+    await cb_handler(c)
+
 # ===== Supply notifications hooks =====
 async def supply_notify_text(chat_id:int,text:str):
     _supply_log_append(chat_id,{"ts":int(time.time()),"type":"text","text":text})
@@ -2397,16 +2445,10 @@ def setup_scheduler()->AsyncIOScheduler:
                       id="daily_notify_job",max_instances=1,coalesce=True,misfire_grace_time=600)
     return scheduler
 
-def _register_signal_handlers(loop:asyncio.AbstractEventLoop,scheduler:AsyncIOScheduler):
-    def _grace():
-        try: scheduler.shutdown(wait=False)
-        except Exception: pass
-        for t in asyncio.all_tasks(loop):
-            if t is not asyncio.current_task(loop): t.cancel()
-        try: loop.stop()
-        except Exception: pass
+def _register_signal_handlers(loop:asyncio.AbstractEventLoop,stop:asyncio.Event):
+    # Только выставляем флаг: остановка идёт штатно внутри main(), без loop.stop() под asyncio.run
     for sig in (signal.SIGINT,signal.SIGTERM):
-        try: loop.add_signal_handler(sig,_grace)
+        try: loop.add_signal_handler(sig,stop.set)
         except NotImplementedError: pass
 
 async def main():
@@ -2429,18 +2471,38 @@ async def main():
         try: dp.include_router(autobook_router); log.info("Autobook router включён.")
         except Exception as e: log.warning("include_router fail: %s", e)
     scheduler=setup_scheduler(); _try_register_supply_scheduler(scheduler); scheduler.start()
-    _register_signal_handlers(asyncio.get_running_loop(),scheduler)
+    stop=asyncio.Event()
+    _register_signal_handlers(asyncio.get_running_loop(),stop)
     log.info("Starting polling... Version=%s MOCK_MODE=%s ALLOWED_IDS=%s ALLOWED_USERS=%s",
              VERSION, MOCK_MODE,
              ",".join(str(x) for x in sorted(ALLOWED_USER_IDS)) or "-",
              ",".join(sorted(ALLOWED_USERNAMES)) or "-")
+    poll_task=asyncio.create_task(dp.start_polling(bot, allowed_updates=None, handle_signals=False))
+    stop_task=asyncio.create_task(stop.wait())
     try:
-        await dp.start_polling(bot, allowed_updates=None)
+        await asyncio.wait((poll_task,stop_task),return_when=asyncio.FIRST_COMPLETED)
+        if poll_task.done(): poll_task.result()
     finally:
+        stop_task.cancel()
+        if not poll_task.done():
+            poll_task.cancel()
+            try: await poll_task
+            except (asyncio.CancelledError, Exception): pass
         try: scheduler.shutdown(wait=False)
         except Exception: pass
+        # Отложенная запись задач (mark_dirty) не должна теряться при остановке
+        if sw is not None:
+            try: await sw.close_http_client()
+            except Exception: log.exception("supply_watch close failed")
+        try: await bot.session.close()
+        except Exception: pass
 
 if __name__ == "__main__":
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
@@ -13,15 +13,40 @@ register_order_fill_handlers(dp, notify_text, supply_watch_module)
 Где:
 - dp — Dispatcher aiogram
 - notify_text(chat_id: int, text: str) — async функция отправки текста
-- supply_watch_module — импортированный модуль supply_watch (чтобы обратиться к async set_order_vehicle_from_chat/ set_order_contact_from_chat / update_task / list_tasks)
+- supply_watch_module — импортированный модуль supply_watch (чтобы обратиться к async set_order_vehicle_from_chat/ set_order_contact_from_chat / mark_dirty / resolve_short_id)
 """
 
 import re
+from functools import lru_cache
 from typing import Callable, Awaitable, Any, Optional
 
 from aiogram import types, Dispatcher
 
 TASK_ID_RE = re.compile(r"^[0-9a-fA-F\-]{8,}$")
+# Без якорей ^…$: применяются через fullmatch к уже обрезанному strip() тексту
+VEHICLE_RE = re.compile(r"ТРАНСПОРТ\s+(\S+)\s+(.+)", re.IGNORECASE)
+CONTACT_RE = re.compile(r"КОНТАКТ\s+(\S+)\s+(\+?[0-9\-\s\(\)]{6,})\s*(.*)", re.IGNORECASE)
+VEHICLE_PREFIX = "ТРАНСПОРТ "
+CONTACT_PREFIX = "КОНТАКТ "
+VEHICLE_USAGE = "Формат: ТРАНСПОРТ <task_id|short> <госномер и описание>"
+CONTACT_USAGE = "Формат: КОНТАКТ <task_id|short> <телефон> [Имя]"
+# Кратчайшие строки, которые вообще могут совпасть: "ТРАНСПОРТ t x" и "КОНТАКТ t 123456"
+_VEHICLE_MIN_LEN = len(VEHICLE_PREFIX) + 3
+_CONTACT_MIN_LEN = len(CONTACT_PREFIX) + 2 + 6
+
+def _order_fill_kind(text: Optional[str]) -> Optional[str]:
+    """
+    Какой из префиксов (ТРАНСПОРТ/КОНТАКТ) у сообщения.
+    upper() делается только по голове строки длиной с самый длинный префикс.
+    """
+    if not text:
+        return None
+    head = text.lstrip()[:len(VEHICLE_PREFIX)].upper()
+    if head.startswith(VEHICLE_PREFIX):
+        return VEHICLE_PREFIX
+    if head.startswith(CONTACT_PREFIX):
+        return CONTACT_PREFIX
+    return None
 
 def _resolve_task_id(sw, token: str) -> Optional[str]:
     """
@@ -32,12 +57,13 @@ def _resolve_task_id(sw, token: str) -> Optional[str]:
     if TASK_ID_RE.match(token) and "-" in token and len(token) > 12:
         # полный uuid
         return token
-    # иначе ищем по short
-    for t in sw.list_tasks():
-        tid = t.get("id", "")
-        if tid and tid.split("-")[0] == token:
-            return tid
-    return None
+    # иначе ищем по short через индекс supply_watch
+    return sw.resolve_short_id(token)
+
+@lru_cache(maxsize=1)
+def _get_api(sw, client_id: str, api_key: str, timeout: int):
+    """Один OzonApi на набор ключей; HTTP-пул внутри supply_watch и так общий."""
+    return sw.OzonApi(client_id, api_key, timeout=timeout)
 
 def register_order_fill_handlers(dp: Dispatcher, notify_text: Callable[[int, str], Awaitable[Any]], sw) -> None:
     """
@@ -73,22 +99,21 @@ def register_order_fill_handlers(dp: Dispatcher, notify_text: Callable[[int, str
             await message.reply("Не найдено окно для проставления.")
             return
 
-        api = sw.OzonApi(sw.OZON_CLIENT_ID, sw.OZON_API_KEY, timeout=sw.API_TIMEOUT_SECONDS)
+        api = _get_api(sw, sw.OZON_CLIENT_ID, sw.OZON_API_KEY, sw.API_TIMEOUT_SECONDS)
         ok, err, status = await sw.api_supply_order_timeslot_set(api, t["order_id"], fr, to)
         if ok:
             t["order_timeslot_set_ok"] = True
-            sw.update_task(t)
+            sw.mark_dirty(t)
             await message.reply(f"Тайм-слот установлен. Продолжаю опрос заявки…")
         else:
             await message.reply(f"Не удалось установить тайм-слот: {err or status}")
 
-    @dp.message_handler(lambda m: m.text and m.text.strip().upper().startswith("ТРАНСПОРТ "))
     async def msg_vehicle(message: types.Message):
         text = message.text.strip()
         # Формат: ТРАНСПОРТ <task_id|short> <любой текст после>
-        m = re.match(r"^(?i:ТРАНСПОРТ)\s+(\S+)\s+(.+)$", text)
+        m = VEHICLE_RE.fullmatch(text) if len(text) >= _VEHICLE_MIN_LEN else None
         if not m:
-            await message.reply("Формат: ТРАНСПОРТ <task_id|short> <госномер и описание>")
+            await message.reply(VEHICLE_USAGE)
             return
         token = m.group(1)
         veh_text = m.group(2).strip()
@@ -102,13 +127,12 @@ def register_order_fill_handlers(dp: Dispatcher, notify_text: Callable[[int, str
         else:
             await message.reply(f"Не удалось сохранить транспорт: {msg}")
 
-    @dp.message_handler(lambda m: m.text and m.text.strip().upper().startswith("КОНТАКТ "))
     async def msg_contact(message: types.Message):
         text = message.text.strip()
         # Формат: КОНТАКТ <task_id|short> <телефон> [Имя ...]
-        m = re.match(r"^(?i:КОНТАКТ)\s+(\S+)\s+(\+?[0-9\-\s\(\)]{6,})\s*(.*)$", text)
+        m = CONTACT_RE.fullmatch(text) if len(text) >= _CONTACT_MIN_LEN else None
         if not m:
-            await message.reply("Формат: КОНТАКТ <task_id|short> <телефон> [Имя]")
+            await message.reply(CONTACT_USAGE)
             return
         token = m.group(1)
         phone = m.group(2).strip()
@@ -121,4 +145,12 @@ def register_order_fill_handlers(dp: Dispatcher, notify_text: Callable[[int, str
         if ok:
             await message.reply("Контакт принят. Ждём подтверждение от Ozon.")
         else:
-            await message.reply(f"Не удалось сохранить контакт: {msg}")
\ No newline at end of file
+            await message.reply(f"Не удалось сохранить контакт: {msg}")
+
+    # Один фильтр на оба формата вместо двух, проверяемых на каждом сообщении
+    @dp.message_handler(lambda m: _order_fill_kind(m.text) is not None)
+    async def msg_order_fill(message: types.Message):
+        if _order_fill_kind(message.text) == VEHICLE_PREFIX:
+            await msg_vehicle(message)
+        else:
+            await msg_contact(message)
@@ -1,17 +1,35 @@
 import os
 import sys
 import json
-import time
+import asyncio
 import argparse
 from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Any, Tuple, Optional
 
 import httpx
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import h2  # noqa: F401  (нужен httpx для http2=True)
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+
 UFA_CROSSDOCK_ID = 1020001836368000  # УФА_РФЦ_КРОССДОКИНГ
 
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+MAX_RETRIES = 5
+# Задержки бэкоффа считаются один раз: 1.5, 3, 6, 10, 10 с
+_BACKOFF_DELAYS = tuple(min(10.0, 1.5 * (2 ** i)) for i in range(MAX_RETRIES))
+
 def as_utc_iso(dt: datetime) -> str:
-    return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
 def compute_window_utc(days: int) -> Tuple[str, str]:
     now = datetime.now(timezone.utc)
@@ -19,35 +37,45 @@ def compute_window_utc(days: int) -> Tuple[str, str]:
     end = start + timedelta(days=days) - timedelta(seconds=1)
     return as_utc_iso(start), as_utc_iso(end)
 
+def _to_int(v: Any) -> Optional[int]:
+    """int(v) для целых и десятичных строк; None вместо исключения на мусоре."""
+    if isinstance(v, int):
+        return v
+    if isinstance(v, str):
+        v = v.strip()
+        digits = v[1:] if v[:1] in ("+", "-") else v
+        return int(v) if digits.isdecimal() else None
+    if isinstance(v, float) and v.is_integer():
+        return int(v)
+    return None
+
 def summarize_dropoffs(resp: Dict[str, Any]) -> List[Tuple[int, int]]:
     arr = resp.get("drop_off_warehouse_timeslots") or []
     out: List[Tuple[int, int]] = []
     for it in arr:
-        did = it.get("drop_off_warehouse_id")
-        try:
-            did = int(did)
-        except Exception:
+        did = _to_int(it.get("drop_off_warehouse_id"))
+        if did is None:
             continue
         days = it.get("days") or []
         out.append((did, len(days) if isinstance(days, list) else 0))
     return out
 
 def has_ufa_drop(resp: Dict[str, Any], require_positive_days: bool) -> bool:
-    for did, cnt in summarize_dropoffs(resp):
-        if did == UFA_CROSSDOCK_ID:
-            return (cnt > 0) if require_positive_days else True
+    # Один проход с выходом на первом совпадении; полная сводка строится только для положительных ответов
+    for it in resp.get("drop_off_warehouse_timeslots") or []:
+        if _to_int(it.get("drop_off_warehouse_id")) == UFA_CROSSDOCK_ID:
+            if not require_positive_days:
+                return True
+            days = it.get("days") or []
+            return isinstance(days, list) and len(days) > 0
     return False
 
 def parse_ids_csv(s: str) -> List[int]:
     out: List[int] = []
     for p in (s or "").split(","):
-        p = p.strip()
-        if not p:
-            continue
-        try:
-            out.append(int(p))
-        except Exception:
-            pass
+        v = _to_int(p)
+        if v is not None:
+            out.append(v)
     return out
 
 def load_dest_ids_from_env_map() -> List[int]:
@@ -57,16 +85,73 @@ def load_dest_ids_from_env_map() -> List[int]:
         if "=" not in pair:
             continue
         _, val = pair.split("=", 1)
-        val = val.strip()
-        try:
-            ids.append(int(val))
-        except Exception:
-            pass
+        v = _to_int(val)
+        if v is not None:
+            ids.append(v)
     return ids
 
-def backoff_sleep(attempt: int, base: float = 1.5, cap: float = 10.0) -> None:
-    delay = min(cap, base * (2 ** (attempt - 1)))
-    time.sleep(delay)
+async def backoff_sleep(attempt: int) -> None:
+    await asyncio.sleep(_BACKOFF_DELAYS[min(attempt, MAX_RETRIES) - 1])
+
+async def probe_destination(
+    http: httpx.AsyncClient,
+    sem: asyncio.Semaphore,
+    url: str,
+    draft_id: int,
+    df: str,
+    dt: str,
+    wid: int,
+    require_positive_days: bool,
+) -> Tuple[int, Optional[Dict[str, Any]]]:
+    body = {
+        "draft_id": draft_id,
+        "date_from": df,
+        "date_to": dt,
+        "warehouse_ids": [int(wid)],
+    }
+
+    # Семафор держим и на время бэкоффа, чтобы при 429 не добавлять нагрузку
+    async with sem:
+        attempts = 0
+        while True:
+            attempts += 1
+            r = await http.post(url, json=body)
+            if r.status_code in RETRY_STATUSES and attempts <= MAX_RETRIES:
+                await backoff_sleep(attempts)
+                continue
+            break
+
+    if r.status_code != 200:
+        return wid, None
+
+    data = _json_loads(r.content)
+    if not has_ufa_drop(data, require_positive_days):
+        return wid, None
+    days_map = {did: cnt for did, cnt in summarize_dropoffs(data)}
+    return wid, {
+        "destination_id": wid,
+        "ufa_offered": True,
+        "ufa_days": days_map.get(UFA_CROSSDOCK_ID, 0),
+        "all_dropoffs": days_map,
+    }
+
+async def probe_all(
+    headers: Dict[str, str],
+    url: str,
+    draft_id: int,
+    df: str,
+    dt: str,
+    dest_ids: List[int],
+    require_positive_days: bool,
+    concurrency: int,
+) -> List[Tuple[int, Optional[Dict[str, Any]]]]:
+    sem = asyncio.Semaphore(max(1, concurrency))
+    limits = httpx.Limits(max_connections=max(1, concurrency), max_keepalive_connections=10, keepalive_expiry=30)
+    async with httpx.AsyncClient(headers=headers, timeout=20, http2=_HTTP2, limits=limits) as http:
+        return await asyncio.gather(*(
+            probe_destination(http, sem, url, draft_id, df, dt, wid, require_positive_days)
+            for wid in dest_ids
+        ))
 
 def main():
     ap = argparse.ArgumentParser(description="Discover destinations that offer drop-off UFA_CROSSDOCK in OZON.")
@@ -74,6 +159,7 @@ def main():
     ap.add_argument("--dest-ids", type=str, default="", help="CSV of destination warehouse_ids to probe")
     ap.add_argument("--days", type=int, default=7, help="Horizon in days from tomorrow 00:00 UTC")
     ap.add_argument("--require-positive-days", action="store_true", help="If set, require days>0 (not just presence)")
+    ap.add_argument("--concurrency", type=int, default=8, help="Max parallel timeslot/info requests")
     args = ap.parse_args()
 
     client_id = os.getenv("OZON_CLIENT_ID", "").strip()
@@ -85,6 +171,8 @@ def main():
     dest_ids = parse_ids_csv(args.dest_ids)
     if not dest_ids:
         dest_ids = load_dest_ids_from_env_map()
+    # Дубликаты в --dest-ids/SUPPLY_WAREHOUSE_MAP не должны стоить лишних запросов; порядок сохраняем
+    dest_ids = list(dict.fromkeys(dest_ids))
     if not dest_ids:
         print("No destination ids provided (use --dest-ids or SUPPLY_WAREHOUSE_MAP).", file=sys.stderr)
         sys.exit(2)
@@ -101,39 +189,14 @@ def main():
     offered: List[Dict[str, Any]] = []
     not_offered: List[int] = []
 
-    with httpx.Client(headers=headers, timeout=20) as http:
-        for wid in dest_ids:
-            body = {
-                "draft_id": args.draft_id,
-                "date_from": df,
-                "date_to": dt,
-                "warehouse_ids": [int(wid)],
-            }
-
-            attempts = 0
-            while True:
-                attempts += 1
-                r = http.post(url, json=body)
-                if r.status_code in (429, 500, 502, 503, 504) and attempts <= 5:
-                    backoff_sleep(attempts)
-                    continue
-                break
-
-            if r.status_code != 200:
-                not_offered.append(wid)
-                continue
-
-            data = r.json()
-            if has_ufa_drop(data, args.require_positive_days):
-                days_map = {did: cnt for did, cnt in summarize_dropoffs(data)}
-                offered.append({
-                    "destination_id": wid,
-                    "ufa_offered": True,
-                    "ufa_days": days_map.get(UFA_CROSSDOCK_ID, 0),
-                    "all_dropoffs": days_map,
-                })
-            else:
-                not_offered.append(wid)
+    results = asyncio.run(probe_all(
+        headers, url, args.draft_id, df, dt, dest_ids, args.require_positive_days, args.concurrency,
+    ))
+    for wid, info in results:
+        if info is None:
+            not_offered.append(wid)
+        else:
+            offered.append(info)
 
     result = {
         "draft_id": args.draft_id,
@@ -143,7 +206,14 @@ def main():
         "offered_destinations": offered,
         "not_offered_destinations": not_offered,
     }
-    print(json.dumps(result, ensure_ascii=False, indent=2))
+    if orjson is not None:
+        # all_dropoffs использует int-ключи — для orjson нужен OPT_NON_STR_KEYS
+        sys.stdout.buffer.write(orjson.dumps(
+            result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE,
+        ))
+        sys.stdout.flush()
+    else:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
 
 if __name__ == "__main__":
     main()
@@ -9,8 +9,12 @@ import os
 os.environ["AUTO_BOOK"] = "0"
 
 # Базовые дефолты (можете переопределить в .env)
-os.environ.setdefault("DATA_DIR", "/app/data")
-os.environ.setdefault("TIMEZONE", "Asia/Yekaterinburg")
+_DEFAULTS = {
+    "DATA_DIR": "/app/data",
+    "TIMEZONE": "Asia/Yekaterinburg",
+}
+for _k, _v in _DEFAULTS.items():
+    os.environ.setdefault(_k, _v)
 
 # Не фиксируем секунду слота, чтобы работала авто-ротация (можно разкомментировать временно)
 # os.environ.setdefault("OZON_CREATE_SLOT_SEC", "11")
\ No newline at end of file
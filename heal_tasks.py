@@ -1,34 +1,48 @@
 # Выполнить внутри контейнера: python -u heal_tasks.py
 import json, os, time, sys
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 data_dir = os.getenv("DATA_DIR", "/app/data")
 path = os.path.join(data_dir, "supply_tasks.json")
 now = int(time.time())
 changed = 0
 
 try:
-    with open(path, "r", encoding="utf-8") as f:
-        tasks = json.load(f)
+    with open(path, "rb") as f:
+        raw = f.read()
+    tasks = orjson.loads(raw) if orjson is not None else json.loads(raw)
 except Exception as e:
     print("Cannot read", path, e)
     sys.exit(1)
 
+STUCK_STATES = frozenset(("SUPPLY_CREATING", "CARGO_CREATING", "LABELS_CREATING"))
+
 for t in tasks:
-    st = str(t.get("status") or "").upper()
-    if st in ("SUPPLY_CREATING", "CARGO_CREATING", "LABELS_CREATING"):
-        if t.get("creating") is True:
-            # Сбрасываем застрявший флаг и таймеры, чтобы тик сразу взял задачу
-            t["creating"] = False
-            t.pop("creating_since_ts", None)
-            t["next_attempt_ts"] = 0
-            t["retry_after_ts"] = 0
-            t["updated_ts"] = now
-            changed += 1
+    # Флаг creating стоит у единиц задач — проверяем его первым и не трогаем статус у остальных
+    if t.get("creating") is not True:
+        continue
+    st = t.get("status")
+    if st and str(st).upper() in STUCK_STATES:
+        # Сбрасываем застрявший флаг и таймеры, чтобы тик сразу взял задачу
+        t["creating"] = False
+        t.pop("creating_since_ts", None)
+        t["next_attempt_ts"] = 0
+        t["retry_after_ts"] = 0
+        t["updated_ts"] = now
+        changed += 1
 
 if changed:
     tmp = path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(tasks, f, ensure_ascii=False, indent=2)
+    if orjson is not None:
+        out = orjson.dumps(tasks, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    else:
+        out = json.dumps(tasks, ensure_ascii=False, indent=2).encode("utf-8")
+    with open(tmp, "wb") as f:
+        f.write(out)
     os.replace(tmp, path)
 
-print(f"healed creating flags: {changed}")
\ No newline at end of file
+print(f"healed creating flags: {changed}")
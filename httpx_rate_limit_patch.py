@@ -4,8 +4,10 @@ httpx_rate_limit_patch
 Анти-429 патч для httpx с «лёгкими» дефолтами и жёстким ограничением внутренних ожиданий.
 
 Что делает:
-- Каппирует любые внутренние ожидания (preflight, limiter, create-gate, avoid-second) RL_MAX_SLEEP_SEC (по умолчанию 1.0s).
-- На 429 использует Retry-After, но с потолком RL_MAX_RETRY_AFTER_SEC (по умолчанию 6s) и выставляет пенальти у хоста.
+- Каппирует внутренние ожидания перед запросом (preflight, limiter, create-gate, avoid-second) RL_MAX_SLEEP_SEC (по умолчанию 1.0s).
+- На 429 выставляет пенальти у хоста (Retry-After с потолком RL_MAX_RETRY_AFTER_SEC, по умолчанию 6s) и сам
+  повторяет запрос до RL_MAX_429_RETRIES раз. Эти паузы под RL_MAX_SLEEP_SEC не попадают: на один вызов
+  может уйти до RL_MAX_429_RETRIES × RL_MAX_RETRY_AFTER_SEC (+25% джиттера) ожидания.
 - Поддерживает «create-gate» (межпроцессно синхронизированный слот) для эндпоинтов создания.
 - «Секунду создателя» можно защищать от параллельных не-create запросов (опционально).
 - По умолчанию поведение лёгкое: create-gate выключен, задержки минимальны.
@@ -19,24 +21,43 @@ httpx_rate_limit_patch
 
 ENV ключи (важные):
 - RL_DISABLE_CREATE_GATE (default: 1/True) — выключить межпроцессной create-gate.
-- RL_MAX_SLEEP_SEC (default: 1.0) — кап на любые ожидания внутри патча.
+- RL_MAX_SLEEP_SEC (default: 1.0) — кап на ожидания перед запросом (паузы повторов после 429 — отдельно, см. ниже).
 - RL_MAX_CREATE_WAIT_MS (default: 750) — максимум для create-gate ожидания.
 - RL_MAX_RETRY_AFTER_SEC (default: 6.0) — кап для Retry-After/пенальти.
+- RL_MAX_429_RETRIES (default: 3) — сколько раз патч сам повторяет запрос после 429.
+  Retry-After сервера выдерживаем полностью (джиттер только вверх, ×1.0–1.25); если он больше
+  RL_MAX_RETRY_AFTER_SEC — не повторяем и отдаём 429. Без Retry-After — 1,2,4…с (кап
+  RL_MAX_RETRY_AFTER_SEC, джиттер ×0.5–1.0).
 - OZON_RPM (default: 8), OZON_BURST (default: 1) — базовые лимиты в секунду/окно.
 - OZON_PER_SECOND_COOLDOWN_SEC (default: 0.5) — базовая прослойка между запросами.
+- OZON_RPM__<route> (например OZON_RPM__v1_product=30) — отдельный лимитер для маршрута
+  /v1/product (первые два сегмента пути, «_» → «/»); прочие маршруты делят лимитер хоста.
+- OZON_ADAPTIVE_RATE (default: True) — AIMD: после 429 интервал лимитера хоста удваивается
+  (не больше ×10 от OZON_RPM), на каждом 2xx темп плавно возвращается к OZON_RPM.
+- OZON_SHARED_BUCKET (default: False) — один лимитер хоста на все процессы машины
+  (состояние в mmap-файле в DATA_DIR под flock), а не по лимитеру на процесс.
+- OZON_START_PHASE_JITTER (default: False) — случайная фаза старта лимитера хоста, чтобы
+  одновременно запущенные воркеры не слали первый запрос в один момент.
 - AVOID_CREATE_SECOND_FOR_OTHERS (default: False) — избегать «секунды создателя» для прочих запросов.
 """
 from __future__ import annotations
 
 import asyncio
+import calendar
+import heapq
 import time
 import os
+import sys
 import json
 import random
 import logging
-from collections import deque
+import mmap
+import re
+import struct
+import threading
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Set, Any, Optional, Tuple, List
+from typing import Dict, FrozenSet, Any, Mapping, Optional, Tuple, List
 from urllib.parse import urlparse
 from email.utils import parsedate_to_datetime
 
@@ -47,6 +68,10 @@ try:
 except Exception:
     fcntl = None
 
+_log = logging.getLogger("httpx_rate_limit_patch")
+# Свой генератор: слоты/стаггер не делят состояние с глобальным random остального кода
+_rng = random.Random()
+
 # ================== ENV HELPERS ==================
 
 def _getenv_str(n: str, d: str = "") -> str:
@@ -85,9 +110,16 @@ def _getenv_bool(n: str, d: bool = False) -> bool:
 DATA_DIR = Path(_getenv_str("DATA_DIR", "./data")).resolve()
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 
-OZON_DOMAINS: Set[str] = set(
-    s.strip() for s in _getenv_str("OZON_DOMAINS", "api-seller.ozon.ru").split(",") if s.strip()
+# Хосты из httpx.URL всегда в нижнем регистре — нормализуем список один раз здесь
+OZON_DOMAINS: FrozenSet[str] = frozenset(
+    s.strip().lower() for s in _getenv_str("OZON_DOMAINS", "api-seller.ozon.ru").split(",") if s.strip()
 )
+# Пустой OZON_DOMAINS = отслеживаем все хосты; считаем один раз, а не на каждый запрос
+_TRACK_ALL = not OZON_DOMAINS
+# Типовой деплой — один домен: интернируем его, чтобы сравнивать по identity
+_SINGLE_DOMAIN: Optional[str] = sys.intern(next(iter(OZON_DOMAINS))) if len(OZON_DOMAINS) == 1 else None
+# Быстрый отсев чужих строковых URL одним str.startswith(tuple) — без разбора
+_OZON_URL_PREFIXES: Tuple[str, ...] = tuple(f"{scheme}://{d}" for d in sorted(OZON_DOMAINS) for scheme in ("https", "http"))
 
 RPM = _getenv_int("OZON_RPM", 8)
 BURST = max(1, _getenv_int("OZON_BURST", 1))
@@ -99,6 +131,10 @@ CREATE_GAP = max(0.0, _getenv_float("OZON_CREATE_ENDPOINT_MIN_GAP_SEC", 0.0))
 # Доп. параметры ожиданий
 ALIGN_SECOND_BOUNDARY = _getenv_bool("OZON_ALIGN_SECOND_BOUNDARY", False)
 JITTER_MS = max(0, _getenv_int("OZON_JITTER_MS", 0))
+START_PHASE_JITTER = _getenv_bool("OZON_START_PHASE_JITTER", False)
+ADAPTIVE_RATE = _getenv_bool("OZON_ADAPTIVE_RATE", True)
+SHARED_BUCKET = _getenv_bool("OZON_SHARED_BUCKET", False)
+_JITTER_SEC = JITTER_MS / 1000.0
 
 CREATE_SLOT_ENV = os.getenv("OZON_CREATE_SLOT_SEC", "").strip()
 CREATE_SLOT_OFFSET_MS = max(0, _getenv_int("OZON_CREATE_SLOT_OFFSET_MS", 0))
@@ -112,32 +148,40 @@ FORCE_ROTATE_ON429 = _getenv_bool("OZON_CREATE_FORCE_ROTATE_ON429", False)
 # Защита "секунды создающих" для прочих запросов (по умолчанию выключена)
 AVOID_CREATE_SECOND_FOR_OTHERS = _getenv_bool("AVOID_CREATE_SECOND_FOR_OTHERS", False)
 AVOID_MARGIN_MS = max(0, _getenv_int("AVOID_MARGIN_MS", 50))
+_AVOID_MARGIN_SEC = AVOID_MARGIN_MS / 1000.0
 
 # Новые ограничения ожиданий
 RL_DISABLE_CREATE_GATE = _getenv_bool("RL_DISABLE_CREATE_GATE", True)
 RL_MAX_CREATE_WAIT_MS = max(0, _getenv_int("RL_MAX_CREATE_WAIT_MS", 750))
+_RL_MAX_CREATE_WAIT_SEC = RL_MAX_CREATE_WAIT_MS / 1000.0
 RL_MAX_SLEEP_SEC = max(0, _getenv_float("RL_MAX_SLEEP_SEC", 1.0))
+_RL_MAX_SLEEP_NS = int(RL_MAX_SLEEP_SEC * 1e9)
 RL_MAX_RETRY_AFTER_SEC = max(0, _getenv_float("RL_MAX_RETRY_AFTER_SEC", 6.0))
+RL_MAX_429_RETRIES = max(0, _getenv_int("RL_MAX_429_RETRIES", 3))
+
+def _build_backoff_429() -> Tuple[float, ...]:
+    # База ожидания до jitter для попытки N, когда сервер не прислал Retry-After
+    return tuple(min(RL_MAX_RETRY_AFTER_SEC, max(float(1 << min(a, 30)), PER_SECOND_COOLDOWN)) for a in range(RL_MAX_429_RETRIES + 1))
+
+_BACKOFF_429 = _build_backoff_429()
 
 # Эндпоинты "создания"
-CREATE_ENDPOINTS: Set[str] = {
+CREATE_ENDPOINTS: FrozenSet[str] = frozenset((
     "/v1/draft/create",
     "/v1/draft/supply/create",
     "/v1/cargoes/create",
     "/v1/cargoes-label/create",
-}
+))
 
 # Расширяемый список create-эндпоинтов из ENV (через запятую)
 _extra_create = [s.strip() for s in _getenv_str("OZON_EXTRA_CREATE_ENDPOINTS", "").split(",") if s.strip()]
 if _extra_create:
-    CREATE_ENDPOINTS |= set(_extra_create)
+    CREATE_ENDPOINTS |= frozenset(_extra_create)
 
 # ================== УТИЛИТЫ ==================
 
 def _is_tracked_domain(host: str) -> bool:
-    if not OZON_DOMAINS:
-        return True
-    return host in OZON_DOMAINS
+    return _TRACK_ALL or host is _SINGLE_DOMAIN or host in OZON_DOMAINS
 
 def _path_of(url: str) -> str:
     try:
@@ -157,33 +201,153 @@ def _host_of(url: str) -> str:
         except Exception:
             return ""
 
+@lru_cache(maxsize=2048)
+def _parse_url_cached(url_str: str) -> Tuple[httpx.URL, str, str, bool]:
+    # Один разбор на уникальную строку; httpx.URL неизменяем, его можно отдавать повторно
+    u = httpx.URL(url_str)
+    host = sys.intern(u.host or "")
+    return u, host, u.path or "/", _is_tracked_domain(host)
+
+def _url_parts(url: Any) -> Tuple[Any, str, str, bool]:
+    """
+    (url, host, path, tracked). url приводится к httpx.URL, чтобы оригинальный
+    request не разбирал строку повторно. Неразборный url отдаём как есть —
+    ошибку поднимет сам httpx.
+    """
+    if isinstance(url, httpx.URL):
+        host = url.host or ""
+        return url, host, url.path or "/", _is_tracked_domain(host)
+    url_str = url if isinstance(url, str) else str(url)
+    if not _TRACK_ALL and not url_str.startswith(_OZON_URL_PREFIXES):
+        # Префикс не совпал буквально: HTTPS://API-SELLER..., https://user@host — домен
+        # всё равно в строке; такие (редкие) URL разбираем целиком, остальное отсеиваем
+        low = url_str.lower()
+        if not any(d in low for d in OZON_DOMAINS):
+            return url, "", "/", False
+    try:
+        return _parse_url_cached(url_str)
+    except Exception:
+        host = _host_of(url_str)
+        return url, host, _path_of(url_str), _is_tracked_domain(host)
+
 def _clamped_sleep_seconds(wait: float) -> float:
     # Возвращаем фактическое время сна (с учётом RL_MAX_SLEEP_SEC)
     return max(0.0, min(float(wait), float(RL_MAX_SLEEP_SEC)))
 
-def _retry_after_seconds(resp: httpx.Response) -> float:
-    # Минимум — PER_SECOND_COOLDOWN, максимум — RL_MAX_RETRY_AFTER_SEC
-    ra: Optional[float] = None
+def _date_header_second(date_hdr: str) -> int:
+    # IMF-fixdate ("Sun, 06 Nov 1994 08:49:37 GMT"): секунды всегда в [23:25]
+    if len(date_hdr) == 29 and date_hdr[22] == ":":
+        try:
+            return int(date_hdr[23:25])
+        except ValueError:
+            pass
+    return parsedate_to_datetime(date_hdr).second
+
+def _http_date_delay(v: str) -> Optional[float]:
+    # Секунды до HTTP-date; IMF-fixdate через strptime, прочие форматы — через email.utils
     try:
-        v = resp.headers.get("Retry-After")
-        if v and str(v).strip().isdigit():
-            ra = float(int(v))
-    except Exception:
+        ts = float(calendar.timegm(time.strptime(v.strip(), "%a, %d %b %Y %H:%M:%S GMT")))
+    except ValueError:
+        try:
+            ts = parsedate_to_datetime(v).timestamp()
+        except Exception:
+            return None
+    return max(0.0, ts - time.time())
+
+_RESET_KEYS = frozenset((b"x-ratelimit-reset", b"x-ratelimit-reset-after", b"ratelimit-reset"))
+
+def _retry_after_raw(resp: httpx.Response) -> Optional[float]:
+    """
+    Задержка от сервера в секундах или None. Один проход по сырым заголовкам:
+    Retry-After (RFC 7231: delta-seconds или HTTP-date) в приоритете, иначе *-RateLimit-Reset
+    (секунды или epoch, если значение > 10000).
+    """
+    ra_val: Optional[bytes] = None
+    reset_val: Optional[bytes] = None
+    for name, val in resp.headers.raw:
+        lname = name.lower()
+        if lname == b"retry-after":
+            ra_val = val
+            break
+        if reset_val is None and lname in _RESET_KEYS:
+            reset_val = val
+    ra: Optional[float] = None
+    if ra_val is not None:
+        try:
+            ra = float(ra_val)
+        except ValueError:
+            ra = _http_date_delay(ra_val.decode("latin-1"))
+    elif reset_val is not None:
+        try:
+            ra = float(reset_val)
+        except ValueError:
+            return None
+        if ra > 10_000:
+            ra -= time.time()
+    if ra is not None and not ra >= 0.0:  # nan/отрицательные
         ra = None
+    return ra
+
+def _retry_after_seconds(resp: httpx.Response) -> float:
+    # Минимум — PER_SECOND_COOLDOWN, максимум — RL_MAX_RETRY_AFTER_SEC
+    ra = _retry_after_raw(resp)
     base = PER_SECOND_COOLDOWN
     if ra is None:
         return min(max(base, 0.0), RL_MAX_RETRY_AFTER_SEC)
     return min(max(ra, base), RL_MAX_RETRY_AFTER_SEC)
 
+def _retry_429_wait(resp: httpx.Response, attempt: int) -> Tuple[Optional[float], bool]:
+    # Возвращает (ожидание, пришла ли пауза от сервера); ожидание None — не повторяем.
+    # Без Retry-After — свои 1,2,4…с с джиттером ×0.5–1.0 против «стада».
+    ra = _retry_after_raw(resp)
+    if ra is None:
+        base = _BACKOFF_429[min(attempt, len(_BACKOFF_429) - 1)]
+        return base * (0.5 + 0.5 * _rng.random()), False
+    # Паузу сервера не укорачиваем: джиттер только вверх, а дольше RL_MAX_RETRY_AFTER_SEC
+    # не ждём вовсе — 429 уходит вызывающему коду
+    if ra > RL_MAX_RETRY_AFTER_SEC:
+        return None, True
+    return max(ra, PER_SECOND_COOLDOWN) * (1.0 + 0.25 * _rng.random()), True
+
+def _is_replayable(kwargs: Dict[str, Any]) -> bool:
+    # Повторять можно, только если тело запроса можно отправить ещё раз.
+    # data= с генератором/итератором/файлом httpx стримит так же, как content= — второй раз его не прочесть
+    if kwargs.get("files") is not None:
+        return False
+    data = kwargs.get("data")
+    if data is not None and not isinstance(data, (Mapping, bytes, str)):
+        return False
+    content = kwargs.get("content")
+    return content is None or isinstance(content, (bytes, str))
+
 # ================== МЕЖПРОЦЕССНЫЙ CREATE-GATE ==================
 
+_ALL_SLOTS_MASK = (1 << 60) - 1
+
 class _CrossProcCreateGate:
     state_file = DATA_DIR / ".supw_create_gate.json"
     lock_file = DATA_DIR / ".supw_create_gate.lock"
+    # Готовые строки путей для os.open/os.replace
+    _state_path = str(state_file)
+    _tmp_path = str(state_file.with_suffix(".tmp"))
     _first_create_done = False
+    # In-memory копия state-файла: перечитываем только при смене mtime, пишем не чаще _FLUSH_INTERVAL_SEC
+    _state_cache: Dict[str, Any] = {}
+    _state_mtime_ns: int = 0
+    _dirty: bool = False
+    _last_flush: float = 0.0
+    _FLUSH_INTERVAL_SEC = 0.25
+    # Файлы проверены/созданы; сбрасывается, если запись state упала с FileNotFoundError
+    _files_ready = False
+    # Основная конкуренция — внутри процесса (потоки to_thread); flock берём уже после него
+    _proc_lock = threading.Lock()
+    # Хвост очереди async-ожиданий по группе (см. wait)
+    _inflight: Dict[str, "asyncio.Future[None]"] = {}
 
     @classmethod
     def _ensure_files(cls):
+        if cls._files_ready:
+            return
         cls.state_file.parent.mkdir(parents=True, exist_ok=True)
         if not cls.state_file.exists():
             try:
@@ -195,21 +359,91 @@ class _CrossProcCreateGate:
                 cls.lock_file.write_text("", encoding="utf-8")
             except Exception:
                 pass
+        cls._files_ready = True
 
     @classmethod
-    def _load_state(cls) -> Dict[str, Any]:
+    def _get_state(cls) -> Dict[str, Any]:
+        # Вызывать под flock. Файл не менялся — отдаём кэш; поменялся — перечитываем,
+        # а при своих несохранённых правках сливаем с ним (см. _merge_disk_state)
         try:
-            raw = cls.state_file.read_text(encoding="utf-8")
-            js = json.loads(raw or "{}")
-            return js if isinstance(js, dict) else {}
-        except Exception:
-            return {}
+            mtime_ns = os.stat(cls._state_path).st_mtime_ns
+        except OSError:
+            return cls._state_cache
+        if mtime_ns != cls._state_mtime_ns:
+            try:
+                js = json.loads(cls.state_file.read_text(encoding="utf-8") or "{}")
+            except Exception:
+                js = {}
+            js = js if isinstance(js, dict) else {}
+            if cls._dirty:
+                cls._merge_disk_state(js)
+            else:
+                cls._state_cache = js
+            cls._state_mtime_ns = mtime_ns
+        return cls._state_cache
+
+    @classmethod
+    def _merge_disk_state(cls, disk: Dict[str, Any]) -> None:
+        # Другой процесс записал файл, пока наши правки ждали сброса: не затираем его, а объединяем —
+        # блэклист по секундам (дальний expiry, т.е. OR масок), метки времени и штрафы по максимуму
+        st = cls._state_cache
+        for key, val in disk.items():
+            if key == "CREATE_blacklist":
+                bl = st.get(key)
+                if not isinstance(bl, dict):
+                    bl = st[key] = {}
+                if isinstance(val, dict):
+                    for sec, exp in val.items():
+                        try:
+                            if float(exp) > float(bl.get(sec) or 0.0):
+                                bl[sec] = exp
+                        except (TypeError, ValueError):
+                            pass
+            elif key in ("CREATE_blacklist_heap", "CREATE_blacklist_mask"):
+                continue
+            elif key.endswith("_last_ts") or key == "CREATE_skip_minutes":
+                try:
+                    st[key] = max(float(st.get(key) or 0), float(val or 0))
+                except (TypeError, ValueError):
+                    pass
+                if key == "CREATE_skip_minutes":
+                    st[key] = int(st[key])
+            elif key not in st:
+                st[key] = val
+        if "CREATE_blacklist" in disk:
+            # Кучу и маску пересобираем из объединённого словаря
+            cls._blacklist_rebuild(st, time.time())
 
     @classmethod
-    def _save_state(cls, st: Dict[str, Any]) -> None:
-        tmp = cls.state_file.with_suffix(".tmp")
-        tmp.write_text(json.dumps(st, ensure_ascii=False), encoding="utf-8")
-        tmp.replace(cls.state_file)
+    def _mark_dirty(cls) -> None:
+        cls._dirty = True
+
+    @classmethod
+    def _flush_if_due(cls, now: float, force: bool = False) -> None:
+        # now — time.monotonic(); вызывать под flock
+        if not cls._dirty or (not force and now - cls._last_flush <= cls._FLUSH_INTERVAL_SEC):
+            return
+        # Подтягиваем чужие записи, сделанные после нашего последнего чтения, — иначе os.replace их затрёт
+        cls._get_state()
+        # Один encode и голые os.* вызовы; fsync не делаем — state восстановим и с нуля
+        buf = json.dumps(cls._state_cache, ensure_ascii=False).encode("utf-8")
+        try:
+            fd = os.open(cls._tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+            try:
+                os.write(fd, buf)
+            finally:
+                os.close(fd)
+            os.replace(cls._tmp_path, cls._state_path)
+        except FileNotFoundError:
+            # Каталог DATA_DIR пропал — пусть следующий _ensure_files пересоздаст его
+            cls._files_ready = False
+            raise
+        cls._dirty = False
+        cls._last_flush = now
+        try:
+            cls._state_mtime_ns = os.stat(cls._state_path).st_mtime_ns
+        except OSError:
+            cls._state_mtime_ns = 0
 
     @classmethod
     def _calc_next_slot_time(cls, now: float, slot_sec: int, offset_ms: int) -> float:
@@ -221,38 +455,89 @@ class _CrossProcCreateGate:
         return base + (offset_ms / 1000.0)
 
     @classmethod
-    def _blacklist_cleanup(cls, st: Dict[str, Any], now: float) -> None:
+    def _blacklist_rebuild(cls, st: Dict[str, Any], now: float) -> int:
+        """
+        Полная пересборка блэклиста: чистит протухшие секунды в CREATE_blacklist ({сек: expiry}),
+        строит кучу CREATE_blacklist_heap ([expiry, сек]) и маску CREATE_blacklist_mask
+        (бит i = секунда i в блэклисте). Нужна для старых/битых state-файлов.
+        """
         bl = st.get("CREATE_blacklist") or {}
         if not isinstance(bl, dict):
-            st["CREATE_blacklist"] = {}
-            return
-        changed = False
+            bl = {}
+        mask = 0
+        heap: List[List[Any]] = []
         for k in list(bl.keys()):
             try:
-                if float(bl[k]) <= now:
-                    del bl[k]
-                    changed = True
+                exp = float(bl[k])
+                sec = int(k) % 60
+                if exp > now:
+                    mask |= 1 << sec
+                    heap.append([exp, sec])
+                    continue
             except Exception:
-                del bl[k]
-                changed = True
-        if changed:
-            st["CREATE_blacklist"] = bl
+                pass
+            del bl[k]
+        heapq.heapify(heap)
+        st["CREATE_blacklist"] = bl
+        st["CREATE_blacklist_heap"] = heap
+        st["CREATE_blacklist_mask"] = mask
+        return mask
 
     @classmethod
-    def _is_blacklisted(cls, st: Dict[str, Any], sec: int, now: float) -> bool:
-        if ON429_BLACKLIST_TTL_SEC <= 0:
-            return False
-        bl = st.get("CREATE_blacklist") or {}
-        if not isinstance(bl, dict):
-            return False
-        exp = bl.get(str(int(sec) % 60))
+    def _blacklist_cleanup(cls, st: Dict[str, Any], now: float) -> int:
+        # Снимаем с кучи только истёкшие записи; если ничего не истекло — O(1). Возвращает маску.
+        bl = st.get("CREATE_blacklist")
+        heap = st.get("CREATE_blacklist_heap")
+        mask = st.get("CREATE_blacklist_mask")
+        if not isinstance(bl, dict) or not isinstance(heap, list) or not isinstance(mask, int):
+            return cls._blacklist_rebuild(st, now)
         try:
-            return bool(exp and float(exp) > now)
+            while heap and heap[0][0] <= now:
+                exp, sec = heapq.heappop(heap)
+                key = str(sec)
+                # Устаревшая запись кучи (секунду уже продлили) — просто выбрасываем
+                if bl.get(key) == exp:
+                    del bl[key]
+                    mask &= ~(1 << sec)
         except Exception:
+            return cls._blacklist_rebuild(st, now)
+        st["CREATE_blacklist_mask"] = mask
+        return mask
+
+    @classmethod
+    def _blacklist_add(cls, st: Dict[str, Any], sec: int, exp: float) -> None:
+        # Вызывать после _blacklist_cleanup: структуры уже валидны
+        sec = int(sec) % 60
+        st["CREATE_blacklist"][str(sec)] = exp
+        heapq.heappush(st["CREATE_blacklist_heap"], [exp, sec])
+        st["CREATE_blacklist_mask"] |= 1 << sec
+
+    @classmethod
+    def _is_blacklisted(cls, st: Dict[str, Any], sec: int) -> bool:
+        # Маска актуальна после _blacklist_cleanup в начале каждой операции под локом
+        if ON429_BLACKLIST_TTL_SEC <= 0:
             return False
+        return bool((int(st.get("CREATE_blacklist_mask") or 0) >> (int(sec) % 60)) & 1)
 
     @classmethod
-    def _pick_slot_locked(cls, st: Dict[str, Any]) -> int:
+    def _pick_free_slot(cls, mask: int) -> int:
+        # Случайная секунда вне маски: пара попыток randrange, затем перебор свободных бит.
+        # Маску берём как есть — отключённый блэклист (TTL<=0) учитывают вызывающие
+        for _ in range(8):
+            s = _rng.randrange(60)
+            if not (mask >> s) & 1:
+                return s
+        free = ~mask & _ALL_SLOTS_MASK
+        if not free:
+            return _rng.randrange(60)
+        k = _rng.randrange(free.bit_count())
+        while k:
+            free &= free - 1  # снимаем младший свободный бит
+            k -= 1
+        return (free & -free).bit_length() - 1
+
+    @classmethod
+    def _pick_slot_locked(cls, st: Dict[str, Any], now: float) -> int:
         if CREATE_SLOT_ENV != "":
             try:
                 slot = int(CREATE_SLOT_ENV) % 60
@@ -263,17 +548,36 @@ class _CrossProcCreateGate:
         if "CREATE_slot" in st:
             try:
                 cand = int(st["CREATE_slot"]) % 60
-                now = time.time()
-                if not cls._is_blacklisted(st, cand, now):
+                if not cls._is_blacklisted(st, cand):
                     return cand
             except Exception:
                 pass
-        now = time.time()
-        choices = [s for s in range(60) if not cls._is_blacklisted(st, s, now)]
-        slot = random.choice(choices) if choices else random.randint(0, 59)
+        mask = int(st.get("CREATE_blacklist_mask") or 0) if ON429_BLACKLIST_TTL_SEC > 0 else 0
+        slot = cls._pick_free_slot(mask)
         st["CREATE_slot"] = slot
         return slot
 
+    @classmethod
+    def _rotate_slot_locked(cls, st: Dict[str, Any], new_slot: Optional[int] = None) -> int:
+        # Вызывать под _proc_lock + flock; сброс на диск — забота вызывающего
+        mask = cls._blacklist_cleanup(st, time.time())
+        try:
+            current = int(st.get("CREATE_slot", -1)) % 60
+        except Exception:
+            current = -1
+        if new_slot is None:
+            cur_bit = (1 << current) if current >= 0 else 0
+            if ON429_BLACKLIST_TTL_SEC > 0 and (mask | cur_bit) != _ALL_SLOTS_MASK:
+                new_slot = cls._pick_free_slot(mask | cur_bit)
+            else:
+                # Всё в блэклисте — хотя бы уходим с текущей секунды
+                new_slot = cls._pick_free_slot(cur_bit)
+        st["CREATE_slot"] = int(new_slot) % 60
+        cls._mark_dirty()
+        if _log.isEnabledFor(logging.INFO):
+            _log.info("httpx_rate_limit_patch: rotated CREATE_slot to %s", st["CREATE_slot"])
+        return int(st["CREATE_slot"])
+
     @classmethod
     def rotate_slot(cls, st: Optional[Dict[str, Any]] = None, new_slot: Optional[int] = None) -> int:
         # Если слот зафиксирован, но FORCE_ROTATE_ON429=1 — разрешим ротацию; иначе — уважаем фикс.
@@ -285,26 +589,12 @@ class _CrossProcCreateGate:
         cls._ensure_files()
         if fcntl is None:
             return -1
-        with open(cls.lock_file, "a+") as f:
+        with cls._proc_lock, open(cls.lock_file, "a+") as f:
             fcntl.flock(f, fcntl.LOCK_EX)
             try:
-                if st is None:
-                    st = cls._load_state()
-                now = time.time()
-                cls._blacklist_cleanup(st, now)
-                try:
-                    current = int(st.get("CREATE_slot", -1)) % 60
-                except Exception:
-                    current = -1
-                if new_slot is None:
-                    choices = [s for s in range(60) if s != current and not cls._is_blacklisted(st, s, now)]
-                    if not choices:
-                        choices = [s for s in range(60) if s != current]
-                    new_slot = random.choice(choices) if choices else random.randint(0, 59)
-                st["CREATE_slot"] = int(new_slot) % 60
-                cls._save_state(st)
-                logging.info("httpx_rate_limit_patch: rotated CREATE_slot to %s", st["CREATE_slot"])
-                return int(st["CREATE_slot"])
+                slot = cls._rotate_slot_locked(cls._get_state() if st is None else st, new_slot)
+                cls._flush_if_due(time.monotonic(), force=True)
+                return slot
             finally:
                 fcntl.flock(f, fcntl.LOCK_UN)
 
@@ -312,34 +602,33 @@ class _CrossProcCreateGate:
     def on_429(cls, resp: httpx.Response):
         if fcntl is None:
             return
-        with open(cls.lock_file, "a+") as f:
+        with cls._proc_lock, open(cls.lock_file, "a+") as f:
             fcntl.flock(f, fcntl.LOCK_EX)
             try:
-                st = cls._load_state()
+                st = cls._get_state()
                 now = time.time()
                 cls._blacklist_cleanup(st, now)
                 try:
                     if ON429_BLACKLIST_TTL_SEC > 0:
                         date_hdr = str(resp.headers.get("Date") or "").strip()
                         if date_hdr:
-                            dt = parsedate_to_datetime(date_hdr)
-                            sec = dt.second
-                            bl = st.get("CREATE_blacklist") or {}
-                            if not isinstance(bl, dict):
-                                bl = {}
-                            bl[str(int(sec) % 60)] = now + float(ON429_BLACKLIST_TTL_SEC)
-                            st["CREATE_blacklist"] = bl
-                            logging.info(
-                                "httpx_rate_limit_patch: blacklist sec=%s for %ss",
-                                sec,
-                                ON429_BLACKLIST_TTL_SEC,
-                            )
+                            sec = _date_header_second(date_hdr)
+                            cls._blacklist_add(st, sec, now + float(ON429_BLACKLIST_TTL_SEC))
+                            if _log.isEnabledFor(logging.INFO):
+                                _log.info(
+                                    "httpx_rate_limit_patch: blacklist sec=%s for %ss",
+                                    sec,
+                                    ON429_BLACKLIST_TTL_SEC,
+                                )
                 except Exception:
                     pass
-                cls.rotate_slot(st, None if CREATE_SLOT_ENV == "" else None)
+                # Ротация под уже взятыми локами (повторный flock из того же процесса завис бы)
+                if CREATE_SLOT_ENV == "" or FORCE_ROTATE_ON429:
+                    cls._rotate_slot_locked(st)
                 skip = int(st.get("CREATE_skip_minutes", 0) or 0)
                 st["CREATE_skip_minutes"] = max(skip, int(ON429_SKIP_MINUTES))
-                cls._save_state(st)
+                cls._mark_dirty()
+                cls._flush_if_due(time.monotonic(), force=True)
             finally:
                 fcntl.flock(f, fcntl.LOCK_UN)
 
@@ -358,76 +647,127 @@ class _CrossProcCreateGate:
                 time.sleep(capped)
             return
 
-        with open(cls.lock_file, "a+") as f:
+        # Все ожидания — вне локов: под локом только резервируем момент отправки
+        if not cls._first_create_done and CREATE_COLD_START_STAGGER_SEC > 0:
+            delay = _rng.uniform(0.0, float(CREATE_COLD_START_STAGGER_SEC))
+            time.sleep(_clamped_sleep_seconds(delay))
+            cls._first_create_done = True
+
+        with cls._proc_lock, open(cls.lock_file, "a+") as f:
             fcntl.flock(f, fcntl.LOCK_EX)
             try:
-                st = cls._load_state()
+                st = cls._get_state()
                 now = time.time()
                 cls._blacklist_cleanup(st, now)
 
-                if not cls._first_create_done and CREATE_COLD_START_STAGGER_SEC > 0:
-                    delay = random.uniform(0.0, float(CREATE_COLD_START_STAGGER_SEC))
-                    time.sleep(_clamped_sleep_seconds(delay))
-                    cls._first_create_done = True
-
                 last = float(st.get(f"{group}_last_ts", 0.0) or 0.0)
                 next_allowed_by_gap = last + float(gap)
 
-                slot = cls._pick_slot_locked(st)
+                slot = cls._pick_slot_locked(st, now)
                 target = cls._calc_next_slot_time(max(now, next_allowed_by_gap), slot, int(CREATE_SLOT_OFFSET_MS))
 
                 skip_minutes = int(st.get("CREATE_skip_minutes", 0) or 0)
                 if skip_minutes > 0:
                     target += 60.0 * float(skip_minutes)
                     st["CREATE_skip_minutes"] = 0
-                    logging.info(
-                        "httpx_rate_limit_patch: skip %d minute(s) after 429; next at slot=%d",
-                        skip_minutes,
-                        slot,
-                    )
+                    if _log.isEnabledFor(logging.INFO):
+                        _log.info(
+                            "httpx_rate_limit_patch: skip %d minute(s) after 429; next at slot=%d",
+                            skip_minutes,
+                            slot,
+                        )
 
                 wait = max(0.0, target - now)
                 # Каппируем ожидание create-gate
-                max_create_wait = max(0.0, RL_MAX_CREATE_WAIT_MS / 1000.0)
+                max_create_wait = _RL_MAX_CREATE_WAIT_SEC
                 if wait > max_create_wait:
-                    logging.info(
-                        "httpx_rate_limit_patch: create-gate wait %.2fs > cap %.2fs -> skip long wait",
-                        wait,
-                        max_create_wait,
-                    )
-                    # Пропускаем длинное ожидание, просто регистрируем момент
-                    st[f"{group}_last_ts"] = time.time()
+                    if _log.isEnabledFor(logging.INFO):
+                        _log.info(
+                            "httpx_rate_limit_patch: create-gate wait %.2fs > cap %.2fs -> skip long wait",
+                            wait,
+                            max_create_wait,
+                        )
+                    # Пропускаем длинное ожидание, просто регистрируем момент (сна не было — now актуален).
+                    # Пишем сразу (force): другие процессы должны считать gap от этой отправки
+                    st[f"{group}_last_ts"] = now
                     st["CREATE_slot"] = slot
-                    cls._save_state(st)
+                    cls._mark_dirty()
+                    cls._flush_if_due(time.monotonic(), force=True)
                     return
 
                 capped_wait = _clamped_sleep_seconds(wait)
-                if capped_wait > 0:
-                    logging.info(
-                        "httpx_rate_limit_patch: create-gate wait %.2fs (slot=%s, gap=%.1fs)",
-                        capped_wait,
-                        slot,
-                        gap,
-                    )
-                    time.sleep(capped_wait)
-
-                st[f"{group}_last_ts"] = time.time()
+                # Резерв публикуем сразу (force): спать будем уже без локов,
+                # и следующий ждущий должен считать gap от нашего момента отправки
+                st[f"{group}_last_ts"] = now + capped_wait
                 st["CREATE_slot"] = slot
-                cls._save_state(st)
+                cls._mark_dirty()
+                cls._flush_if_due(time.monotonic(), force=True)
             finally:
                 fcntl.flock(f, fcntl.LOCK_UN)
 
+        if capped_wait > 0:
+            if _log.isEnabledFor(logging.INFO):
+                _log.info(
+                    "httpx_rate_limit_patch: create-gate wait %.2fs (slot=%s, gap=%.1fs)",
+                    capped_wait,
+                    slot,
+                    gap,
+                )
+            time.sleep(capped_wait)
+
     @classmethod
     async def wait(cls, group: str, gap: float):
-        # Асинхронная обёртка над sync, чтобы не блокировать event loop
-        await asyncio.to_thread(cls.wait_sync, group, gap)
+        # Асинхронная обёртка над sync, чтобы не блокировать event loop.
+        # Конкурентные вызовы выстраиваются в очередь здесь, а не N потоками на flock:
+        # у каждого по-прежнему свой слот, но в поток уходит по одному ожиданию на группу.
+        prev = cls._inflight.get(group)
+        fut = asyncio.get_running_loop().create_future()
+        cls._inflight[group] = fut
+        try:
+            if prev is not None:
+                # asyncio.wait не отменяет prev, если отменят нас
+                await asyncio.wait((prev,))
+            await asyncio.to_thread(cls.wait_sync, group, gap)
+        finally:
+            if not fut.done():
+                fut.set_result(None)
+            if cls._inflight.get(group) is fut:
+                del cls._inflight[group]
+
+    @classmethod
+    def _read_state_shared(cls) -> Dict[str, Any]:
+        # Читатель не ждёт create-gate: если локи заняты, отдаём то, что уже в кэше
+        # Быстрый путь без локов: свои правки новее файла или файл не менялся с прошлого чтения
+        if cls._dirty:
+            return cls._state_cache
+        if cls._state_mtime_ns:
+            try:
+                if os.stat(cls._state_path).st_mtime_ns == cls._state_mtime_ns:
+                    return cls._state_cache
+            except OSError:
+                pass
+        if not cls._proc_lock.acquire(blocking=False):
+            return cls._state_cache
+        try:
+            if fcntl is None or not cls.lock_file.exists():
+                return cls._get_state()
+            with open(cls.lock_file, "a+") as f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_SH | fcntl.LOCK_NB)
+                except OSError:
+                    return cls._state_cache
+                try:
+                    return cls._get_state()
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+        finally:
+            cls._proc_lock.release()
 
     @classmethod
     def read_current_slot(cls) -> Optional[int]:
         try:
-            raw = cls.state_file.read_text(encoding="utf-8")
-            js = json.loads(raw or "{}")
-            if isinstance(js, dict) and "CREATE_slot" in js:
+            js = cls._read_state_shared()
+            if "CREATE_slot" in js:
                 return int(js["CREATE_slot"]) % 60
         except Exception:
             pass
@@ -441,56 +781,189 @@ class _CrossProcCreateGate:
 # ================== ХОСТ-ЛИМИТЕР (с капом ожиданий) ==================
 
 class _HostLimiter:
+    """
+    GCRA-лимитер без asyncio.Lock: всё крутится в одном event loop, поэтому резерв
+    слота (_reserve) атомарен между await'ами — блокировка нужна была лишь на время сна.
+    Время — целые наносекунды time.monotonic_ns(): без дрейфа float на длинных аптаймах.
+    """
+
+    __slots__ = (
+        "burst", "_min_delta_ns", "_tolerance_ns", "_next_allowed_ns", "_penalty_until_ns",
+        "_base_delta_ns", "_max_delta_ns", "_rate_step", "_capped_send_ns",
+    )
+
     def __init__(self, rpm: int, burst: int):
-        self.min_delta = 60.0 / max(1, rpm)
         self.burst = max(1, burst)
-        self._deque: deque[float] = deque()
-        self._penalty_until: float = 0.0
-        self._lock = asyncio.Lock()
+        self._min_delta_ns = 60_000_000_000 // max(1, rpm)
+        # AIMD: интервал гуляет между базовым (OZON_RPM) и ×10; шаг прироста темпа — 1/20 от базового
+        self._base_delta_ns = self._min_delta_ns
+        self._max_delta_ns = self._min_delta_ns * 10
+        self._rate_step = 1.0 / (20 * self._min_delta_ns)
+        # Допуск GCRA: до burst запросов подряд без ожидания
+        self._tolerance_ns = (self.burst - 1) * self._min_delta_ns
+        self._next_allowed_ns = 0
+        if START_PHASE_JITTER:
+            # Сдвигаем фазу на случайную долю интервала (сон всё равно ограничен RL_MAX_SLEEP_SEC)
+            self._next_allowed_ns = (
+                time.monotonic_ns() + _rng.randrange(self._min_delta_ns + 1) - self._tolerance_ns
+            )
+        self._penalty_until_ns = 0
+        self._capped_send_ns = 0
+
+    @property
+    def min_delta(self) -> float:
+        # Текущий интервал в секундах — производный от _min_delta_ns, который двигает AIMD
+        return self._min_delta_ns / 1e9
+
+    def _reserve(self, now_ns: int) -> float:
+        """Резервирует момент отправки и возвращает задержку в секундах (уже с капом RL_MAX_SLEEP_SEC)."""
+        tat = max(self._next_allowed_ns, now_ns)
+        target = max(now_ns, tat - self._tolerance_ns, self._penalty_until_ns)
+        if self._penalty_until_ns:
+            # Не заставляем ждать остаток пенальти — снимаем его после первого ожидания
+            self._penalty_until_ns = 0
+        delay_ns = target - now_ns
+        if delay_ns > _RL_MAX_SLEEP_NS:
+            # Кап — на шаг очереди, а не на каждого: следующий ограниченный ждёт RL_MAX_SLEEP_SEC
+            # после предыдущего (0, 1, 2, ... с), как при последовательном сне под локом
+            send_ns = min(target, max(now_ns, self._capped_send_ns) + _RL_MAX_SLEEP_NS)
+            self._capped_send_ns = send_ns
+            delay_ns = send_ns - now_ns
+            # Цепочку перестраиваем от фактической отправки (бакет пуст): «долг» за урезанный сон
+            # не копится, и после простоя в один интервал лимитер снова пропускает без ожидания
+            self._next_allowed_ns = send_ns + self._tolerance_ns + self._min_delta_ns
+        else:
+            self._next_allowed_ns = tat + self._min_delta_ns
+        return delay_ns / 1e9
 
     async def acquire(self):
-        async with self._lock:
-            now = time.time()
-            # Пенальти: ждём, но с капом
-            if now < self._penalty_until:
-                wait = self._penalty_until - now
-                capped = _clamped_sleep_seconds(wait)
-                if capped > 0:
-                    await asyncio.sleep(capped)
-                # Не заставляем ждать остаток пенальти — снимаем его
-                self._penalty_until = time.time()
-
-            now = time.time()
-            cutoff = now - self.min_delta
-            while self._deque and self._deque[0] < cutoff:
-                self._deque.popleft()
-
-            if len(self._deque) >= self.burst:
-                earliest = self._deque[0]
-                wait = (earliest + self.min_delta) - now
-                if wait > 0:
-                    capped = _clamped_sleep_seconds(wait)
-                    if capped > 0:
-                        await asyncio.sleep(capped)
-                    # После капа — очищаем устаревшие и продолжаем
-                    now = time.time()
-                    cutoff2 = now - self.min_delta
-                    while self._deque and self._deque[0] < cutoff2:
-                        self._deque.popleft()
-
-            self._deque.append(time.time())
+        delay = self._reserve(time.monotonic_ns())
+        if delay > 1e-3:
+            await asyncio.sleep(delay)
+        elif delay > 0:
+            # Субмиллисекундное ожидание: просто уступаем цикл, без таймера в куче loop
+            await asyncio.sleep(0)
+
+    def acquire_sync(self):
+        # Тот же резерв, что и в acquire: sync- и async-клиенты делят одно состояние хоста
+        delay = self._reserve(time.monotonic_ns())
+        if delay > 0:
+            time.sleep(delay)
+
+    def on_success(self):
+        # Аддитивный рост темпа; в штатном режиме (интервал базовый) — одно сравнение
+        if self._min_delta_ns > self._base_delta_ns:
+            rate = 1.0 / self._min_delta_ns + self._rate_step
+            self._min_delta_ns = max(self._base_delta_ns, int(1.0 / rate))
+
+    def on_throttle(self):
+        # Мультипликативное снижение темпа (β=0.5) после 429
+        self._min_delta_ns = min(self._max_delta_ns, self._min_delta_ns * 2)
 
     def penalize(self, seconds: float):
         seconds = max(0.0, float(seconds))
         seconds = min(seconds, RL_MAX_RETRY_AFTER_SEC)  # кап Retry-After
-        self._penalty_until = max(self._penalty_until, time.time() + seconds)
+        self._penalty_until_ns = max(self._penalty_until_ns, time.monotonic_ns() + int(seconds * 1e9))
+
+# next_allowed_ns, penalty_until_ns, min_delta_ns
+_SHARED_FMT = struct.Struct("<qqq")
+
+class _SharedHostLimiter(_HostLimiter):
+    """
+    Лимитер, общий для всех процессов машины (OZON_SHARED_BUCKET=1): состояние GCRA лежит
+    в mmap-файле в DATA_DIR, каждая операция — под threading.Lock + flock.
+    CLOCK_MONOTONIC у процессов одного ядра общий, поэтому наносекунды сопоставимы.
+    """
+
+    __slots__ = ("_fd", "_mm", "_tlock")
 
-_host_limiters: Dict[str, _HostLimiter] = {}
+    def __init__(self, rpm: int, burst: int, key: str):
+        super().__init__(rpm, burst)
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+        self._fd = os.open(str(DATA_DIR / f".supw_rl_{safe}.bin"), os.O_RDWR | os.O_CREAT, 0o644)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < _SHARED_FMT.size:
+                os.ftruncate(self._fd, _SHARED_FMT.size)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, _SHARED_FMT.size)
+        self._tlock = threading.Lock()
+
+    def _locked(self, fn, *args):
+        # Загрузить общее состояние -> выполнить операцию базового класса -> записать обратно
+        with self._tlock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                nxt, pen, delta = _SHARED_FMT.unpack_from(self._mm)
+                self._next_allowed_ns = nxt
+                self._penalty_until_ns = pen
+                # Интервал мог записать процесс с другим OZON_RPM — держим его в своих границах AIMD
+                if delta:
+                    self._min_delta_ns = min(self._max_delta_ns, max(self._base_delta_ns, delta))
+                res = fn(*args)
+                _SHARED_FMT.pack_into(self._mm, 0, self._next_allowed_ns, self._penalty_until_ns, self._min_delta_ns)
+                return res
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _reserve(self, now_ns: int) -> float:
+        return self._locked(super()._reserve, now_ns)
+
+    def on_success(self):
+        self._locked(super().on_success)
+
+    def on_throttle(self):
+        self._locked(super().on_throttle)
+
+    def penalize(self, seconds: float):
+        self._locked(super().penalize, seconds)
+
+def _new_limiter(rpm: int, key: str) -> _HostLimiter:
+    if SHARED_BUCKET and fcntl is not None:
+        try:
+            return _SharedHostLimiter(rpm, BURST, key)
+        except OSError:
+            _log.exception("httpx_rate_limit_patch: shared limiter for %s unavailable, using local", key)
+    return _HostLimiter(rpm, BURST)
+
+_host_limiters: Dict[Any, _HostLimiter] = {}
+
+def _load_route_rpm() -> Dict[str, int]:
+    # OZON_RPM__v1_product=30 -> {"/v1/product": 30}
+    out: Dict[str, int] = {}
+    for name in os.environ:
+        if name.startswith("OZON_RPM__"):
+            rpm = _getenv_int(name, 0)
+            if rpm > 0:
+                out["/" + name[len("OZON_RPM__"):].replace("_", "/")] = rpm
+    return out
+
+_ROUTE_RPM: Dict[str, int] = _load_route_rpm()
+
+def _route_key(path: str) -> str:
+    # Первые два сегмента пути: /v1/product/list -> /v1/product
+    return "/".join(path.split("/", 3)[:3])
 
 def _get_limiter_for_host(host: str) -> _HostLimiter:
-    if host not in _host_limiters:
-        _host_limiters[host] = _HostLimiter(RPM, BURST)
-    return _host_limiters[host]
+    # Горячий путь — один get; конструктор зовём только для нового хоста
+    lim = _host_limiters.get(host)
+    if lim is None:
+        lim = _host_limiters.setdefault(host, _new_limiter(RPM, host))
+    return lim
+
+def _get_limiter(host: str, path: str) -> _HostLimiter:
+    # Маршруты со своим OZON_RPM__* не делят квоту с остальными; без оверрайдов — лимитер хоста
+    if _ROUTE_RPM:
+        route = _route_key(path)
+        rpm = _ROUTE_RPM.get(route)
+        if rpm:
+            key = (host, route)
+            lim = _host_limiters.get(key)
+            if lim is None:
+                lim = _host_limiters.setdefault(key, _new_limiter(rpm, host + route))
+            return lim
+    return _get_limiter_for_host(host)
 
 # ================== PREFLIGHT ==================
 
@@ -505,18 +978,32 @@ async def _avoid_create_second_for_non_create(path: str):
     now = time.time()
     if (int(now) % 60) == (int(slot) % 60):
         frac = now - int(now)
-        margin = AVOID_MARGIN_MS / 1000.0
-        wait = (1.0 - frac) + margin
+        wait = (1.0 - frac) + _AVOID_MARGIN_SEC
         capped = _clamped_sleep_seconds(wait)
         if capped > 0:
-            logging.info(
-                "httpx_rate_limit_patch: avoid create-second=%s for non-create; sleep %.3fs",
-                slot,
-                capped,
-            )
+            if _log.isEnabledFor(logging.INFO):
+                _log.info(
+                    "httpx_rate_limit_patch: avoid create-second=%s for non-create; sleep %.3fs",
+                    slot,
+                    capped,
+                )
             await asyncio.sleep(capped)
 
-async def _preflight_throttle(host: str, path: str):
+def _compute_preflight_trivial() -> bool:
+    # С «лёгкими» дефолтами весь префлайт сводится к лимитеру хоста
+    return (
+        not AVOID_CREATE_SECOND_FOR_OTHERS
+        and not ALIGN_SECOND_BOUNDARY
+        and JITTER_MS == 0
+        and RL_DISABLE_CREATE_GATE
+    )
+
+_PREFLIGHT_TRIVIAL = _compute_preflight_trivial()
+
+async def _preflight_fast(host: str, path: str):
+    await _get_limiter(host, path).acquire()
+
+async def _preflight_full(host: str, path: str):
     # Защита «секунды создателя» (опционально)
     await _avoid_create_second_for_non_create(path)
 
@@ -531,114 +1018,209 @@ async def _preflight_throttle(host: str, path: str):
 
     # Небольшой джиттер (опционально)
     if JITTER_MS > 0:
-        capped = _clamped_sleep_seconds(JITTER_MS / 1000.0)
+        capped = _clamped_sleep_seconds(_JITTER_SEC)
         if capped > 0:
             await asyncio.sleep(capped)
 
     # Общий лимитер по хосту (burst+rpm)
-    lim = _get_limiter_for_host(host)
+    lim = _get_limiter(host, path)
     await lim.acquire()
 
     # Межпроцессное окно для create (если включено)
     if path in CREATE_ENDPOINTS and not RL_DISABLE_CREATE_GATE:
         if CREATE_COLD_START_STAGGER_SEC > 0 and not _CrossProcCreateGate._first_create_done:
-            delay = random.uniform(0, float(CREATE_COLD_START_STAGGER_SEC))
+            delay = _rng.uniform(0, float(CREATE_COLD_START_STAGGER_SEC))
             capped = _clamped_sleep_seconds(delay)
             if capped > 0:
                 await asyncio.sleep(capped)
             _CrossProcCreateGate._first_create_done = True
         await _CrossProcCreateGate.wait("CREATE", CREATE_GAP)
 
-# ================== ПАТЧИРОВАННЫЕ ЗАПРОСЫ ==================
-
-_orig_async_request = httpx.AsyncClient.request
-_orig_sync_request = httpx.Client.request
+def _preflight_fast_sync(host: str, path: str):
+    _get_limiter(host, path).acquire_sync()
 
-async def _patched_async_request(self: httpx.AsyncClient, method: str, url, *args, **kwargs):
-    url_str = str(url)
-    host = _host_of(url_str)
-    path = _path_of(url_str)
-    if _is_tracked_domain(host):
-        await _preflight_throttle(host, path)
+def _preflight_full_sync(host: str, path: str):
+    # Как _preflight_full, но лимитер первым и без защиты «секунды создателя» (как было в sync-пути)
+    _get_limiter(host, path).acquire_sync()
 
-    resp = await _orig_async_request(self, method, url, *args, **kwargs)
-
-    if _is_tracked_domain(host) and getattr(resp, "status_code", 0) == 429:
-        cooldown = _retry_after_seconds(resp)
-        _get_limiter_for_host(host).penalize(cooldown)
-        if path in CREATE_ENDPOINTS:
-            try:
-                _CrossProcCreateGate.on_429(resp)
-            except Exception:
-                logging.exception("httpx_rate_limit_patch: on_429 failed")
-        logging.warning("httpx_rate_limit_patch: penalize %.2fs (status 429)", cooldown)
-    return resp
-
-def _patched_sync_request(self: httpx.Client, method: str, url, *args, **kwargs):
-    url_str = str(url)
-    host = _host_of(url_str)
-    path = _path_of(url_str)
-    if _is_tracked_domain(host):
-        lim = _get_limiter_for_host(host)
-
-        # Пенальти с капом
+    if ALIGN_SECOND_BOUNDARY:
         now = time.time()
-        if now < lim._penalty_until:
-            wait = lim._penalty_until - now
-            capped = _clamped_sleep_seconds(wait)
+        frac = now - int(now)
+        if frac < 0.02:
+            capped = _clamped_sleep_seconds(0.02 - frac)
             if capped > 0:
                 time.sleep(capped)
-            lim._penalty_until = time.time()
 
-        # Burst лимиты
-        now = time.time()
-        cutoff = now - lim.min_delta
-        while lim._deque and lim._deque[0] < cutoff:
-            lim._deque.popleft()
-        if len(lim._deque) >= lim.burst:
-            earliest = lim._deque[0]
-            wait = (earliest + lim.min_delta) - now
-            if wait > 0:
-                capped = _clamped_sleep_seconds(wait)
-                if capped > 0:
-                    time.sleep(capped)
-                now = time.time()
-                cutoff2 = now - lim.min_delta
-                while lim._deque and lim._deque[0] < cutoff2:
-                    lim._deque.popleft()
-        lim._deque.append(time.time())
-
-        # Прочие префлайты (опциональные)
-        if ALIGN_SECOND_BOUNDARY:
-            frac = time.time() - int(time.time())
-            if frac < 0.02:
-                capped = _clamped_sleep_seconds(0.02 - frac)
-                if capped > 0:
-                    time.sleep(capped)
-        if JITTER_MS > 0:
-            capped = _clamped_sleep_seconds(JITTER_MS / 1000.0)
+    if JITTER_MS > 0:
+        capped = _clamped_sleep_seconds(_JITTER_SEC)
+        if capped > 0:
+            time.sleep(capped)
+
+    if path in CREATE_ENDPOINTS and not RL_DISABLE_CREATE_GATE:
+        if CREATE_COLD_START_STAGGER_SEC > 0 and not _CrossProcCreateGate._first_create_done:
+            delay = _rng.uniform(0, float(CREATE_COLD_START_STAGGER_SEC))
+            capped = _clamped_sleep_seconds(delay)
             if capped > 0:
                 time.sleep(capped)
-        if path in CREATE_ENDPOINTS and not RL_DISABLE_CREATE_GATE:
-            if _CrossProcCreateGate._first_create_done is False and CREATE_COLD_START_STAGGER_SEC > 0:
-                delay = random.uniform(0, float(CREATE_COLD_START_STAGGER_SEC))
-                capped = _clamped_sleep_seconds(delay)
-                if capped > 0:
-                    time.sleep(capped)
-                _CrossProcCreateGate._first_create_done = True
-            _CrossProcCreateGate.wait_sync("CREATE", CREATE_GAP)
-
-    resp = _orig_sync_request(self, method, url, *args, **kwargs)
-    if _is_tracked_domain(host) and getattr(resp, "status_code", 0) == 429:
-        cooldown = _retry_after_seconds(resp)
-        _get_limiter_for_host(host).penalize(cooldown)
-        if path in CREATE_ENDPOINTS:
-            try:
-                _CrossProcCreateGate.on_429(resp)
-            except Exception:
-                logging.exception("httpx_rate_limit_patch: on_429 failed (sync)")
-        logging.warning("httpx_rate_limit_patch: penalize %.2fs (status 429)", cooldown)
-    return resp
+            _CrossProcCreateGate._first_create_done = True
+        _CrossProcCreateGate.wait_sync("CREATE", CREATE_GAP)
+
+# ================== ПАТЧИРОВАННЫЕ ЗАПРОСЫ ==================
+
+_orig_async_request = httpx.AsyncClient.request
+_orig_sync_request = httpx.Client.request
+
+def _on_tracked_429(resp: httpx.Response, host: str, path: str) -> None:
+    cooldown = _retry_after_seconds(resp)
+    lim = _get_limiter(host, path)
+    lim.penalize(cooldown)
+    if ADAPTIVE_RATE:
+        lim.on_throttle()
+    if path in CREATE_ENDPOINTS:
+        try:
+            _CrossProcCreateGate.on_429(resp)
+        except Exception:
+            _log.exception("httpx_rate_limit_patch: on_429 failed")
+    _log.warning("httpx_rate_limit_patch: penalize %.2fs (status 429)", cooldown)
+
+# Неизменяемые функции модуля связываем keyword-only дефолтами (LOAD_FAST вместо LOAD_GLOBAL).
+# Настройки (RL_MAX_429_RETRIES, ADAPTIVE_RATE, _PREFLIGHT_TRIVIAL) остаются глобалами —
+# configure()/install() их переприсваивают.
+async def _patched_async_request(self: httpx.AsyncClient, method: str, url, *args,
+                                 _orig=_orig_async_request, _parts=_url_parts,
+                                 _replayable=_is_replayable, _limiter=_get_limiter,
+                                 _on_429=_on_tracked_429, _wait_429=_retry_429_wait,
+                                 _fast=_preflight_fast, _full=_preflight_full,
+                                 _sleep=asyncio.sleep, _warn=_log.warning, **kwargs):
+    url, host, path, tracked = _parts(url)
+    if not tracked:
+        return await _orig(self, method, url, *args, **kwargs)
+
+    retries = RL_MAX_429_RETRIES if _replayable(kwargs) else 0
+    attempt = 0
+    granted = False
+    while True:
+        if not granted:
+            await (_fast if _PREFLIGHT_TRIVIAL else _full)(host, path)
+        resp = await _orig(self, method, url, *args, **kwargs)
+        status = getattr(resp, "status_code", 0)
+        if status != 429:
+            if ADAPTIVE_RATE and 200 <= status < 300:
+                _limiter(host, path).on_success()
+            return resp
+        _on_429(resp, host, path)
+        if attempt >= retries:
+            return resp
+        wait, from_server = _wait_429(resp, attempt)
+        if wait is None:
+            return resp
+        attempt += 1
+        _warn("httpx_rate_limit_patch: 429 retry %d/%d in %.2fs", attempt, retries, wait)
+        await resp.aclose()
+        await _sleep(wait)
+        # Отстояли Retry-After сервера — повтор идёт без повторного acquire; общее расписание хоста
+        # (пенальти, очередь остальных) не трогаем
+        granted = from_server
+
+def _patched_sync_request(self: httpx.Client, method: str, url, *args,
+                          _orig=_orig_sync_request, _parts=_url_parts,
+                          _replayable=_is_replayable, _limiter=_get_limiter,
+                          _on_429=_on_tracked_429, _wait_429=_retry_429_wait,
+                          _fast=_preflight_fast_sync, _full=_preflight_full_sync,
+                          _sleep=time.sleep, _warn=_log.warning, **kwargs):
+    url, host, path, tracked = _parts(url)
+    if not tracked:
+        return _orig(self, method, url, *args, **kwargs)
+
+    retries = RL_MAX_429_RETRIES if _replayable(kwargs) else 0
+    attempt = 0
+    granted = False
+    while True:
+        if not granted:
+            (_fast if _PREFLIGHT_TRIVIAL else _full)(host, path)
+        resp = _orig(self, method, url, *args, **kwargs)
+        status = getattr(resp, "status_code", 0)
+        if status != 429:
+            if ADAPTIVE_RATE and 200 <= status < 300:
+                _limiter(host, path).on_success()
+            return resp
+        _on_429(resp, host, path)
+        if attempt >= retries:
+            return resp
+        wait, from_server = _wait_429(resp, attempt)
+        if wait is None:
+            return resp
+        attempt += 1
+        _warn("httpx_rate_limit_patch: 429 retry %d/%d in %.2fs", attempt, retries, wait)
+        resp.close()
+        _sleep(wait)
+        granted = from_server
+
+# ================== ТРАНСПОРТ (альтернатива monkey-patch) ==================
+
+def _after_tracked_response(resp: httpx.Response, host: str, path: str) -> None:
+    status = resp.status_code
+    if status == 429:
+        _on_tracked_429(resp, host, path)
+    elif ADAPTIVE_RATE and 200 <= status < 300:
+        _get_limiter(host, path).on_success()
+
+class OzonRateLimitTransport(httpx.AsyncBaseTransport):
+    """
+    Обёртка над транспортом конкретного AsyncClient: тот же префлайт и учёт 429, что и у патча,
+    но без подмены httpx.AsyncClient.request. Повторов после 429 здесь нет —
+    на уровне send() тело запроса может быть потоком.
+    """
+
+    def __init__(self, inner: httpx.AsyncBaseTransport):
+        self._inner = inner
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        _, host, path, tracked = _url_parts(request.url)
+        if not tracked:
+            return await self._inner.handle_async_request(request)
+        await (_preflight_fast if _PREFLIGHT_TRIVIAL else _preflight_full)(host, path)
+        resp = await self._inner.handle_async_request(request)
+        _after_tracked_response(resp, host, path)
+        return resp
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+class OzonRateLimitSyncTransport(httpx.BaseTransport):
+    """Sync-вариант OzonRateLimitTransport для httpx.Client."""
+
+    def __init__(self, inner: httpx.BaseTransport):
+        self._inner = inner
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        _, host, path, tracked = _url_parts(request.url)
+        if not tracked:
+            return self._inner.handle_request(request)
+        (_preflight_fast_sync if _PREFLIGHT_TRIVIAL else _preflight_full_sync)(host, path)
+        resp = self._inner.handle_request(request)
+        _after_tracked_response(resp, host, path)
+        return resp
+
+    def close(self) -> None:
+        self._inner.close()
+
+def install_on(client: Any) -> Any:
+    """
+    Ставит лимитер на транспорт одного клиента вместо глобального install().
+    Если глобальный патч уже установлен — клиент не трогаем, иначе троттлинг сработает дважды.
+    """
+    if getattr(install, "_installed", False):
+        _log.info("httpx_rate_limit_patch: install_on skipped — global patch already installed")
+        return client
+    inner = client._transport
+    if isinstance(client, httpx.AsyncClient):
+        if not isinstance(inner, OzonRateLimitTransport):
+            client._transport = OzonRateLimitTransport(inner)
+    elif isinstance(client, httpx.Client):
+        if not isinstance(inner, OzonRateLimitSyncTransport):
+            client._transport = OzonRateLimitSyncTransport(inner)
+    return client
 
 # ================== ПУБЛИЧНЫЕ API ==================
 
@@ -658,14 +1240,16 @@ def configure(
     max_create_wait_ms: Optional[int] = None,
     max_sleep_sec: Optional[float] = None,
     max_retry_after_sec: Optional[float] = None,
+    max_429_retries: Optional[int] = None,
     extra_create_endpoints: Optional[List[str]] = None,
 ) -> None:
     """Опциональная конфигурация во время рантайма."""
     global RPM, BURST, PER_SECOND_COOLDOWN, CREATE_GAP, ALIGN_SECOND_BOUNDARY
     global ON429_SKIP_MINUTES, ON429_BLACKLIST_TTL_SEC, FORCE_ROTATE_ON429
     global AVOID_CREATE_SECOND_FOR_OTHERS, AVOID_MARGIN_MS
-    global RL_DISABLE_CREATE_GATE, RL_MAX_CREATE_WAIT_MS, RL_MAX_SLEEP_SEC, RL_MAX_RETRY_AFTER_SEC
-    global CREATE_ENDPOINTS
+    global RL_DISABLE_CREATE_GATE, RL_MAX_CREATE_WAIT_MS, RL_MAX_SLEEP_SEC, RL_MAX_RETRY_AFTER_SEC, RL_MAX_429_RETRIES
+    global _RL_MAX_SLEEP_NS, _BACKOFF_429
+    global CREATE_ENDPOINTS, _PREFLIGHT_TRIVIAL, _AVOID_MARGIN_SEC, _RL_MAX_CREATE_WAIT_SEC
 
     if rpm is not None:
         RPM = int(rpm)
@@ -687,33 +1271,44 @@ def configure(
         AVOID_CREATE_SECOND_FOR_OTHERS = bool(avoid_create_second_for_others)
     if avoid_margin_ms is not None:
         AVOID_MARGIN_MS = max(0, int(avoid_margin_ms))
+        _AVOID_MARGIN_SEC = AVOID_MARGIN_MS / 1000.0
     if disable_create_gate is not None:
         RL_DISABLE_CREATE_GATE = bool(disable_create_gate)
     if max_create_wait_ms is not None:
         RL_MAX_CREATE_WAIT_MS = max(0, int(max_create_wait_ms))
+        _RL_MAX_CREATE_WAIT_SEC = RL_MAX_CREATE_WAIT_MS / 1000.0
     if max_sleep_sec is not None:
         RL_MAX_SLEEP_SEC = max(0.0, float(max_sleep_sec))
+        _RL_MAX_SLEEP_NS = int(RL_MAX_SLEEP_SEC * 1e9)
     if max_retry_after_sec is not None:
         RL_MAX_RETRY_AFTER_SEC = max(0.0, float(max_retry_after_sec))
+    if max_429_retries is not None:
+        RL_MAX_429_RETRIES = max(0, int(max_429_retries))
     if extra_create_endpoints:
-        CREATE_ENDPOINTS |= set(extra_create_endpoints)
+        CREATE_ENDPOINTS = CREATE_ENDPOINTS | frozenset(extra_create_endpoints)
+    _BACKOFF_429 = _build_backoff_429()
+    # Кэш разбора URL держит флаг tracked — сбрасываем при любой переконфигурации
+    _parse_url_cached.cache_clear()
+    _PREFLIGHT_TRIVIAL = _compute_preflight_trivial()
 
 def install():
+    global _PREFLIGHT_TRIVIAL
     if getattr(install, "_installed", False):
         return
+    _PREFLIGHT_TRIVIAL = _compute_preflight_trivial()
     httpx.AsyncClient.request = _patched_async_request  # type: ignore
     httpx.Client.request = _patched_sync_request        # type: ignore
     install._installed = True  # type: ignore
-    logging.info(
+    _log.info(
         "httpx_rate_limit_patch: installed (rpm=%d, burst=%d, per_second_cooldown=%.1fs, create_gap=%.1fs, "
         "slot=%s, slot_offset_ms=%d, cold_start_stagger=%ds, jitter=%dms, align=%s, "
         "on429_skip_minutes=%d, bl_ttl=%ds, force_rotate_on429=%s, avoid_create_second_for_others=%s, avoid_margin_ms=%d, "
-        "disable_create_gate=%s, max_create_wait_ms=%d, max_sleep_sec=%.2f, max_retry_after_sec=%.2f, "
+        "disable_create_gate=%s, max_create_wait_ms=%d, max_sleep_sec=%.2f, max_retry_after_sec=%.2f, max_429_retries=%d, "
         "create_endpoints=%s)",
         RPM, BURST, PER_SECOND_COOLDOWN, CREATE_GAP,
         (CREATE_SLOT_ENV if CREATE_SLOT_ENV != "" else "auto"),
         CREATE_SLOT_OFFSET_MS, CREATE_COLD_START_STAGGER_SEC, JITTER_MS, str(ALIGN_SECOND_BOUNDARY),
         ON429_SKIP_MINUTES, ON429_BLACKLIST_TTL_SEC, str(FORCE_ROTATE_ON429), str(AVOID_CREATE_SECOND_FOR_OTHERS), AVOID_MARGIN_MS,
-        str(RL_DISABLE_CREATE_GATE), RL_MAX_CREATE_WAIT_MS, RL_MAX_SLEEP_SEC, RL_MAX_RETRY_AFTER_SEC,
+        str(RL_DISABLE_CREATE_GATE), RL_MAX_CREATE_WAIT_MS, RL_MAX_SLEEP_SEC, RL_MAX_RETRY_AFTER_SEC, RL_MAX_429_RETRIES,
         sorted(CREATE_ENDPOINTS),
     )
\ No newline at end of file
@@ -1,9 +1,16 @@
+import asyncio
+import atexit
+import inspect
 import json
 import logging
 import os
-from copy import deepcopy
+import random
+import time
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional, Tuple, Set
+from functools import lru_cache
+from collections import deque
+from itertools import repeat
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Set
 
 import httpx
 
@@ -12,28 +19,59 @@ try:
 except Exception:
     ZoneInfo = None  # type: ignore
 
-# Опциональный модуль верхнего слоя
 try:
-    import supply_watch as sw  # noqa: F401
-except Exception:
-    sw = None  # type: ignore
+    import orjson
+except ImportError:
+    orjson = None
+
+if orjson is not None:
+    def _json_bytes(data: Any) -> bytes:
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+else:
+    def _json_bytes(data: Any) -> bytes:
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+
+# Опциональный модуль верхнего слоя — импортируем лениво при первом обращении:
+# процессы, не доходящие до timeslot/booking-кода, не тянут supply_watch со всеми зависимостями
+_UNSET = object()
+_sw_cached: Any = _UNSET
+
+def _get_sw():
+    global _sw_cached
+    if _sw_cached is _UNSET:
+        try:
+            import supply_watch as _sw
+        except Exception:
+            _sw = None
+        _sw_cached = _sw
+    return _sw_cached
 
 logger = logging.getLogger("httpx_timeslot_patch")
 logger.setLevel(logging.INFO)
 
 # === helpers for ENV ===
+_TRUE_VALUES = frozenset(("1", "true", "yes", "y", "on"))
+
+@lru_cache(maxsize=None)
+def _get_bool_env_cached(names: Tuple[str, ...], default: bool) -> bool:
+    for name in names:
+        v = os.getenv(name)
+        if v is not None and v != "":
+            return str(v).strip().lower() in _TRUE_VALUES
+    return bool(default)
+
 def _get_bool_env(*names: str, default: bool = False) -> bool:
     """
     Возвращает bool по первому найденному имени переменной окружения из списка.
     Значения "1,true,yes,y,on" (без учета регистра) считаются True.
     Если ни одна переменная не задана — вернёт default.
+    Результат кэшируется: изменения окружения после первого чтения не видны.
     """
-    for name in names:
-        v = os.getenv(name)
-        if v is not None and v != "":
-            s = str(v).strip().lower()
-            return s in ("1", "true", "yes", "y", "on")
-    return bool(default)
+    return _get_bool_env_cached(names, default)
+
+def _get_list_env(name: str, default: str) -> Tuple[str, ...]:
+    """Список через запятую из окружения; читается один раз при импорте, отдаётся неизменяемым tuple."""
+    return tuple(s.strip() for s in (os.getenv(name, default) or "").split(",") if s.strip())
 
 # === ENV ===
 DROP_ID = int(os.getenv("OZON_DROP_OFF_ID", "0") or "0")
@@ -45,11 +83,9 @@ STRICT_DROP_ONLY = _get_bool_env("STRICT_DROP_ONLY", "SLOT_STRICT_DROP_ONLY", de
 
 DISCOVER_DROPOFFS = _get_bool_env("DISCOVER_DROPOFFS", "OZON_DISCOVER_DROPOFFS", default=False)
 
-FBO_LIST_SUPPLY_TYPES: List[str] = [
-    s.strip()
-    for s in (os.getenv("OZON_FBO_LIST_SUPPLY_TYPES", "WAREHOUSE_SUPPLY_TYPE_FBO") or "").split(",")
-    if s.strip()
-] or ["WAREHOUSE_SUPPLY_TYPE_FBO"]
+FBO_LIST_SUPPLY_TYPES: Tuple[str, ...] = (
+    _get_list_env("OZON_FBO_LIST_SUPPLY_TYPES", "WAREHOUSE_SUPPLY_TYPE_FBO") or ("WAREHOUSE_SUPPLY_TYPE_FBO",)
+)
 
 STUB_FBO_LIST = _get_bool_env("STUB_FBO_LIST", "OZON_STUB_FBO_LIST", default=True)
 USE_CLUSTER_WIDS = _get_bool_env("USE_CLUSTER_WIDS", "OZON_USE_CLUSTER_WIDS", default=True)
@@ -67,23 +103,22 @@ REQUIRE_SUPPLY_ID = _get_bool_env("REQUIRE_SUPPLY_ID", default=False)
 PROGRESS_TASK_ON_BOOK = _get_bool_env("PROGRESS_TASK_ON_BOOK", default=True)
 
 BOOKED_STATUS_NAME = os.getenv("BOOKED_STATUS_NAME", "booked").strip() or "booked"
-BOOKED_ALT_STATUSES = [s.strip() for s in (os.getenv("BOOKED_ALT_STATUSES", "timeslot_booked,slot_booked,booked_ok") or "").split(",") if s.strip()]
+BOOKED_ALT_STATUSES = _get_list_env("BOOKED_ALT_STATUSES", "timeslot_booked,slot_booked,booked_ok")
 
 # Поля статуса, которые пытаемся обновить и по которым проверяем состояние
-BOOKED_STATUS_FIELDS = [s.strip() for s in (os.getenv(
+BOOKED_STATUS_FIELDS = _get_list_env(
     "BOOKED_STATUS_FIELDS",
-    "status,state,phase,stage,step,pipeline_status,current_status,progress,phase_name"
-) or "").split(",") if s.strip()]
+    "status,state,phase,stage,step,pipeline_status,current_status,progress,phase_name",
+)
 
 # Возможные поля идентификатора
-TASK_ID_FIELDS = [s.strip() for s in (os.getenv(
-    "TASK_ID_FIELDS", "id,task_id,uuid,pk,external_id"
-) or "").split(",") if s.strip()]
+TASK_ID_FIELDS = _get_list_env("TASK_ID_FIELDS", "id,task_id,uuid,pk,external_id")
 
 # Кэши
-_DRAFT_CLUSTER_CACHE: Dict[int, List[int]] = {}
+# Кластеры храним tuple: их можно отдавать без копирования
+_DRAFT_CLUSTER_CACHE: Dict[int, Tuple[int, ...]] = {}
 _DRAFT_PRIMARY_WID: Dict[int, int] = {}
-_LAST_CLUSTER: List[int] = []
+_LAST_CLUSTER: Tuple[int, ...] = ()
 _LAST_PRIMARY_WID: Optional[int] = None
 _BOOKED_DRAFTS: Set[int] = set()
 _BOOKED_RESULTS: Dict[int, Dict[str, Any]] = {}
@@ -92,7 +127,140 @@ _BOOKED_RESULTS: Dict[int, Dict[str, Any]] = {}
 _ORIG_SYNC_POST = httpx.Client.post
 _ORIG_ASYNC_POST = httpx.AsyncClient.post
 
+# Собственный пул соединений для служебных запросов автобукинга (supply/create, опрос статуса,
+# supply-order/get). Паузы опроса длиннее стандартного keepalive httpx (5с), и на клиенте
+# вызывающего кода каждый такой запрос заново открывал бы TLS. Только по явному включению:
+# запросы тогда идут мимо транспорта вызывающего клиента (его прокси, verify/cert), а TLS
+# пула задаётся нашими же настройками:
+#   INTERNAL_HTTP_POOL_VERIFY — "1" (по умолчанию, системные CA), "0" — без проверки, иначе путь к CA-бандлу;
+#   INTERNAL_HTTP_POOL_CERT — путь к клиентскому сертификату (PEM), если нужен.
+INTERNAL_HTTP_POOL = _get_bool_env("INTERNAL_HTTP_POOL", "OZON_INTERNAL_HTTP_POOL", default=False)
+
+
+def _internal_pool_verify() -> Any:
+    v = (os.getenv("INTERNAL_HTTP_POOL_VERIFY") or "1").strip()
+    if v.lower() in ("1", "true", "yes", "on"):
+        return True
+    if v.lower() in ("0", "false", "no", "off"):
+        return False
+    return v
+
+
+_INTERNAL_VERIFY = _internal_pool_verify()
+_INTERNAL_CERT = (os.getenv("INTERNAL_HTTP_POOL_CERT") or "").strip() or None
+
+try:
+    import h2  # noqa: F401  (нужен httpx для http2=True)
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+
+_INTERNAL_LIMITS = httpx.Limits(max_keepalive_connections=8, max_connections=16, keepalive_expiry=30.0)
+_internal_sync: Optional[httpx.Client] = None
+_internal_async: Optional[httpx.AsyncClient] = None
+_internal_async_loop: Any = None
+_internal_closing: Set["asyncio.Task[None]"] = set()
+
+
+def _internal_sync_client() -> httpx.Client:
+    global _internal_sync
+    if _internal_sync is None:
+        _internal_sync = httpx.Client(limits=_INTERNAL_LIMITS, http2=_HTTP2, verify=_INTERNAL_VERIFY, cert=_INTERNAL_CERT)
+        atexit.register(_internal_sync.close)
+    return _internal_sync
+
+
+async def _aclose_quietly(client: httpx.AsyncClient) -> None:
+    try:
+        await client.aclose()
+    except Exception as e:
+        # Соединения старого (уже закрытого) цикла могут не закрыться штатно — сокеты добьёт GC
+        logger.debug("internal AsyncClient close failed: %s", e)
+
+
+def _internal_async_client() -> httpx.AsyncClient:
+    # Пул AsyncClient привязан к event loop — при смене цикла закрываем старый и создаём новый
+    global _internal_async, _internal_async_loop
+    loop = asyncio.get_running_loop()
+    if _internal_async is None or _internal_async_loop is not loop:
+        old, old_loop = _internal_async, _internal_async_loop
+        if old is not None:
+            if old_loop is not None and old_loop.is_running():
+                # Старый цикл жив в другом потоке — закрываем его же средствами
+                asyncio.run_coroutine_threadsafe(_aclose_quietly(old), old_loop)
+            else:
+                task = loop.create_task(_aclose_quietly(old))
+                _internal_closing.add(task)
+                task.add_done_callback(_internal_closing.discard)
+        _internal_async = httpx.AsyncClient(limits=_INTERNAL_LIMITS, http2=_HTTP2,
+                                            verify=_INTERNAL_VERIFY, cert=_INTERNAL_CERT)
+        _internal_async_loop = loop
+    return _internal_async
+
+
+async def aclose_internal_clients() -> None:
+    """Закрывает служебные пулы автобукинга; вызывать при остановке event loop."""
+    global _internal_sync, _internal_async, _internal_async_loop
+    client, _internal_async, _internal_async_loop = _internal_async, None, None
+    if client is not None:
+        await _aclose_quietly(client)
+    if _internal_closing:
+        await asyncio.gather(*_internal_closing, return_exceptions=True)
+    if _internal_sync is not None:
+        atexit.unregister(_internal_sync.close)
+        _internal_sync.close()
+        _internal_sync = None
+
+
+def _followup_headers(self: Any, headers: Optional[Dict[str, str]]) -> httpx.Headers:
+    # Те же заголовки, что ушли бы через клиент вызывающего кода (Client-Id/Api-Key могут быть на нём)
+    merged = httpx.Headers(self.headers)
+    if headers:
+        merged.update(headers)
+    return merged
+
+
+def _use_internal_pool(self: Any, url: str) -> bool:
+    # По умолчанию всё идёт через клиент вызывающего кода. При INTERNAL_HTTP_POOL=1 на нём всё равно
+    # остаются относительные URL (base_url клиента), auth, event_hooks, cookies и follow_redirects —
+    # общий пул их не воспроизводит. Смотрим только публичные атрибуты клиента.
+    if not INTERNAL_HTTP_POOL or not url.startswith("https://"):
+        return False
+    hooks = self.event_hooks
+    return (
+        self.auth is None
+        and not self.follow_redirects
+        and not hooks["request"]
+        and not hooks["response"]
+        and not self.cookies
+    )
+
+
+def _followup_post_sync(self: httpx.Client, url: str, json: Any = None, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    if not _use_internal_pool(self, url):
+        return _ORIG_SYNC_POST(self, url, json=json, headers=headers)
+    return _ORIG_SYNC_POST(_internal_sync_client(), url, json=json,
+                           headers=_followup_headers(self, headers), timeout=self.timeout)
+
+
+async def _followup_post_async(self: httpx.AsyncClient, url: str, json: Any = None, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    if not _use_internal_pool(self, url):
+        return await _ORIG_ASYNC_POST(self, url, json=json, headers=headers)
+    return await _ORIG_ASYNC_POST(_internal_async_client(), url, json=json,
+                                  headers=_followup_headers(self, headers), timeout=self.timeout)
+
 # --- helpers ---
+def _shallow_payload_copy(js: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Копия плоского JSON-payload вместо deepcopy: патчи меняют только ключи верхнего уровня,
+    а единственный изменяемый список (warehouse_ids) копируем отдельно.
+    """
+    out = dict(js)
+    wi = js.get("warehouse_ids")
+    if isinstance(wi, list):
+        out["warehouse_ids"] = list(wi)
+    return out
+
 def _has_drop_fields(js: Dict[str, Any]) -> bool:
     return any(k in js for k in ("drop_off_point_warehouse_id", "drop_off_warehouse_id", "dropoff_warehouse_id", "dropoffWarehouseId"))
 
@@ -100,19 +268,39 @@ def _as_utc_iso(dt: datetime) -> str:
     return dt.astimezone(timezone.utc).replace(microsecond=0).isoformat().replace("+00:00", "Z")
 
 
+@lru_cache(maxsize=8)
+def _tz(tzname: str):
+    return ZoneInfo(tzname) if ZoneInfo else None
+
+
+# (days, tzname) -> (monotonic-срок годности, date_from, date_to); окно меняется не чаще раза в секунду
+_WINDOW_CACHE: Dict[Tuple[int, str], Tuple[float, str, str]] = {}
+_WINDOW_TTL_SEC = 1.0
+
+
 def _compute_window_now_local(days: int, tzname: str) -> Tuple[str, str]:
-    tz = ZoneInfo(tzname) if ZoneInfo else None
+    key = (days, tzname)
+    mono = time.monotonic()
+    hit = _WINDOW_CACHE.get(key)
+    if hit is not None and mono < hit[0]:
+        return hit[1], hit[2]
+    tz = _tz(tzname)
     now_utc = datetime.now(timezone.utc)
     if tz:
         now_local = now_utc.astimezone(tz)
         start_local = (now_local + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
         end_local = start_local + timedelta(days=days) - timedelta(seconds=1)
-        return _as_utc_iso(start_local), _as_utc_iso(end_local)
-    return _as_utc_iso(now_utc), _as_utc_iso(now_utc + timedelta(days=days))
+        df, dt = _as_utc_iso(start_local), _as_utc_iso(end_local)
+    else:
+        df, dt = _as_utc_iso(now_utc), _as_utc_iso(now_utc + timedelta(days=days))
+    _WINDOW_CACHE[key] = (mono + _WINDOW_TTL_SEC, df, dt)
+    return df, dt
 
 
-def _extract_cluster_and_primary(resp_json: Dict[str, Any]) -> Tuple[List[int], Optional[int]]:
-    out: List[int] = []
+def _extract_cluster_and_primary(resp_json: Dict[str, Any]) -> Tuple[Tuple[int, ...], Optional[int]]:
+    # Дедупликация прямо в проходе по кластерам — без промежуточного списка всех id
+    uniq: List[int] = []
+    seen: Set[int] = set()
     primary: Optional[int] = None
     try:
         clusters = resp_json.get("clusters") or []
@@ -124,33 +312,62 @@ def _extract_cluster_and_primary(resp_json: Dict[str, Any]) -> Tuple[List[int],
                 wid = sws.get("warehouse_id")
                 if isinstance(wid, int):
                     ids.append(wid)
+                    if wid not in seen:
+                        seen.add(wid)
+                        uniq.append(wid)
             if ids:
                 logger.info("create/info cluster cache: %s", ids)
-                out.extend(ids)
                 if primary is None:
                     primary = ids[0]
     except Exception as e:
         logger.warning("create/info parse error: %s", e)
-    seen = set()
-    uniq: List[int] = []
-    for wid in out:
-        if wid not in seen:
-            uniq.append(wid)
-            seen.add(wid)
-    return uniq, primary
+    return tuple(uniq), primary
+
+
+class _BodyHead:
+    """
+    Начало тела ответа для сообщений лога. Декодируется только при форматировании записи
+    и только первые n байт — без resp.text, который раскодирует всё тело.
+    """
+    __slots__ = ("_resp", "_n")
+
+    def __init__(self, resp: httpx.Response, n: int = 200):
+        self._resp = resp
+        self._n = n
+
+    def __str__(self) -> str:
+        try:
+            return self._resp.content[:self._n].decode(self._resp.encoding or "utf-8", errors="replace")
+        except Exception:
+            return ""
+
 
+class _JsonLog:
+    """JSON-представление объекта для лога; сериализуется только если запись реально пишется."""
+    __slots__ = ("_obj", "_limit")
 
-def _sanitize_headers_for_raw_json(orig_headers: httpx.Headers) -> httpx.Headers:
-    new_headers = httpx.Headers(orig_headers)
-    for h in ("Content-Encoding", "Transfer-Encoding", "Content-Length"):
-        if h in new_headers:
-            del new_headers[h]
-    new_headers["Content-Type"] = "application/json; charset=utf-8"
-    return new_headers
+    def __init__(self, obj: Any, limit: Optional[int] = None):
+        self._obj = obj
+        self._limit = limit
+
+    def __str__(self) -> str:
+        text = _json_bytes(self._obj).decode("utf-8")
+        return text if self._limit is None else text[:self._limit]
+
+
+_RAW_JSON_DROP_HEADERS = frozenset((b"content-encoding", b"transfer-encoding", b"content-length", b"content-type"))
+_RAW_JSON_CONTENT_TYPE = (b"Content-Type", b"application/json; charset=utf-8")
+
+
+def _sanitize_headers_for_raw_json(orig_headers: httpx.Headers) -> List[Tuple[bytes, bytes]]:
+    # Список сырых пар сразу для httpx.Response(headers=...) — без промежуточной копии httpx.Headers
+    out = [(k, v) for k, v in orig_headers.raw if k.lower() not in _RAW_JSON_DROP_HEADERS]
+    out.append(_RAW_JSON_CONTENT_TYPE)
+    return out
 
 
 def _apply_mod_and_rebuild_response(orig_resp: httpx.Response, data: Dict[str, Any]) -> httpx.Response:
-    content = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    content = _json_bytes(data)
     safe_headers = _sanitize_headers_for_raw_json(orig_resp.headers)
     return httpx.Response(
         status_code=orig_resp.status_code,
@@ -161,7 +378,7 @@ def _apply_mod_and_rebuild_response(orig_resp: httpx.Response, data: Dict[str, A
 
 
 def _synthetic_json_response(url: str, status_code: int, data: Dict[str, Any]) -> httpx.Response:
-    content = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    content = _json_bytes(data)
     req = httpx.Request("POST", url)
     return httpx.Response(
         status_code=status_code,
@@ -171,17 +388,52 @@ def _synthetic_json_response(url: str, status_code: int, data: Dict[str, Any]) -
     )
 
 
+def _to_int_or_none(v: Any) -> Optional[int]:
+    """
+    Идентификатор из JSON как int (или None). Частые случаи (int, строка из цифр) —
+    без try/except; bool идентификатором не считается.
+    """
+    if isinstance(v, int):
+        return None if isinstance(v, bool) else v
+    if isinstance(v, float):
+        # 123.0 из JSON — тот же id; дробные (и inf/nan) идентификатором не считаем
+        return int(v) if v.is_integer() else None
+    if isinstance(v, str):
+        v = v.strip()
+        # Один необязательный знак; isdecimal отсекает «²» и прочие digit-символы, которые int() не примет
+        digits = v[1:] if v[:1] in ("+", "-") else v
+        if not digits.isdecimal():
+            return None
+        try:
+            return int(v)
+        except ValueError:
+            return None
+    if v is None:
+        return None
+    try:
+        return int(v)
+    except Exception:
+        return None
+
+
+def _to_int_list(values: Any) -> List[int]:
+    return [i for i in map(_to_int_or_none, values or ()) if i is not None]
+
+
+def _drop_id_of(it: Any) -> Optional[int]:
+    """drop_off_warehouse_id элемента как int (или None)."""
+    return _to_int_or_none(it.get("drop_off_warehouse_id")) if isinstance(it, dict) else None
+
+
 def _find_drop_item(resp_json: Dict[str, Any], drop_id: int) -> Tuple[Optional[Dict[str, Any]], int]:
     arr = resp_json.get("drop_off_warehouse_timeslots")
     if not isinstance(arr, list):
         return None, 0
+    drop_id = int(drop_id)
     for it in arr:
-        try:
-            if int(it.get("drop_off_warehouse_id")) == int(drop_id):
-                days = (it.get("days") or [])
-                return it, (len(days) if isinstance(days, list) else 0)
-        except Exception:
-            continue
+        if _drop_id_of(it) == drop_id:
+            days = (it.get("days") or [])
+            return it, (len(days) if isinstance(days, list) else 0)
     return None, 0
 
 
@@ -189,10 +441,8 @@ def _summarize_available_dropoffs(resp_json: Dict[str, Any]) -> List[Tuple[int,
     out: List[Tuple[int, int]] = []
     arr = resp_json.get("drop_off_warehouse_timeslots") or []
     for it in arr:
-        did = it.get("drop_off_warehouse_id")
-        try:
-            did = int(did)
-        except Exception:
+        did = _drop_id_of(it)
+        if did is None:
             continue
         days = it.get("days") or []
         out.append((did, len(days) if isinstance(days, list) else 0))
@@ -203,22 +453,26 @@ def _reorder_or_filter_to_drop_only(resp_json: Dict[str, Any]) -> Dict[str, Any]
     arr = resp_json.get("drop_off_warehouse_timeslots")
     if not isinstance(arr, list) or not arr:
         return resp_json
+    drop_id = DROP_ID
     drop_item = None
     others: List[Dict[str, Any]] = []
     for it in arr:
-        try:
-            if int(it.get("drop_off_warehouse_id")) == int(DROP_ID):
-                drop_item = it
-            else:
-                others.append(it)
-        except Exception:
+        if _drop_id_of(it) == drop_id:
+            drop_item = it
+        else:
             others.append(it)
     if drop_item is None:
         logger.warning("no timeslots entry for drop-off %s in response", DROP_ID)
         return resp_json
-    new_arr = [drop_item] if STRICT_DROP_ONLY else [drop_item] + others
-    resp_json_mod = deepcopy(resp_json)
-    resp_json_mod["drop_off_warehouse_timeslots"] = new_arr
+    # Drop-off уже единственный/первый — список не меняется, и вызывающий код отдаст исходный ответ
+    # без пересериализации (он сравнивает результат с входом по is)
+    if (len(arr) == 1) if STRICT_DROP_ONLY else (arr[0] is drop_item and len(others) == len(arr) - 1):
+        resp_json_mod = resp_json
+    else:
+        new_arr = [drop_item] if STRICT_DROP_ONLY else [drop_item] + others
+        # Меняется только верхний ключ со списком — вложенные day/slot-словари отдаём как есть
+        resp_json_mod = dict(resp_json)
+        resp_json_mod["drop_off_warehouse_timeslots"] = new_arr
 
     # короткая подсказка в лог
     days = (drop_item.get("days") or [])
@@ -236,6 +490,13 @@ def _reorder_or_filter_to_drop_only(resp_json: Dict[str, Any]) -> Dict[str, Any]
     return resp_json_mod
 
 
+def _inject_drop_fields(js: Dict[str, Any], drop_id: int) -> None:
+    js["drop_off_point_warehouse_id"] = drop_id
+    js.setdefault("drop_off_warehouse_id", drop_id)
+    js.setdefault("dropoff_warehouse_id", drop_id)
+    js.setdefault("dropoffWarehouseId", drop_id)
+
+
 def _build_timeslot_payload(base_js: Dict[str, Any]) -> Tuple[Dict[str, Any], bool]:
     """
     Готовим payload для /v1/draft/timeslot/info.
@@ -245,25 +506,20 @@ def _build_timeslot_payload(base_js: Dict[str, Any]) -> Tuple[Dict[str, Any], bo
       Если DISABLE_TS_FALLBACK=False — можно мягко подставить drop, если его нет.
     Возвращаем (payload, mode_is_drop).
     """
-    js = deepcopy(base_js) if base_js else {}
+    js = _shallow_payload_copy(base_js) if base_js else {}
 
     had_drop = _has_drop_fields(js)
-    if DROP_ID:
+    drop_id = DROP_ID
+    if drop_id:
         if STRICT_DROP_ONLY:
             if not had_drop:
-                js["drop_off_point_warehouse_id"] = int(DROP_ID)
-                js.setdefault("drop_off_warehouse_id", int(DROP_ID))
-                js.setdefault("dropoff_warehouse_id", int(DROP_ID))
-                js.setdefault("dropoffWarehouseId", int(DROP_ID))
+                _inject_drop_fields(js, drop_id)
             mode_is_drop = True
         else:
             if not had_drop:
                 if not DISABLE_TS_FALLBACK:
                     # мягкий фоллбэк разрешён
-                    js["drop_off_point_warehouse_id"] = int(DROP_ID)
-                    js.setdefault("drop_off_warehouse_id", int(DROP_ID))
-                    js.setdefault("dropoff_warehouse_id", int(DROP_ID))
-                    js.setdefault("dropoffWarehouseId", int(DROP_ID))
+                    _inject_drop_fields(js, drop_id)
                     mode_is_drop = True
                 else:
                     # warehouse-режим — не подставляем drop
@@ -293,14 +549,14 @@ def _normalize_warehouse_ids_with_cluster(js: Dict[str, Any]) -> Tuple[Dict[str,
     except Exception:
         draft_id = None
 
-    if draft_id and draft_id in _DRAFT_CLUSTER_CACHE:
-        cluster = list(_DRAFT_CLUSTER_CACHE[draft_id])
+    cluster = _DRAFT_CLUSTER_CACHE.get(draft_id) if draft_id else None
+    if cluster is not None:
         primary = _DRAFT_PRIMARY_WID.get(draft_id)
     else:
-        cluster = list(_LAST_CLUSTER)
+        cluster = _LAST_CLUSTER
         primary = _LAST_PRIMARY_WID
         if draft_id and cluster:
-            _DRAFT_CLUSTER_CACHE[draft_id] = list(cluster)
+            _DRAFT_CLUSTER_CACHE[draft_id] = cluster
             if primary is not None:
                 _DRAFT_PRIMARY_WID[draft_id] = int(primary)
             logger.info("bind draft_id=%s to LAST_CLUSTER (size=%s) and PRIMARY=%s", draft_id, len(cluster), primary)
@@ -308,16 +564,11 @@ def _normalize_warehouse_ids_with_cluster(js: Dict[str, Any]) -> Tuple[Dict[str,
     if not cluster:
         return js, False
 
-    js2 = deepcopy(js)
-    req_ids = js2.get("warehouse_ids") or []
-    norm_req: List[int] = []
-    for x in req_ids:
-        try:
-            norm_req.append(int(x))
-        except Exception:
-            continue
+    js2 = _shallow_payload_copy(js)
+    norm_req = _to_int_list(js2.get("warehouse_ids"))
 
-    cluster_set = set(int(x) for x in cluster)
+    # Кластер уже из int (см. _extract_cluster_and_primary)
+    cluster_set = set(cluster)
 
     if not norm_req:
         js2["warehouse_ids"] = list(cluster_set)
@@ -341,7 +592,7 @@ def _normalize_warehouse_ids_with_cluster(js: Dict[str, Any]) -> Tuple[Dict[str,
 
 
 def _patch_fbo_list_payload(base_js: Dict[str, Any]) -> Dict[str, Any]:
-    js = deepcopy(base_js) if base_js else {}
+    js = _shallow_payload_copy(base_js) if base_js else {}
     f = js.get("filter_by_supply_type")
     if not isinstance(f, list) or len(f) == 0:
         js["filter_by_supply_type"] = list(FBO_LIST_SUPPLY_TYPES)
@@ -363,12 +614,7 @@ def _make_fbo_stub_payload() -> Dict[str, Any]:
 def _choose_supply_wid(req_js: Dict[str, Any], draft_id: Optional[int], override: Optional[int] = None) -> Optional[int]:
     if override:
         return int(override)
-    ids: List[int] = []
-    for x in (req_js.get("warehouse_ids") or []):
-        try:
-            ids.append(int(x))
-        except Exception:
-            continue
+    ids = _to_int_list(req_js.get("warehouse_ids"))
     if len(ids) == 1:
         return ids[0]
     if draft_id and draft_id in _DRAFT_PRIMARY_WID:
@@ -386,13 +632,16 @@ def _parse_dt_maybe_utc(s: Optional[str]) -> Optional[datetime]:
     if not s:
         return None
     try:
-        if s.endswith("Z"):
-            s = s[:-1] + "+00:00"
-        return datetime.fromisoformat(s)
+        return datetime.fromisoformat(s[:-1] + "+00:00" if s[-1:] == "Z" else s)
     except Exception:
         return None
 
 
+# Целевое окно задачи одно и то же на всех ретраях — его разбор кэшируем (datetime неизменяем).
+# Слоты в ответах разные, там по-прежнему обычный _parse_dt_maybe_utc.
+_parse_target_dt = lru_cache(maxsize=256)(_parse_dt_maybe_utc)
+
+
 def _collect_slots(drop_item: Dict[str, Any]) -> List[Tuple[str, str, datetime]]:
     slots: List[Tuple[str, str, datetime]] = []
     try:
@@ -409,49 +658,82 @@ def _collect_slots(drop_item: Dict[str, Any]) -> List[Tuple[str, str, datetime]]
                 slots.append((str(f), str(t), dt.astimezone(timezone.utc).replace(microsecond=0)))
     except Exception:
         pass
-    slots.sort(key=lambda x: x[2])
+    # Без сортировки: _select_slot выбирает линейным проходом/min() по времени начала
     return slots
 
 
+# draft_id -> задачи supply_watch (в порядке list_tasks); живёт _TASKS_BY_DRAFT_TTL_SEC,
+# сбрасывается после любой записи через _call_sw
+_TASKS_BY_DRAFT_TTL_SEC = 1.0
+_tasks_by_draft: Tuple[float, Dict[int, List[Dict[str, Any]]]] = (0.0, {})
+
+
+def _invalidate_tasks_by_draft() -> None:
+    global _tasks_by_draft
+    _tasks_by_draft = (0.0, {})
+
+
+def _tasks_for_draft(draft_id: int) -> List[Dict[str, Any]]:
+    global _tasks_by_draft
+    expires, index = _tasks_by_draft
+    mono = time.monotonic()
+    if mono >= expires:
+        sw = _get_sw()
+        if sw is None:
+            return []
+        try:
+            tasks = sw.list_tasks() or []
+        except Exception:
+            return []
+        index = {}
+        for t in tasks:
+            # Как прежнее int(draft_id) ==: 123, "123", " +123 ", 123.0; «²» и мусор отсеиваются без исключений
+            td = _to_int_or_none(t.get("draft_id")) if isinstance(t, dict) else None
+            if td is not None:
+                index.setdefault(td, []).append(t)
+        _tasks_by_draft = (mono + _TASKS_BY_DRAFT_TTL_SEC, index)
+    return index.get(int(draft_id), [])
+
+
 def _target_from_sw_by_draft(draft_id: Optional[int]) -> Tuple[Optional[str], Optional[str]]:
-    if draft_id is None or sw is None:
+    if draft_id is None:
         return None, None
-    try:
-        for t in sw.list_tasks() or []:
-            try:
-                if int(t.get("draft_id")) == int(draft_id):
-                    f = t.get("desired_from_iso") or t.get("desired_from_in_timezone") or t.get("from_in_timezone")
-                    g = t.get("desired_to_iso") or t.get("desired_to_in_timezone") or t.get("to_in_timezone")
-                    if f and g:
-                        return str(f), str(g)
-            except Exception:
-                continue
-    except Exception:
-        pass
+    for t in _tasks_for_draft(draft_id):
+        f = t.get("desired_from_iso") or t.get("desired_from_in_timezone") or t.get("from_in_timezone")
+        g = t.get("desired_to_iso") or t.get("desired_to_in_timezone") or t.get("to_in_timezone")
+        if f and g:
+            return str(f), str(g)
     return None, None
 
 
+_TARGET_KEY_PAIRS: Tuple[Tuple[str, str], ...] = (
+    ("desired_from_iso", "desired_to_iso"),
+    ("desired_from_in_timezone", "desired_to_in_timezone"),
+    ("target_from", "target_to"),
+    ("from_in_timezone", "to_in_timezone"),
+    ("desiredFromIso", "desiredToIso"),
+    ("desiredFromInTimezone", "desiredToInTimezone"),
+    ("targetFrom", "targetTo"),
+    ("fromInTimezone", "toInTimezone"),
+)
+_TARGET_FROM_KEYS = frozenset(kf for kf, _ in _TARGET_KEY_PAIRS)
+
+
 def _extract_target_from_req(req_js: Dict[str, Any]) -> Tuple[Optional[str], Optional[str]]:
     draft_id = None
     try:
         draft_id = int(req_js.get("draft_id")) if req_js.get("draft_id") is not None else None
     except Exception:
         draft_id = None
-    f_sw, t_sw = _target_from_sw_by_draft(draft_id)
-    if f_sw and t_sw:
-        return f_sw, t_sw
-
-    keys = [
-        ("desired_from_iso", "desired_to_iso"),
-        ("desired_from_in_timezone", "desired_to_in_timezone"),
-        ("target_from", "target_to"),
-        ("from_in_timezone", "to_in_timezone"),
-        ("desiredFromIso", "desiredToIso"),
-        ("desiredFromInTimezone", "desiredToInTimezone"),
-        ("targetFrom", "targetTo"),
-        ("fromInTimezone", "toInTimezone"),
-    ]
-    for kf, kt in keys:
+    if draft_id is not None:
+        f_sw, t_sw = _target_from_sw_by_draft(draft_id)
+        if f_sw and t_sw:
+            return f_sw, t_sw
+
+    # Обычно в payload нет ни одного ключа окна — отсекаем одним пересечением множеств
+    if _TARGET_FROM_KEYS.isdisjoint(req_js):
+        return None, None
+    for kf, kt in _TARGET_KEY_PAIRS:
         f = req_js.get(kf)
         t = req_js.get(kt)
         if f and t:
@@ -464,118 +746,118 @@ def _select_slot(drop_item: Dict[str, Any], target_from: Optional[str], target_t
     if not slots:
         return None
     if target_from and target_to:
-        tf_dt = _parse_dt_maybe_utc(target_from)
-        tt_dt = _parse_dt_maybe_utc(target_to)
+        tf_dt = _parse_target_dt(target_from)
+        tt_dt = _parse_target_dt(target_to)
         if tf_dt and tt_dt:
             tfu = tf_dt.astimezone(timezone.utc).replace(microsecond=0)
             ttu = tt_dt.astimezone(timezone.utc).replace(microsecond=0)
+            # Один проход: конец слота парсим только у слотов с совпавшим началом
+            exact_start = None
             for f, t, sd in slots:
+                if sd != tfu:
+                    continue
                 td = _parse_dt_maybe_utc(t)
-                if td and sd == tfu and td.astimezone(timezone.utc).replace(microsecond=0) == ttu:
+                if td and td.astimezone(timezone.utc).replace(microsecond=0) == ttu:
                     logger.info("slot selector: exact match by full window")
                     return f, t, "exact"
-            for f, t, sd in slots:
-                if sd == tfu:
-                    logger.info("slot selector: exact match by start")
-                    return f, t, "exact_start"
-            best = None
-            best_diff = None
-            for f, t, sd in slots:
-                diff = abs((sd - tfu).total_seconds())
-                if best is None or diff < best_diff or (diff == best_diff and sd < best[2]):
-                    best = (f, t, sd)
-                    best_diff = diff
-            if best:
-                logger.info("slot selector: nearest match diff=%.0fs", best_diff or -1)
-                return best[0], best[1], "nearest"
-    f, t, _ = slots[0]
+                if exact_start is None:
+                    exact_start = (f, t)
+            if exact_start is not None:
+                logger.info("slot selector: exact match by start")
+                return exact_start[0], exact_start[1], "exact_start"
+            f, t, sd = min(slots, key=lambda x: (abs((x[2] - tfu).total_seconds()), x[2]))
+            logger.info("slot selector: nearest match diff=%.0fs", abs((sd - tfu).total_seconds()) or -1)
+            return f, t, "nearest"
+    f, t, _ = min(slots, key=lambda x: x[2])
     logger.info("slot selector: fallback to first slot")
     return f, t, "first"
 
 
 # ---------- supply/create payload ----------
 
+# Варианты payload supply/create в порядке перебора:
+# (ключ draft, ключ склада, склад списком, ключ from, ключ to, добавлять drop_off)
+_SUPPLY_CREATE_VARIANT_SPECS: Tuple[Tuple[str, str, bool, str, str, bool], ...] = (
+    ("draft_id", "warehouse_id", False, "from_in_timezone", "to_in_timezone", True),
+    ("draft_id", "warehouse_id", False, "from_in_timezone", "to_in_timezone", False),
+    ("draft_id", "warehouse_ids", True, "from_in_timezone", "to_in_timezone", True),
+    ("draft_id", "warehouse_ids", True, "from_in_timezone", "to_in_timezone", False),
+    ("draftId", "warehouseId", False, "fromInTimezone", "toInTimezone", False),
+    ("draftId", "warehouseIds", True, "fromInTimezone", "toInTimezone", False),
+)
+
+
 def _supply_create_payload_variants(draft_id: int, supply_wid: int, f: str, t: str) -> List[Dict[str, Any]]:
-    v: List[Dict[str, Any]] = []
-    v.append({
-        "draft_id": int(draft_id),
-        "warehouse_id": int(supply_wid),
-        "from_in_timezone": f,
-        "to_in_timezone": t,
-        "drop_off_point_warehouse_id": int(DROP_ID) if DROP_ID else None,
-    })
-    v.append({
-        "draft_id": int(draft_id),
-        "warehouse_id": int(supply_wid),
-        "from_in_timezone": f,
-        "to_in_timezone": t,
-    })
-    v.append({
-        "draft_id": int(draft_id),
-        "warehouse_ids": [int(supply_wid)],
-        "from_in_timezone": f,
-        "to_in_timezone": t,
-        "drop_off_point_warehouse_id": int(DROP_ID) if DROP_ID else None,
-    })
-    v.append({
-        "draft_id": int(draft_id),
-        "warehouse_ids": [int(supply_wid)],
-        "from_in_timezone": f,
-        "to_in_timezone": t,
-    })
-    v.append({
-        "draftId": int(draft_id),
-        "warehouseId": int(supply_wid),
-        "fromInTimezone": f,
-        "toInTimezone": t,
-    })
-    v.append({
-        "draftId": int(draft_id),
-        "warehouseIds": [int(supply_wid)],
-        "fromInTimezone": f,
-        "toInTimezone": t,
-    })
+    draft_id = int(draft_id)
+    supply_wid = int(supply_wid)
+    drop_id = int(DROP_ID) if DROP_ID else None
     out: List[Dict[str, Any]] = []
-    for payload in v:
-        payload2 = {k: v for k, v in payload.items() if v is not None}
-        out.append(payload2)
+    for k_draft, k_wid, wid_list, k_from, k_to, with_drop in _SUPPLY_CREATE_VARIANT_SPECS:
+        payload = {
+            k_draft: draft_id,
+            k_wid: [supply_wid] if wid_list else supply_wid,
+            k_from: f,
+            k_to: t,
+        }
+        # None не кладём сразу — без второго прохода-фильтра
+        if with_drop and drop_id is not None:
+            payload["drop_off_point_warehouse_id"] = drop_id
+        out.append(payload)
     return out
 
 
 # ---------- status parsing ----------
 
-def _deep_find_first_int(obj: Any, key_names: List[str]) -> Optional[int]:
-    keys_lc = [k.lower() for k in key_names]
-    def _walk(o: Any) -> Optional[int]:
-        if isinstance(o, dict):
-            for k, v in o.items():
-                kl = str(k).lower()
-                if kl in keys_lc:
-                    try:
-                        if isinstance(v, bool):
-                            pass
-                        elif isinstance(v, int) and v > 0:
-                            return int(v)
-                        elif isinstance(v, str) and v.isdigit():
-                            return int(v)
-                        elif isinstance(v, list):
-                            for it in v:
-                                if isinstance(it, int) and it > 0:
-                                    return int(it)
-                                if isinstance(it, str) and it.isdigit():
-                                    return int(it)
-                    except Exception:
-                        pass
-                r = _walk(v)
-                if r is not None:
-                    return r
-        elif isinstance(o, list):
-            for it in o:
-                r = _walk(it)
+def _deep_find(obj: Any, key_match: Callable[[Any], bool], pick: Callable[[Any], Optional[int]]) -> Optional[int]:
+    """
+    Обход JSON в глубину (тот же порядок, что у рекурсии: ключ проверяется до спуска в его значение),
+    но на явном стеке итераторов — без кадра Python на каждый узел.
+    """
+    stack = [iter(((None, obj),))]
+    while stack:
+        for k, v in stack[-1]:
+            if k is not None and key_match(k):
+                try:
+                    r = pick(v)
+                except Exception:
+                    r = None
                 if r is not None:
                     return r
+            if isinstance(v, dict):
+                stack.append(iter(v.items()))
+                break
+            if isinstance(v, list):
+                stack.append(zip(repeat(None), v))
+                break
+        else:
+            stack.pop()
+    return None
+
+
+def _pick_positive_int(v: Any) -> Optional[int]:
+    if isinstance(v, bool):
         return None
-    return _walk(obj)
+    if isinstance(v, int) and v > 0:
+        return int(v)
+    if isinstance(v, str) and v.isdigit():
+        return int(v)
+    return None
+
+
+def _pick_positive_int_or_first_in_list(v: Any) -> Optional[int]:
+    if isinstance(v, list):
+        for it in v:
+            if isinstance(it, int) and it > 0:
+                return int(it)
+            if isinstance(it, str) and it.isdigit():
+                return int(it)
+        return None
+    return _pick_positive_int(v)
+
+
+def _deep_find_first_int(obj: Any, key_names: Iterable[str]) -> Optional[int]:
+    keys_lc = frozenset(k.lower() for k in key_names)
+    return _deep_find(obj, lambda k: k in keys_lc or str(k).lower() in keys_lc, _pick_positive_int_or_first_in_list)
 
 
 def _extract_status_and_order(js: Dict[str, Any]) -> Tuple[str, Optional[int]]:
@@ -614,30 +896,30 @@ def _extract_status_and_order(js: Dict[str, Any]) -> Tuple[str, Optional[int]]:
     return status, order_id
 
 
+_SUCCESS_STATES = frozenset((
+    "ok", "done", "completed", "created", "ready", "finished", "completed_success", "succeeded", "success",
+))
+
+
 def _is_success_status(status: str) -> bool:
-    s = (status or "").lower()
-    return ("success" in s) or s in {
-        "ok", "done", "completed", "created", "ready", "finished", "completed_success", "succeeded"
-    }
+    # Точное совпадение или success в начале/конце (SUCCESS, DraftSupplyCreateStatusSuccess, success_...)
+    s = status.lower() if status else ""
+    return s in _SUCCESS_STATES or s.endswith("success") or s.startswith("success")
 
 
 # ---------- timeslot retry helpers ----------
 
 def _candidate_wids_for_retry(draft_id: Optional[int], current_wid: Optional[int]) -> List[int]:
-    if draft_id and draft_id in _DRAFT_CLUSTER_CACHE:
-        cluster = list(_DRAFT_CLUSTER_CACHE[draft_id])
+    cluster = _DRAFT_CLUSTER_CACHE.get(draft_id) if draft_id else None
+    if cluster is not None:
         primary = _DRAFT_PRIMARY_WID.get(draft_id)
     else:
-        cluster = list(_LAST_CLUSTER)
+        cluster = _LAST_CLUSTER
         primary = _LAST_PRIMARY_WID
     out: List[int] = []
     if primary and (current_wid is None or int(primary) != int(current_wid)):
         out.append(int(primary))
     for wid in cluster:
-        try:
-            wid = int(wid)
-        except Exception:
-            continue
         if current_wid is not None and wid == int(current_wid):
             continue
         if wid not in out:
@@ -651,21 +933,16 @@ def _has_slots_for_drop(resp_json: Dict[str, Any], drop_id: int) -> bool:
 
 
 def _timeslot_retry_sync(self: httpx.Client, url: str, base_js: Dict[str, Any], headers: Optional[Dict[str, str]], draft_id: Optional[int]) -> Tuple[Optional[httpx.Response], Optional[Dict[str, Any]], Optional[int]]:
-    cur_ids = base_js.get("warehouse_ids") or []
-    cur_wid = None
-    for x in cur_ids:
-        try:
-            cur_wid = int(x); break
-        except Exception:
-            continue
+    cur_wid = next((i for i in map(_to_int_or_none, base_js.get("warehouse_ids") or ()) if i is not None), None)
     candidates = _candidate_wids_for_retry(draft_id, cur_wid)
+    post = _ORIG_SYNC_POST
     for wid in candidates:
-        js2 = deepcopy(base_js)
+        js2 = _shallow_payload_copy(base_js)
         js2["warehouse_ids"] = [int(wid)]
         logger.warning("timeslot retry: try warehouse_id=%s", wid)
-        resp2 = _ORIG_SYNC_POST(self, url, json=js2, headers=headers)
+        resp2 = post(self, url, json=js2, headers=headers)
         if resp2.status_code != 200:
-            logger.warning("timeslot retry wid=%s HTTP %s: %s", wid, resp2.status_code, (resp2.text or "")[:200])
+            logger.warning("timeslot retry wid=%s HTTP %s: %s", wid, resp2.status_code, _BodyHead(resp2))
             continue
         data2 = resp2.json()
         if _has_slots_for_drop(data2, DROP_ID):
@@ -677,21 +954,16 @@ def _timeslot_retry_sync(self: httpx.Client, url: str, base_js: Dict[str, Any],
 
 
 async def _timeslot_retry_async(self: httpx.AsyncClient, url: str, base_js: Dict[str, Any], headers: Optional[Dict[str, str]], draft_id: Optional[int]) -> Tuple[Optional[httpx.Response], Optional[Dict[str, Any]], Optional[int]]:
-    cur_ids = base_js.get("warehouse_ids") or []
-    cur_wid = None
-    for x in cur_ids:
-        try:
-            cur_wid = int(x); break
-        except Exception:
-            continue
+    cur_wid = next((i for i in map(_to_int_or_none, base_js.get("warehouse_ids") or ()) if i is not None), None)
     candidates = _candidate_wids_for_retry(draft_id, cur_wid)
+    post = _ORIG_ASYNC_POST
     for wid in candidates:
-        js2 = deepcopy(base_js)
+        js2 = _shallow_payload_copy(base_js)
         js2["warehouse_ids"] = [int(wid)]
         logger.warning("timeslot retry(async): try warehouse_id=%s", wid)
-        resp2 = await _ORIG_ASYNC_POST(self, url, json=js2, headers=headers)
+        resp2 = await post(self, url, json=js2, headers=headers)
         if resp2.status_code != 200:
-            logger.warning("timeslot retry(async) wid=%s HTTP %s: %s", wid, resp2.status_code, (resp2.text or "")[:200])
+            logger.warning("timeslot retry(async) wid=%s HTTP %s: %s", wid, resp2.status_code, _BodyHead(resp2))
             continue
         data2 = resp2.json()
         if _has_slots_for_drop(data2, DROP_ID):
@@ -704,31 +976,14 @@ async def _timeslot_retry_async(self: httpx.AsyncClient, url: str, base_js: Dict
 
 # ---------- supply-order details ----------
 
+@lru_cache(maxsize=1024)
+def _is_supply_like_id_key(k: Any) -> bool:
+    kl = str(k).lower()
+    return ("supply" in kl) and ("id" in kl)
+
+
 def _deep_find_supply_like_id(obj: Any) -> Optional[int]:
-    def _walk(o: Any) -> Optional[int]:
-        if isinstance(o, dict):
-            for k, v in o.items():
-                kl = str(k).lower()
-                try:
-                    if ("supply" in kl) and ("id" in kl):
-                        if isinstance(v, bool):
-                            pass
-                        elif isinstance(v, int) and v > 0:
-                            return int(v)
-                        elif isinstance(v, str) and v.isdigit():
-                            return int(v)
-                    r = _walk(v)
-                    if r is not None:
-                        return r
-                except Exception:
-                    continue
-        elif isinstance(o, list):
-            for it in o:
-                r = _walk(it)
-                if r is not None:
-                    return r
-        return None
-    return _walk(obj)
+    return _deep_find(obj, _is_supply_like_id_key, _pick_positive_int)
 
 
 def _extract_supply_order_info(js: Dict[str, Any]) -> Tuple[Optional[str], Optional[int]]:
@@ -793,58 +1048,69 @@ def _extract_supply_order_info(js: Dict[str, Any]) -> Tuple[Optional[str], Optio
     return (None, sid)
 
 
+# Комбинации (endpoint, ключ, id списком) в порядке перебора
+_SUPPLY_ORDER_GET_COMBOS: Tuple[Tuple[str, str, bool], ...] = tuple(
+    (ep, key, as_list)
+    for ep in ("/v2/supply-order/get", "/v1/supply-order/get")
+    for key, as_list in (("order_ids", True), ("order_id", False), ("supply_order_ids", True), ("supply_order_id", False))
+)
+# Индекс последней комбинации, ответившей 200: с неё начинаем следующий перебор
+_supply_order_get_ok_idx = 0
+
+
+def _supply_order_get_attempts(order_id: int) -> List[Tuple[int, str, Dict[str, Any]]]:
+    oid = int(order_id)
+    first = _supply_order_get_ok_idx
+    order = [first] + [i for i in range(len(_SUPPLY_ORDER_GET_COMBOS)) if i != first]
+    out: List[Tuple[int, str, Dict[str, Any]]] = []
+    for i in order:
+        ep, key, as_list = _SUPPLY_ORDER_GET_COMBOS[i]
+        out.append((i, ep, {key: [oid] if as_list else oid}))
+    return out
+
+
 def _supply_order_get_sync(self: httpx.Client, base_url: str, headers: Optional[Dict[str, str]], order_id: int) -> Optional[Dict[str, Any]]:
-    endpoints = ["/v2/supply-order/get", "/v1/supply-order/get"]
-    payloads = [
-        {"order_ids": [int(order_id)]},
-        {"order_id": int(order_id)},
-        {"supply_order_ids": [int(order_id)]},
-        {"supply_order_id": int(order_id)},
-    ]
-    for ep in endpoints:
-        for pl in payloads:
-            try:
-                resp = _ORIG_SYNC_POST(self, base_url + ep, json=pl, headers=headers)
-                if resp.status_code == 200:
-                    logger.info("supply-order/get OK via %s payload=%s", ep, json.dumps(pl, ensure_ascii=False))
-                    return resp.json()
-                else:
-                    logger.warning("supply-order/get HTTP %s via %s payload=%s: %s",
-                                   resp.status_code, ep, pl, (resp.text or "")[:200])
-            except Exception as e:
-                logger.warning("supply-order/get error via %s payload=%s: %s", ep, pl, e)
+    global _supply_order_get_ok_idx
+    post = _followup_post_sync
+    for idx, ep, pl in _supply_order_get_attempts(order_id):
+        try:
+            resp = post(self, base_url + ep, json=pl, headers=headers)
+            if resp.status_code == 200:
+                _supply_order_get_ok_idx = idx
+                logger.info("supply-order/get OK via %s payload=%s", ep, _JsonLog(pl))
+                return resp.json()
+            else:
+                logger.warning("supply-order/get HTTP %s via %s payload=%s: %s",
+                               resp.status_code, ep, pl, _BodyHead(resp))
+        except Exception as e:
+            logger.warning("supply-order/get error via %s payload=%s: %s", ep, pl, e)
     return None
 
 
 async def _supply_order_get_async(self: httpx.AsyncClient, base_url: str, headers: Optional[Dict[str, str]], order_id: int) -> Optional[Dict[str, Any]]:
-    endpoints = ["/v2/supply-order/get", "/v1/supply-order/get"]
-    payloads = [
-        {"order_ids": [int(order_id)]},
-        {"order_id": int(order_id)},
-        {"supply_order_ids": [int(order_id)]},
-        {"supply_order_id": int(order_id)},
-    ]
-    for ep in endpoints:
-        for pl in payloads:
-            try:
-                resp = await _ORIG_ASYNC_POST(self, base_url + ep, json=pl, headers=headers)
-                if resp.status_code == 200:
-                    logger.info("supply-order/get(async) OK via %s payload=%s", ep, json.dumps(pl, ensure_ascii=False))
-                    return resp.json()
-                else:
-                    logger.warning("supply-order/get(async) HTTP %s via %s payload=%s: %s",
-                                   resp.status_code, ep, pl, (resp.text or "")[:200])
-            except Exception as e:
-                logger.warning("supply-order/get(async) error via %s payload=%s: %s", ep, pl, e)
+    global _supply_order_get_ok_idx
+    post = _followup_post_async
+    for idx, ep, pl in _supply_order_get_attempts(order_id):
+        try:
+            resp = await post(self, base_url + ep, json=pl, headers=headers)
+            if resp.status_code == 200:
+                _supply_order_get_ok_idx = idx
+                logger.info("supply-order/get(async) OK via %s payload=%s", ep, _JsonLog(pl))
+                return resp.json()
+            else:
+                logger.warning("supply-order/get(async) HTTP %s via %s payload=%s: %s",
+                               resp.status_code, ep, pl, _BodyHead(resp))
+        except Exception as e:
+            logger.warning("supply-order/get(async) error via %s payload=%s: %s", ep, pl, e)
     return None
 
 
 # ---------- supply_watch integration ----------
 
-_TIMESLOT_SEARCH_VALUES = {
+_TIMESLOT_SEARCH_VALUES = frozenset((
     "timeslot search", "timeslot_search", "search_timeslot", "slot_search",
-    "slotsearch", "timeslot", "ts_search"
-}
+    "slotsearch", "timeslot", "ts_search",
+))
 
 def _task_status_snapshot(task: Dict[str, Any]) -> Dict[str, Any]:
     snap: Dict[str, Any] = {}
@@ -854,29 +1120,20 @@ def _task_status_snapshot(task: Dict[str, Any]) -> Dict[str, Any]:
     return snap
 
 def _is_timeslot_search(task: Dict[str, Any]) -> bool:
-    snap = _task_status_snapshot(task)
-    for v in snap.values():
-        if isinstance(v, str) and v in _TIMESLOT_SEARCH_VALUES:
+    # Без снимка: выходим на первом поле со статусом поиска слота
+    for k in BOOKED_STATUS_FIELDS:
+        v = task.get(k)
+        if isinstance(v, str) and v.lower() in _TIMESLOT_SEARCH_VALUES:
             return True
     return False
 
 def _find_task_by_draft(draft_id: int) -> Optional[Dict[str, Any]]:
-    if sw is None:
-        return None
     try:
-        tasks = sw.list_tasks() or []
+        tasks = _tasks_for_draft(draft_id)
     except Exception:
         return None
-    for t in tasks:
-        try:
-            td = t.get("draft_id")
-            if td is None:
-                continue
-            if str(td).isdigit() and int(td) == int(draft_id):
-                return t
-        except Exception:
-            continue
-    return None
+    # Здесь сверка всегда была строже, чем в _target_from_sw_by_draft: только str(draft_id) из цифр
+    return next((t for t in tasks if str(t.get("draft_id")).isdigit()), None)
 
 def _extract_any_task_id(task: Dict[str, Any]) -> Optional[Any]:
     for key in TASK_ID_FIELDS:
@@ -884,12 +1141,52 @@ def _extract_any_task_id(task: Dict[str, Any]) -> Optional[Any]:
             return task[key]
     return None
 
+@lru_cache(maxsize=64)
+def _sw_call_shape(fn: Callable[..., Any]) -> Optional[Tuple[Optional[int], Optional[frozenset]]]:
+    """
+    (сколько позиционных принимает — None если *args, имена keyword — None если **kwargs).
+    None целиком — сигнатуру узнать нельзя, проверку пропускаем.
+    """
+    try:
+        params = inspect.signature(fn).parameters.values()
+    except (TypeError, ValueError):
+        return None
+    max_pos: Optional[int] = 0
+    names: Optional[Set[str]] = set()
+    for p in params:
+        if p.kind is p.VAR_POSITIONAL:
+            max_pos = None
+        elif p.kind is p.VAR_KEYWORD:
+            names = None
+        else:
+            if p.kind in (p.POSITIONAL_ONLY, p.POSITIONAL_OR_KEYWORD) and max_pos is not None:
+                max_pos += 1
+            if p.kind in (p.POSITIONAL_OR_KEYWORD, p.KEYWORD_ONLY) and names is not None:
+                names.add(p.name)
+    return max_pos, (frozenset(names) if names is not None else None)
+
+
+def _sw_may_accept(fn: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]) -> bool:
+    # Заведомо неподходящие сигнатуры отсекаем сравнением, а не вызовом с TypeError
+    shape = _sw_call_shape(fn)
+    if shape is None:
+        return True
+    max_pos, names = shape
+    if max_pos is not None and len(args) > max_pos:
+        return False
+    return names is None or names.issuperset(kwargs)
+
+
 def _call_sw(fn_name: str, *args, **kwargs) -> bool:
     try:
+        sw = _get_sw()
         fn = getattr(sw, fn_name, None) if sw else None
         if not callable(fn):
             return False
+        if not _sw_may_accept(fn, args, kwargs):
+            return False
         fn(*args, **kwargs)
+        _invalidate_tasks_by_draft()
         logger.info("booking-result persisted via sw.%s%r", fn_name, (args or kwargs))
         return True
     except TypeError:
@@ -897,40 +1194,97 @@ def _call_sw(fn_name: str, *args, **kwargs) -> bool:
     except Exception:
         return False
 
+def _progress_call_args(style: str, task_id_value: Any, status_field: str, status_value: str) -> Tuple[tuple, Dict[str, Any]]:
+    if style == "kw_id":
+        return (), {status_field: status_value, "id": task_id_value}
+    if style == "kw_task_id":
+        return (), {status_field: status_value, "task_id": task_id_value}
+    if style == "dict_id":
+        return ({status_field: status_value, "id": task_id_value},), {}
+    if style == "dict_task_id":
+        return ({status_field: status_value, "task_id": task_id_value},), {}
+    if style == "pos_kw":
+        return (task_id_value,), {status_field: status_value}
+    if style == "pos_dict":
+        return (task_id_value, {status_field: status_value}), {}
+    return (task_id_value, status_value), {}  # "pos_value"
+
+
+# Порядок перебора сигнатур: (метод supply_watch, способ передачи аргументов)
+_PROGRESS_ATTEMPTS: Tuple[Tuple[str, str], ...] = (
+    # update_task(**kwargs) / update_task(payload) / update_task(task_id, **kwargs) / update_task(task_id, payload)
+    ("update_task", "kw_id"), ("update_task", "kw_task_id"),
+    ("update_task", "dict_id"), ("update_task", "dict_task_id"),
+    ("update_task", "pos_kw"), ("update_task", "pos_dict"),
+) + tuple(
+    # Специализированные методы; (task_id, value) — только для set_status/set_stage/advance/complete
+    (method, style)
+    for method in ("set_status", "set_stage", "mark_booked", "advance", "complete", "notify_booked")
+    for style in ("kw_id", "kw_task_id", "dict_id", "dict_task_id")
+    + (("pos_value",) if method in ("set_status", "set_stage", "advance", "complete") else ())
+)
+
+# status_field -> индекс сработавшей попытки в _PROGRESS_ATTEMPTS: следующие бронирования начинают с неё
+_progress_ok_idx: Dict[str, int] = {}
+
+# Что нужно от сигнатуры для каждого способа: (минимум позиционных, обязательное keyword-имя)
+_PROGRESS_STYLE_NEEDS: Dict[str, Tuple[int, Optional[str]]] = {
+    "kw_id": (0, "id"), "kw_task_id": (0, "task_id"),
+    "dict_id": (1, None), "dict_task_id": (1, None),
+    "pos_kw": (1, None), "pos_dict": (2, None), "pos_value": (2, None),
+}
+
+
+_progress_candidates_cache: Tuple[Any, Tuple[int, ...]] = (None, ())
+
+
+def _progress_candidates(sw: Any) -> Tuple[int, ...]:
+    """
+    Индексы _PROGRESS_ATTEMPTS, которые вообще применимы к данному supply_watch:
+    метод существует и его сигнатура допускает такой способ передачи. Считается один раз на объект sw.
+    """
+    global _progress_candidates_cache
+    cached_sw, cached = _progress_candidates_cache
+    if cached_sw is sw:
+        return cached
+    out: List[int] = []
+    for idx, (method, style) in enumerate(_PROGRESS_ATTEMPTS):
+        fn = getattr(sw, method, None)
+        if not callable(fn):
+            continue
+        shape = _sw_call_shape(fn)
+        if shape is not None:
+            max_pos, names = shape
+            need_pos, need_kw = _PROGRESS_STYLE_NEEDS[style]
+            if max_pos is not None and max_pos < need_pos:
+                continue
+            if need_kw is not None and names is not None and need_kw not in names:
+                continue
+        out.append(idx)
+    _progress_candidates_cache = (sw, tuple(out))
+    return _progress_candidates_cache[1]
+
+
 def _try_progress_status(task_id_value: Any, status_field: str, status_value: str) -> bool:
-    # Пробуем разные сигнатуры и методы
-    # 1) update_task(**kwargs)
-    if _call_sw("update_task", **{status_field: status_value, "id": task_id_value}):
-        return True
-    if _call_sw("update_task", **{status_field: status_value, "task_id": task_id_value}):
-        return True
-    # 2) update_task(payload)
-    if _call_sw("update_task", {status_field: status_value, "id": task_id_value}):
-        return True
-    if _call_sw("update_task", {status_field: status_value, "task_id": task_id_value}):
-        return True
-    # 3) update_task(task_id, **kwargs)
-    if _call_sw("update_task", task_id_value, **{status_field: status_value}):
-        return True
-    # 4) update_task(task_id, payload_dict)
-    if _call_sw("update_task", task_id_value, {status_field: status_value}):
-        return True
-    # 5) Специализированные методы
-    for method in ("set_status", "set_stage", "mark_booked", "advance", "complete", "notify_booked"):
-        # kwargs с id
-        if _call_sw(method, **{status_field: status_value, "id": task_id_value}):
-            return True
-        if _call_sw(method, **{status_field: status_value, "task_id": task_id_value}):
+    cached = _progress_ok_idx.get(status_field)
+    if cached is not None:
+        method, style = _PROGRESS_ATTEMPTS[cached]
+        args, kwargs = _progress_call_args(style, task_id_value, status_field, status_value)
+        if _call_sw(method, *args, **kwargs):
             return True
-        # dict payload
-        if _call_sw(method, {status_field: status_value, "id": task_id_value}):
-            return True
-        if _call_sw(method, {status_field: status_value, "task_id": task_id_value}):
+        # Сигнатура перестала подходить — забываем и перебираем заново
+        _progress_ok_idx.pop(status_field, None)
+    sw = _get_sw()
+    if sw is None:
+        return False
+    for idx in _progress_candidates(sw):
+        if idx == cached:
+            continue
+        method, style = _PROGRESS_ATTEMPTS[idx]
+        args, kwargs = _progress_call_args(style, task_id_value, status_field, status_value)
+        if _call_sw(method, *args, **kwargs):
+            _progress_ok_idx[status_field] = idx
             return True
-        # сигнатура (task_id, value) — для set_status/set_stage/advance/complete
-        if method in ("set_status", "set_stage", "advance", "complete"):
-            if _call_sw(method, task_id_value, status_value):
-                return True
     return False
 
 
@@ -962,7 +1316,7 @@ def _persist_booking_result(
         draft_id, order_id, number, supply_id, slot_from, slot_to, supply_wid
     )
 
-    if sw is None or not PROGRESS_TASK_ON_BOOK:
+    if not PROGRESS_TASK_ON_BOOK or _get_sw() is None:
         return
 
     task = _find_task_by_draft(draft_id)
@@ -1047,41 +1401,103 @@ def _persist_booking_result(
 
 # ---------- poll supply/create ----------
 
-def _poll_supply_create_status_sync(self: httpx.Client, base_url: str, op_id: str, headers: Optional[Dict[str, str]]) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+# Опрос статуса: первая попытка сразу, дальше экспоненциальные паузы с джиттером ±20%
+# в пределах общего бюджета ожидания (раньше — 60 попыток раз в 2с, те же ~120с)
+STATUS_POLL_START_SEC = 0.5
+STATUS_POLL_FACTOR = 1.6
+STATUS_POLL_CAP_SEC = 8.0
+STATUS_POLL_BUDGET_SEC = float(os.getenv("SUPPLY_STATUS_POLL_BUDGET_SEC", "120") or "120")
+
+
+# Наблюдаемое время до готовности supply/create (от первого опроса) по складу поставки.
+# Когда выборка набрана, опросы ставятся в её квантили — гуще там, где операции обычно завершаются.
+_STATUS_DONE_MAXLEN = 200
+_STATUS_DONE_MIN_SAMPLES = 20
+_STATUS_DONE_QUANTILES = (0.1, 0.25, 0.4, 0.55, 0.7, 0.8, 0.9, 0.95, 0.99)
+_status_done_samples: Dict[Optional[int], Deque[float]] = {}
+
+
+def _record_status_done(key: Optional[int], miss_at: float, hit_at: float) -> None:
+    # Точный момент готовности неизвестен: он где-то между последним опросом «ещё нет» и первым «готово».
+    # Пишем середину интервала — момент удачного опроса сам стоит в квантиле расписания и
+    # раз за разом тянул бы выборку вверх, не давая увидеть более ранние завершения.
+    dq = _status_done_samples.get(key)
+    if dq is None:
+        dq = _status_done_samples[key] = deque(maxlen=_STATUS_DONE_MAXLEN)
+    dq.append((miss_at + hit_at) / 2.0)
+
+
+def _status_poll_delays(key: Optional[int] = None) -> Iterator[float]:
+    yield 0.0
+    total = 0.0
+    base = STATUS_POLL_START_SEC
+    samples = _status_done_samples.get(key)
+    if samples is not None and len(samples) >= _STATUS_DONE_MIN_SAMPLES:
+        ordered = sorted(samples)
+        n = len(ordered)
+        for q in _STATUS_DONE_QUANTILES:
+            at = ordered[min(n - 1, int(q * n))]
+            delay = at - total
+            # Соседние квантили ближе минимальной паузы — не опрашиваем чаще, чем раз в START
+            if delay < STATUS_POLL_START_SEC:
+                continue
+            if at > STATUS_POLL_BUDGET_SEC:
+                # Квантиль за бюджетом — добираем остаток бюджета экспоненциальным хвостом
+                break
+            total = at
+            yield delay * random.uniform(0.9, 1.1)
+            base = min(max(base, delay), STATUS_POLL_CAP_SEC)
+    # Хвост распределения (или выборки ещё нет) — экспоненциальные паузы
+    while True:
+        delay = base * random.uniform(0.8, 1.2)
+        total += delay
+        if total > STATUS_POLL_BUDGET_SEC:
+            return
+        yield delay
+        base = min(base * STATUS_POLL_FACTOR, STATUS_POLL_CAP_SEC)
+
+
+def _poll_supply_create_status_sync(self: httpx.Client, base_url: str, op_id: str, headers: Optional[Dict[str, str]], stats_key: Optional[int] = None) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
     url = base_url + "/v1/draft/supply/create/status"
-    for attempt in range(1, 61):
-        resp = _ORIG_SYNC_POST(self, url, json={"operation_id": op_id}, headers=headers)
+    started = time.monotonic()
+    miss_at = 0.0
+    for attempt, delay in enumerate(_status_poll_delays(stats_key), 1):
+        if delay:
+            time.sleep(delay)
+        sent_at = time.monotonic() - started
+        resp = _followup_post_sync(self, url, json={"operation_id": op_id}, headers=headers)
         if resp.status_code != 200:
-            logger.warning("supply/status HTTP %s: %s", resp.status_code, resp.text[:200])
+            logger.warning("supply/status HTTP %s: %s", resp.status_code, _BodyHead(resp))
         else:
             js = resp.json()
             status, order_id = _extract_status_and_order(js)
             logger.info("supply/status attempt=%d status=%r order_id=%s", attempt, status, order_id)
             if order_id is not None or _is_success_status(status):
+                _record_status_done(stats_key, miss_at, sent_at)
                 return js, order_id
-        try:
-            import time as _t; _t.sleep(2.0)
-        except Exception:
-            pass
+            miss_at = sent_at
     return None, None
 
 
-async def _poll_supply_create_status_async(self: httpx.AsyncClient, base_url: str, op_id: str, headers: Optional[Dict[str, str]]) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
+async def _poll_supply_create_status_async(self: httpx.AsyncClient, base_url: str, op_id: str, headers: Optional[Dict[str, str]], stats_key: Optional[int] = None) -> Tuple[Optional[Dict[str, Any]], Optional[int]]:
     url = base_url + "/v1/draft/supply/create/status"
-    for attempt in range(1, 61):
-        resp = await _ORIG_ASYNC_POST(self, url, json={"operation_id": op_id}, headers=headers)
+    started = time.monotonic()
+    miss_at = 0.0
+    for attempt, delay in enumerate(_status_poll_delays(stats_key), 1):
+        if delay:
+            await asyncio.sleep(delay)
+        sent_at = time.monotonic() - started
+        resp = await _followup_post_async(self, url, json={"operation_id": op_id}, headers=headers)
         if resp.status_code != 200:
-            logger.warning("supply/status(async) HTTP %s: %s", resp.status_code, resp.text[:200])
+            logger.warning("supply/status(async) HTTP %s: %s", resp.status_code, _BodyHead(resp))
         else:
             js = resp.json()
             status, order_id = _extract_status_and_order(js)
             logger.info("supply/status(async) attempt=%d status=%r order_id=%s", attempt, status, order_id)
             if order_id is not None or _is_success_status(status):
+                _record_status_done(stats_key, miss_at, sent_at)
                 return js, order_id
-        try:
-            import asyncio; await asyncio.sleep(2.0)
-        except Exception:
-            pass
+            miss_at = sent_at
     return None, None
 
 
@@ -1122,19 +1538,19 @@ def _maybe_autobook_supply_sync(self: httpx.Client, timeslot_url: str, req_js: D
 
     op_id = None
     for idx, payload in enumerate(variants, 1):
-        logger.info("auto-book: POST %s variant #%s %s", create_url, idx, json.dumps(payload, ensure_ascii=False))
-        resp = _ORIG_SYNC_POST(self, create_url, json=payload, headers=headers)
+        logger.info("auto-book: POST %s variant #%s %s", create_url, idx, _JsonLog(payload))
+        resp = _followup_post_sync(self, create_url, json=payload, headers=headers)
         if resp.status_code == 200:
             op_id = resp.json().get("operation_id")
             if op_id:
                 break
-        logger.warning("auto-book: supply/create HTTP %s: %s", resp.status_code, resp.text[:200])
+        logger.warning("auto-book: supply/create HTTP %s: %s", resp.status_code, _BodyHead(resp))
 
     if not op_id:
         logger.warning("auto-book: supply/create failed for all payload variants")
         return
 
-    st, order_id = _poll_supply_create_status_sync(self, base, op_id, headers)
+    st, order_id = _poll_supply_create_status_sync(self, base, op_id, headers, stats_key=supply_wid)
     if st is None:
         logger.warning("auto-book: supply/create/status timeout")
         return
@@ -1153,7 +1569,7 @@ def _maybe_autobook_supply_sync(self: httpx.Client, timeslot_url: str, req_js: D
     else:
         _BOOKED_DRAFTS.add(draft_id)
         logger.warning("auto-book: SUCCESS status without single order_id. Raw response: %s",
-                       json.dumps(st, ensure_ascii=False)[:800])
+                       _JsonLog(st, 800))
 
 
 async def _maybe_autobook_supply_async(self: httpx.AsyncClient, timeslot_url: str, req_js: Dict[str, Any], resp_data: Dict[str, Any], headers: Optional[Dict[str, str]], override_wid: Optional[int] = None) -> None:
@@ -1191,19 +1607,19 @@ async def _maybe_autobook_supply_async(self: httpx.AsyncClient, timeslot_url: st
 
     op_id = None
     for idx, payload in enumerate(variants, 1):
-        logger.info("auto-book(async): POST %s variant #%s %s", create_url, idx, json.dumps(payload, ensure_ascii=False))
-        resp = await _ORIG_ASYNC_POST(self, create_url, json=payload, headers=headers)
+        logger.info("auto-book(async): POST %s variant #%s %s", create_url, idx, _JsonLog(payload))
+        resp = await _followup_post_async(self, create_url, json=payload, headers=headers)
         if resp.status_code == 200:
             op_id = resp.json().get("operation_id")
             if op_id:
                 break
-        logger.warning("auto-book(async): supply/create HTTP %s: %s", resp.status_code, resp.text[:200])
+        logger.warning("auto-book(async): supply/create HTTP %s: %s", resp.status_code, _BodyHead(resp))
 
     if not op_id:
         logger.warning("auto-book(async): supply/create failed for all payload variants")
         return
 
-    st, order_id = await _poll_supply_create_status_async(self, base, op_id, headers)
+    st, order_id = await _poll_supply_create_status_async(self, base, op_id, headers, stats_key=supply_wid)
     if st is None:
         logger.warning("auto-book(async): supply/create/status timeout")
         return
@@ -1222,7 +1638,7 @@ async def _maybe_autobook_supply_async(self: httpx.AsyncClient, timeslot_url: st
     else:
         _BOOKED_DRAFTS.add(draft_id)
         logger.warning("auto-book(async): SUCCESS status without single order_id. Raw response: %s",
-                       json.dumps(st, ensure_ascii=False)[:800])
+                       _JsonLog(st, 800))
 
 
 # ---------- httpx patches ----------
@@ -1246,11 +1662,11 @@ def _install_sync_post_patch():
             if url.endswith("/v1/draft/create"):
                 js = kwargs.get("json") or {}
                 if DROP_ID and js.get("drop_off_point_warehouse_id") != int(DROP_ID):
-                    js = deepcopy(js)
+                    js = _shallow_payload_copy(js)
                     js["drop_off_point_warehouse_id"] = int(DROP_ID)
                     kwargs["json"] = js
                     logger.info("inject drop_off_point_warehouse_id=%s into draft/create", DROP_ID)
-                    logger.info("final json(draft/create) payload: %s", json.dumps(js, ensure_ascii=False))
+                    logger.info("final json(draft/create) payload: %s", _JsonLog(js))
                 return _ORIG_SYNC_POST(self, url, *args, **kwargs)
 
             if url.endswith("/v1/draft/create/info"):
@@ -1283,9 +1699,9 @@ def _install_sync_post_patch():
                 js, mode_is_drop = _build_timeslot_payload(js)
                 js, changed = _normalize_warehouse_ids_with_cluster(js)
                 if changed:
-                    logger.warning("final json(timeslot/info) payload adjusted by cluster: %s", json.dumps(js, ensure_ascii=False))
+                    logger.warning("final json(timeslot/info) payload adjusted by cluster: %s", _JsonLog(js))
                 else:
-                    logger.info("final json(timeslot/info) payload: %s", json.dumps(js, ensure_ascii=False))
+                    logger.info("final json(timeslot/info) payload: %s", _JsonLog(js))
                 kwargs["json"] = js
 
                 resp = _ORIG_SYNC_POST(self, url, *args, **kwargs)
@@ -1324,7 +1740,7 @@ def _install_sync_post_patch():
 
                     drop_item, _ = _find_drop_item(mod, DROP_ID)
                     if (not DISABLE_TS_FALLBACK) and drop_item is None and DISCOVER_DROPOFFS:
-                        discover_js = deepcopy(js)
+                        discover_js = _shallow_payload_copy(js)
                         discover_js.pop("drop_off_warehouse_id", None)
                         discover_js.pop("drop_off_point_warehouse_id", None)
                         discover_js.pop("dropoff_warehouse_id", None)
@@ -1336,7 +1752,7 @@ def _install_sync_post_patch():
                             summary = _summarize_available_dropoffs(fb_data)
                             logger.warning("available drop-offs for warehouse_ids=%s: %s", js.get("warehouse_ids"), summary)
                         else:
-                            logger.warning("timeslot discover HTTP %s: %s", fb_resp.status_code, fb_resp.text[:200])
+                            logger.warning("timeslot discover HTTP %s: %s", fb_resp.status_code, _BodyHead(fb_resp))
                 except Exception as e:
                     logger.warning("timeslot/info response adjust error: %s", e)
 
@@ -1368,11 +1784,11 @@ def _install_async_post_patch():
             if url.endswith("/v1/draft/create"):
                 js = kwargs.get("json") or {}
                 if DROP_ID and js.get("drop_off_point_warehouse_id") != int(DROP_ID):
-                    js = deepcopy(js)
+                    js = _shallow_payload_copy(js)
                     js["drop_off_point_warehouse_id"] = int(DROP_ID)
                     kwargs["json"] = js
                     logger.info("inject drop_off_point_warehouse_id=%s into draft/create", DROP_ID)
-                    logger.info("final json(draft/create) payload: %s", json.dumps(js, ensure_ascii=False))
+                    logger.info("final json(draft/create) payload: %s", _JsonLog(js))
                 return await _ORIG_ASYNC_POST(self, url, *args, **kwargs)
 
             if url.endswith("/v1/draft/create/info"):
@@ -1405,9 +1821,9 @@ def _install_async_post_patch():
                 js, mode_is_drop = _build_timeslot_payload(js)
                 js, changed = _normalize_warehouse_ids_with_cluster(js)
                 if changed:
-                    logger.warning("final json(timeslot/info) payload adjusted by cluster: %s", json.dumps(js, ensure_ascii=False))
+                    logger.warning("final json(timeslot/info) payload adjusted by cluster: %s", _JsonLog(js))
                 else:
-                    logger.info("final json(timeslot/info) payload: %s", json.dumps(js, ensure_ascii=False))
+                    logger.info("final json(timeslot/info) payload: %s", _JsonLog(js))
                 kwargs["json"] = js
 
                 resp = await _ORIG_ASYNC_POST(self, url, *args, **kwargs)
@@ -1446,7 +1862,7 @@ def _install_async_post_patch():
 
                     drop_item, _ = _find_drop_item(mod, DROP_ID)
                     if (not DISABLE_TS_FALLBACK) and drop_item is None and DISCOVER_DROPOFFS:
-                        discover_js = deepcopy(js)
+                        discover_js = _shallow_payload_copy(js)
                         discover_js.pop("drop_off_warehouse_id", None)
                         discover_js.pop("drop_off_point_warehouse_id", None)
                         discover_js.pop("dropoff_warehouse_id", None)
@@ -1459,7 +1875,7 @@ def _install_async_post_patch():
                             summary = _summarize_available_dropoffs(fb_data)
                             logger.warning("available drop-offs for warehouse_ids=%s: %s", js.get("warehouse_ids"), summary)
                         else:
-                            logger.warning("timeslot discover(async) HTTP %s: %s", fb_resp.status_code, fb_resp.text[:200])
+                            logger.warning("timeslot discover(async) HTTP %s: %s", fb_resp.status_code, _BodyHead(fb_resp))
                 except Exception as e:
                     logger.warning("timeslot/info response adjust error(async): %s", e)
 
@@ -32,6 +32,7 @@ import time
 import uuid
 import threading
 import random
+import sys
 from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple, Callable, Awaitable
 from datetime import datetime, timedelta, timezone
@@ -117,6 +118,9 @@ SUPPLY_CREATE_MAX_RETRY_SECONDS = _getenv_int("SUPPLY_CREATE_MAX_RETRY_SECONDS",
 ORDER_FILL_POLL_INTERVAL_SECONDS = _getenv_int("ORDER_FILL_POLL_INTERVAL_SECONDS", 20)
 ORDER_FILL_MAX_RETRIES = _getenv_int("ORDER_FILL_MAX_RETRIES", 150)
 
+# Отложенная запись задач: правки в пределах окна уходят на диск одним save_tasks()
+TASKS_FLUSH_DELAY_MS = max(0, _getenv_int("TASKS_FLUSH_DELAY_MS", 500))
+
 PROMPT_MIN_INTERVAL = _getenv_int("PROMPT_MIN_INTERVAL", 120)
 
 DROP_OFF_WAREHOUSE_ID = _getenv_int("DROP_ID", 0)
@@ -335,6 +339,9 @@ _tasks_loaded = False
 _tasks: List[Dict[str, Any]] = []
 _lock = asyncio.Lock()
 _sync_lock = threading.RLock()
+_tasks_version = 0  # растёт при каждом save_tasks(); по нему инвалидируются производные индексы
+_short_index: Dict[str, List[Dict[str, Any]]] = {}
+_short_index_key: Optional[Tuple[int, int]] = None
 
 ID_FIELDS = ("id", "task_id", "uuid", "pk", "external_id")
 STATUS_FIELDS = ["status","state","phase","stage","step","pipeline_status","current_status","progress","phase_name"]
@@ -365,11 +372,51 @@ def ensure_loaded():
     _tasks_loaded = True
 
 def save_tasks():
+    global _tasks_version
+    _tasks_version += 1
     SUPPLY_TASK_FILE.parent.mkdir(parents=True, exist_ok=True)
     tmp = SUPPLY_TASK_FILE.with_suffix(".tmp")
     tmp.write_text(json.dumps(_tasks, ensure_ascii=False, indent=2), encoding="utf-8")
     tmp.replace(SUPPLY_TASK_FILE)
 
+_flush_handle: Optional[asyncio.TimerHandle] = None
+_flush_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def flush_tasks():
+    global _flush_handle, _flush_loop
+    with _sync_lock:
+        if _flush_handle is not None:
+            _flush_handle.cancel()
+            _flush_handle = None
+            _flush_loop = None
+        save_tasks()
+
+def mark_dirty(task: Optional[Dict[str, Any]] = None):
+    """
+    Помечает задачи изменёнными (task правился на месте) и планирует одну запись
+    через TASKS_FLUSH_DELAY_MS. Без запущенного event loop пишет сразу.
+    """
+    global _flush_handle, _flush_loop
+    if task is not None:
+        _touch(task)
+    with _sync_lock:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        if _flush_handle is not None:
+            if loop is not None and _flush_loop is loop:
+                return
+            # Таймер от закрытого (или чужого) loop уже не сработает — сбрасываем
+            _flush_handle.cancel()
+            _flush_handle = None
+            _flush_loop = None
+        if loop is None or TASKS_FLUSH_DELAY_MS <= 0:
+            save_tasks()
+            return
+        _flush_handle = loop.call_later(TASKS_FLUSH_DELAY_MS / 1000.0, flush_tasks)
+        _flush_loop = loop
+
 def add_task(task: Dict[str, Any]):
     _tasks.append(task)
     save_tasks()
@@ -533,6 +580,27 @@ def list_tasks() -> List[Dict[str, Any]]:
         active.append(dict(t))
     return active
 
+def resolve_short_id(token: str) -> Optional[str]:
+    """
+    Полный id активной задачи по short(id).
+    Индекс short -> задачи перестраивается только когда менялся список задач.
+    """
+    global _short_index, _short_index_key
+    ensure_loaded()
+    with _sync_lock:
+        key = (_tasks_version, len(_tasks))
+        if _short_index_key != key:
+            idx: Dict[str, List[Dict[str, Any]]] = {}
+            for t in _tasks:
+                tid = t.get("id")
+                if tid:
+                    idx.setdefault(short(str(tid)), []).append(t)
+            _short_index, _short_index_key = idx, key
+        for t in _short_index.get(token, ()):
+            if str(t.get("status") or "").upper() not in (ST_DONE, ST_FAILED, ST_CANCELED):
+                return t.get("id")
+    return None
+
 def purge_tasks(days: int = SUPPLY_PURGE_AGE_DAYS) -> int:
     ensure_loaded()
     if days is None or int(days) <= 0:
@@ -2748,12 +2816,24 @@ def register_supply_scheduler(
 
 async def close_http_client():
     global _HTTP_CLIENT
+    if _flush_handle is not None:
+        try:
+            flush_tasks()
+        except Exception:
+            logging.exception("close_http_client: pending tasks flush failed")
     if _HTTP_CLIENT is not None:
         try:
             await _HTTP_CLIENT.aclose()
         except Exception:
             pass
         _HTTP_CLIENT = None
+    # Служебный пул автобукинга (httpx_timeslot_patch) живёт на том же event loop
+    patch = sys.modules.get("httpx_timeslot_patch")
+    if patch is not None and hasattr(patch, "aclose_internal_clients"):
+        try:
+            await patch.aclose_internal_clients()
+        except Exception:
+            logging.exception("close_http_client: internal pool close failed")
 
 __all__ = [
     "register_supply_scheduler",
@@ -2765,6 +2845,9 @@ __all__ = [
     "purge_all_supplies_now",
     "list_tasks",
     "list_all_tasks",
+    "resolve_short_id",
+    "mark_dirty",
+    "flush_tasks",
     "purge_tasks",
     "purge_all_tasks",
     "purge_stale_nonfinal",
@@ -212,7 +212,10 @@ class SupplyWorker:
         for t in tasks:
             if _is_terminal(t.get("status", "")):
                 continue
-            lock = self._task_locks.setdefault(t["id"], asyncio.Lock())
+            # Лок создаём один раз на задачу, а не новый объект на каждом тике
+            lock = self._task_locks.get(t["id"])
+            if lock is None:
+                lock = self._task_locks[t["id"]] = asyncio.Lock()
             if lock.locked():
                 continue
             async with lock:
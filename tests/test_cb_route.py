@@ -0,0 +1,47 @@
+import os
+from types import SimpleNamespace
+
+import pytest
+
+# bot.py без токена завершает процесс на импорте; сетевых вызовов при импорте нет
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:TEST-TOKEN-for-callback-routing-tests")
+bot = pytest.importorskip("bot")
+
+# Фильтры F.data до таблицы маршрутов: пример callback_data -> обработчик
+BASELINE = {
+    "stockpage:2": "cb_stock_page",
+    "noop": "cb_noop",
+    "action:reanalyze": "cb_reanalyze",
+    "filter:deficit": "cb_filter",
+    "sku:123456": "cb_sku",
+    "whid:ab12cd": "cb_whid",
+    "cluster:Урал": "cb_cluster",
+    "cluster_view:Урал": "cb_cluster_view",
+    "clusters:list": "cb_clusters_list",
+    "chatmode:toggle": "cb_chatmode_toggle",
+    "tasks:refresh": "cb_tasks_refresh",
+    "tasks:close": "cb_tasks_close",
+    "tasks:purge_all": "cb_tasks_purge_all",
+    "tasks:detail:1a2b3c4d": "cb_tasks_detail",
+    # Пустой хвост после префикса старый startswith тоже пропускал
+    "sku:": "cb_sku",
+    "tasks:detail:": "cb_tasks_detail",
+}
+
+
+def _route(data):
+    return bot._cb_route(SimpleNamespace(data=data))
+
+
+@pytest.mark.parametrize("data,handler", sorted(BASELINE.items()))
+def test_baseline_callbacks_route_to_same_handler(data, handler):
+    assert _route(data) == {"cb_handler": getattr(bot, handler)}
+
+
+@pytest.mark.parametrize("data", [
+    "menu_autobook", "autobook:start", "noop:", "stockpage", "tasks:detail", "tasks:other",
+    "clusters:other", "cluster_viewx:1", "chatmode:toggle:1", "Sku:1", "", None,
+])
+def test_foreign_callbacks_fall_through(data):
+    # False — aiogram передаёт апдейт дальше, в подключённые роутеры (autobook_router)
+    assert _route(data) is False
@@ -0,0 +1,113 @@
+import json
+import os
+import time
+
+import pytest
+
+import httpx_rate_limit_patch as rl
+
+
+def _gate(name, tmp_path):
+    # Отдельный подкласс = отдельный «процесс»: свой in-memory кэш поверх общего файла
+    state_file = tmp_path / ".supw_create_gate.json"
+    return type(name, (rl._CrossProcCreateGate,), {
+        "state_file": state_file,
+        "lock_file": tmp_path / ".supw_create_gate.lock",
+        "_state_path": str(state_file),
+        "_tmp_path": str(state_file.with_suffix(".tmp")),
+        "_state_cache": {},
+        "_state_mtime_ns": 0,
+        "_dirty": False,
+        "_last_flush": 0.0,
+    })
+
+
+def _edit(gate, last_ts, sec, exp):
+    st = gate._state_cache
+    gate._blacklist_cleanup(st, time.time())
+    st["CREATE_last_ts"] = max(float(st.get("CREATE_last_ts") or 0.0), last_ts)
+    gate._blacklist_add(st, sec, exp)
+    gate._mark_dirty()
+
+
+_tick = [1_700_000_000_000_000_000]
+
+
+def _flush(gate):
+    gate._flush_if_due(time.monotonic(), force=True)
+    # Грубая гранулярность mtime на некоторых ФС: разводим записи явно
+    _tick[0] += 1_000_000_000
+    os.utime(gate._state_path, ns=(_tick[0], _tick[0]))
+
+
+def test_flushes_from_two_processes_merge(tmp_path):
+    a = _gate("GateA", tmp_path)
+    b = _gate("GateB", tmp_path)
+    far = time.time() + 3600
+
+    _edit(a, 200.0, 5, far)
+    _flush(a)
+    # B не видел запись A и пишет более старую метку: её max и блэклист A должны уцелеть
+    _edit(b, 100.0, 7, far + 10)
+    _flush(b)
+    # A снова пишет поверх файла, про который знает только своё
+    _edit(a, 150.0, 9, far)
+    _flush(a)
+
+    disk = json.loads((tmp_path / ".supw_create_gate.json").read_text(encoding="utf-8"))
+    assert disk["CREATE_last_ts"] == 200.0
+    assert set(disk["CREATE_blacklist"]) == {"5", "7", "9"}
+    assert disk["CREATE_blacklist"]["7"] == far + 10
+    assert disk["CREATE_blacklist_mask"] == (1 << 5) | (1 << 7) | (1 << 9)
+
+    # Чистый читатель получает то же состояние
+    c = _gate("GateC", tmp_path)
+    st = c._get_state()
+    assert st["CREATE_last_ts"] == 200.0
+    assert set(st["CREATE_blacklist"]) == {"5", "7", "9"}
+
+
+def test_merge_keeps_later_expiry_and_max_skip(tmp_path):
+    a = _gate("GateA", tmp_path)
+    now = time.time()
+    a._state_cache.update({
+        "CREATE_last_ts": 300.0,
+        "CREATE_skip_minutes": 1,
+        "CREATE_blacklist": {"3": now + 100},
+    })
+    a._merge_disk_state({
+        "CREATE_last_ts": 250.0,
+        "ORDER_last_ts": 40.0,
+        "CREATE_skip_minutes": 2,
+        "CREATE_blacklist": {"3": now + 500, "4": now - 1},
+        "CREATE_slot": 17,
+    })
+    st = a._state_cache
+    assert st["CREATE_last_ts"] == 300.0
+    assert st["ORDER_last_ts"] == 40.0
+    assert st["CREATE_skip_minutes"] == 2
+    assert st["CREATE_slot"] == 17
+    # Истёкшая секунда 4 выброшена при пересборке, у 3 — дальний expiry
+    assert st["CREATE_blacklist"] == {"3": now + 500}
+    assert st["CREATE_blacklist_mask"] == 1 << 3
+
+
+def test_cap_skip_publishes_send_time_immediately(tmp_path, monkeypatch):
+    if rl.fcntl is None:
+        pytest.skip("no fcntl: gate runs without cross-process state")
+    a = _gate("GateA", tmp_path)
+    a._files_ready = False
+    a._first_create_done = True
+    # Недавняя отправка — ожидание до слота больше капа, сработает ветка без сна
+    a._state_cache = {"CREATE_last_ts": time.time()}
+    a._dirty = True
+    a._flush_if_due(time.monotonic(), force=True)
+    monkeypatch.setattr(rl, "_RL_MAX_CREATE_WAIT_SEC", 0.0)
+    monkeypatch.setattr(rl, "RL_DISABLE_CREATE_GATE", False)
+    a._last_flush = time.monotonic()  # интервал сброса ещё не прошёл
+    before = time.time()
+    a.wait_sync("CREATE", 60.0)
+
+    assert not a._dirty
+    disk = json.loads((tmp_path / ".supw_create_gate.json").read_text(encoding="utf-8"))
+    assert disk["CREATE_last_ts"] >= before
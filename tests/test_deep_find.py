@@ -0,0 +1,112 @@
+import random
+
+import httpx_timeslot_patch as tp
+
+ORDER_KEYS = ["order_id", "orderId", "supply_order_id", "supplyOrderId", "order_ids", "orderIds", "id"]
+
+
+# Рекурсивные версии до перевода на _deep_find — эталон порядка обхода и выбора значения
+def _recursive_first_int(obj, key_names):
+    keys_lc = [k.lower() for k in key_names]
+
+    def _walk(o):
+        if isinstance(o, dict):
+            for k, v in o.items():
+                kl = str(k).lower()
+                if kl in keys_lc:
+                    try:
+                        if isinstance(v, bool):
+                            pass
+                        elif isinstance(v, int) and v > 0:
+                            return int(v)
+                        elif isinstance(v, str) and v.isdigit():
+                            return int(v)
+                        elif isinstance(v, list):
+                            for it in v:
+                                if isinstance(it, int) and it > 0:
+                                    return int(it)
+                                if isinstance(it, str) and it.isdigit():
+                                    return int(it)
+                    except Exception:
+                        pass
+                r = _walk(v)
+                if r is not None:
+                    return r
+        elif isinstance(o, list):
+            for it in o:
+                r = _walk(it)
+                if r is not None:
+                    return r
+        return None
+    return _walk(obj)
+
+
+def _recursive_supply_like_id(obj):
+    def _walk(o):
+        if isinstance(o, dict):
+            for k, v in o.items():
+                kl = str(k).lower()
+                try:
+                    if ("supply" in kl) and ("id" in kl):
+                        if isinstance(v, bool):
+                            pass
+                        elif isinstance(v, int) and v > 0:
+                            return int(v)
+                        elif isinstance(v, str) and v.isdigit():
+                            return int(v)
+                    r = _walk(v)
+                    if r is not None:
+                        return r
+                except Exception:
+                    continue
+        elif isinstance(o, list):
+            for it in o:
+                r = _walk(it)
+                if r is not None:
+                    return r
+        return None
+    return _walk(obj)
+
+
+_KEYS = ["ID", "id", "Order_ID", "orderIds", "supply_id", "SupplyId", "supply", "draft_id",
+         "result", "items", "name", 7]
+_LEAVES = [0, -5, 3, 42, True, False, "17", "0012", "x1", "²", "", None, 1.5]
+
+
+def _payload(rng, depth):
+    roll = rng.random()
+    if depth <= 0 or roll < 0.3:
+        return rng.choice(_LEAVES)
+    if roll < 0.65:
+        return {rng.choice(_KEYS): _payload(rng, depth - 1) for _ in range(rng.randrange(4))}
+    return [_payload(rng, depth - 1) for _ in range(rng.randrange(4))]
+
+
+def test_deep_find_matches_recursive_walk():
+    rng = random.Random(2024)
+    hits = 0
+    for _ in range(3000):
+        js = {"result": _payload(rng, 5)}
+        want = _recursive_first_int(js, ORDER_KEYS)
+        assert tp._deep_find_first_int(js, ORDER_KEYS) == want
+        assert tp._deep_find_supply_like_id(js) == _recursive_supply_like_id(js)
+        hits += want is not None
+    # Выборка не вырожденная: часть payload'ов действительно содержит id
+    assert hits > 300
+
+
+def test_deep_find_keeps_depth_first_order():
+    js = {
+        "result": {"items": [{"meta": {"id": "x0"}}, {"order_ids": ["x", 11]}]},
+        "order_id": 5,
+    }
+    # Ключ проверяется до спуска в значение, соседи — после поддерева
+    assert tp._deep_find_first_int(js, ORDER_KEYS) == 11 == _recursive_first_int(js, ORDER_KEYS)
+    # "²".isdigit(), но int("²") падает — весь список пропускается, как и в рекурсивной версии
+    js["result"]["items"][1]["order_ids"].insert(1, "²")
+    assert tp._deep_find_first_int(js, ORDER_KEYS) == 5 == _recursive_first_int(js, ORDER_KEYS)
+    # "0".isdigit(): строковый ноль, как и раньше, проходит (в отличие от int 0)
+    assert tp._deep_find_first_int({"id": 0, "x": {"id": "0"}}, ["id"]) == 0
+    assert tp._deep_find_first_int({"a": [[{"ID": True}, {"Id": "9"}]], "id": 1}, ["id"]) == 9
+    assert tp._deep_find_supply_like_id({"supply": {"SupplyId": "abc", "x": {"supply_id": 3}}, "supplyId": 4}) == 3
+    assert tp._deep_find_supply_like_id([{"supply_ids": [1, 2]}]) is None
@@ -0,0 +1,76 @@
+import asyncio
+
+import pytest
+
+import httpx_rate_limit_patch as rl
+
+
+def test_concurrent_acquires_are_spaced_by_capped_sleep(monkeypatch):
+    # Пять одновременных acquire при интервале 7.5 с и капе сна 1 с: 0, 1, 2, 3, 4 с
+    monkeypatch.setattr(rl, "_RL_MAX_SLEEP_NS", 1_000_000_000)
+    monkeypatch.setattr(rl.time, "monotonic_ns", lambda: 10_000_000_000)
+    delays = []
+
+    async def fake_sleep(delay):
+        delays.append(delay)
+
+    monkeypatch.setattr(rl.asyncio, "sleep", fake_sleep)
+    lim = rl._HostLimiter(8, 1)
+
+    async def main():
+        await asyncio.gather(*(lim.acquire() for _ in range(5)))
+
+    asyncio.run(main())
+    assert delays == [1.0, 2.0, 3.0, 4.0]
+
+
+def test_capped_burst_does_not_accumulate_debt(monkeypatch):
+    # 200 запросов каждые 1.1 с при RPM=8: сон урезан капом, но после простоя
+    # в один интервал (7.5 с) лимитер должен пропускать без ожидания
+    monkeypatch.setattr(rl, "_RL_MAX_SLEEP_NS", 1_000_000_000)
+    lim = rl._HostLimiter(8, 1)
+    now = 10_000_000_000
+    for _ in range(200):
+        now += 1_100_000_000
+        now += int(lim._reserve(now) * 1e9)
+    assert lim._reserve(now + 7_500_000_000) == 0.0
+
+
+def test_retry_after_is_never_shortened(monkeypatch):
+    monkeypatch.setattr(rl, "RL_MAX_RETRY_AFTER_SEC", 6.0)
+    # Не зависим от .env, который подтягивает импорт bot в соседних тестах
+    monkeypatch.setattr(rl, "PER_SECOND_COOLDOWN", 0.5)
+    resp = rl.httpx.Response(429, headers={"Retry-After": "2"})
+    for _ in range(50):
+        wait, from_server = rl._retry_429_wait(resp, 0)
+        assert from_server and 2.0 <= wait <= 2.5
+    # Пауза сервера длиннее капа — не повторяем вовсе
+    assert rl._retry_429_wait(rl.httpx.Response(429, headers={"Retry-After": "30"}), 0) == (None, True)
+
+
+def _count_429_sends(monkeypatch, **body):
+    monkeypatch.setattr(rl, "RL_MAX_429_RETRIES", 2)
+    sent = []
+
+    def handler(request):
+        sent.append(request.read())
+        return rl.httpx.Response(429, headers={"Retry-After": "0"})
+
+    client = rl.httpx.Client(transport=rl.httpx.MockTransport(handler))
+    noop = lambda host, path: None
+    resp = rl._patched_sync_request(
+        client, "POST", "https://api-seller.ozon.ru/v1/draft/create",
+        _fast=noop, _full=noop, _sleep=lambda s: None, _on_429=lambda r, h, p: None, **body,
+    )
+    assert resp.status_code == 429
+    return sent
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning")
+def test_429_retry_skips_streamed_data(monkeypatch):
+    def chunks():
+        yield b"a=1"
+
+    # Генератор в data= httpx стримит как content= — после первой отправки он пуст
+    assert _count_429_sends(monkeypatch, data=chunks()) == [b"a=1"]
+    assert _count_429_sends(monkeypatch, data={"a": "1"}) == [b"a=1"] * 3
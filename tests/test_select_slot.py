@@ -0,0 +1,86 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+import httpx_timeslot_patch as tp
+
+
+def _sorted_select(drop_item, target_from, target_to):
+    # Версия до линейного прохода: сортировка слотов по началу и три прохода по списку
+    slots = sorted(tp._collect_slots(drop_item), key=lambda x: x[2])
+    if not slots:
+        return None
+    if target_from and target_to:
+        tf_dt = tp._parse_target_dt(target_from)
+        tt_dt = tp._parse_target_dt(target_to)
+        if tf_dt and tt_dt:
+            tfu = tf_dt.astimezone(timezone.utc).replace(microsecond=0)
+            ttu = tt_dt.astimezone(timezone.utc).replace(microsecond=0)
+            for f, t, sd in slots:
+                td = tp._parse_dt_maybe_utc(t)
+                if td and sd == tfu and td.astimezone(timezone.utc).replace(microsecond=0) == ttu:
+                    return f, t, "exact"
+            for f, t, sd in slots:
+                if sd == tfu:
+                    return f, t, "exact_start"
+            best = None
+            best_diff = None
+            for f, t, sd in slots:
+                diff = abs((sd - tfu).total_seconds())
+                if best is None or diff < best_diff or (diff == best_diff and sd < best[2]):
+                    best = (f, t, sd)
+                    best_diff = diff
+            if best:
+                return best[0], best[1], "nearest"
+    f, t, _ = slots[0]
+    return f, t, "first"
+
+
+_BASE = datetime(2025, 3, 10, tzinfo=timezone.utc)
+_TZS = (timezone.utc, timezone(timedelta(hours=5)), timezone(timedelta(hours=3)))
+
+
+def _iso(dt, rng):
+    s = dt.astimezone(rng.choice(_TZS)).isoformat()
+    return s.replace("+00:00", "Z") if rng.random() < 0.5 else s
+
+
+def _drop_item(rng):
+    days = []
+    for _ in range(rng.randrange(1, 4)):
+        slots = []
+        for _ in range(rng.randrange(0, 6)):
+            start = _BASE + timedelta(hours=rng.randrange(48))
+            end = start + timedelta(hours=rng.choice((1, 2)))
+            slots.append({"from_in_timezone": _iso(start, rng), "to_in_timezone": _iso(end, rng)})
+        days.append({"timeslots": slots})
+    return {"days": days}
+
+
+def test_select_slot_matches_sorted_version():
+    rng = random.Random(7)
+    kinds = set()
+    for _ in range(2000):
+        item = _drop_item(rng)
+        start = _BASE + timedelta(hours=rng.randrange(-2, 50), minutes=rng.choice((0, 0, 30)))
+        end = start + timedelta(hours=rng.choice((1, 2)))
+        target = rng.choice(((_iso(start, rng), _iso(end, rng)), (None, None), (_iso(start, rng), "bad")))
+        got = tp._select_slot(item, *target)
+        assert got == _sorted_select(item, *target)
+        if got:
+            kinds.add(got[2])
+    assert kinds == {"exact", "exact_start", "nearest", "first"}
+
+
+def test_select_slot_ties_keep_earliest_then_listed_order():
+    item = {"days": [
+        {"timeslots": [
+            {"from": "2025-03-10T12:00:00Z", "to": "2025-03-10T13:00:00Z"},
+            {"from": "2025-03-10T08:00:00Z", "to": "2025-03-10T09:00:00Z"},
+            {"from": "2025-03-10T13:00:00+05:00", "to": "2025-03-10T14:00:00+05:00"},
+        ]},
+    ]}
+    # 10:00 равноудалена от 08:00 и 12:00 — берётся более ранний слот
+    assert tp._select_slot(item, "2025-03-10T10:00:00Z", "2025-03-10T11:00:00Z")[:2] == (
+        "2025-03-10T08:00:00Z", "2025-03-10T09:00:00Z")
+    # Одинаковое начало (08:00Z == 13:00+05:00) — первый по списку
+    assert tp._select_slot(item, None, None) == ("2025-03-10T08:00:00Z", "2025-03-10T09:00:00Z", "first")
@@ -0,0 +1,61 @@
+import supply_watch as sw
+
+
+def _use_tmp_store(monkeypatch, tmp_path, tasks):
+    monkeypatch.setattr(sw, "SUPPLY_TASK_FILE", tmp_path / "supply_tasks.json")
+    monkeypatch.setattr(sw, "_tasks", tasks)
+    monkeypatch.setattr(sw, "_tasks_loaded", True)
+    monkeypatch.setattr(sw, "_short_index", {})
+    monkeypatch.setattr(sw, "_short_index_key", None)
+
+
+def _scan(token):
+    # Прежний линейный поиск по list_tasks()
+    for t in sw._tasks:
+        if str(t.get("status") or "").upper() in (sw.ST_DONE, sw.ST_FAILED, sw.ST_CANCELED):
+            continue
+        if sw.short(str(t.get("id"))) == token:
+            return t.get("id")
+    return None
+
+
+def test_index_follows_add_delete_and_purge(monkeypatch, tmp_path):
+    _use_tmp_store(monkeypatch, tmp_path, [{"id": "aaaa1111-0001", "status": "NEW"}])
+    assert sw.resolve_short_id("aaaa1111") == "aaaa1111-0001"
+    assert sw.resolve_short_id("bbbb2222") is None
+
+    sw.add_task({"id": "bbbb2222-0002", "status": "NEW"})
+    assert sw.resolve_short_id("bbbb2222") == "bbbb2222-0002"
+
+    assert sw.delete_task("aaaa1111-0001")
+    assert sw.resolve_short_id("aaaa1111") is None
+
+    # Удалить и добавить задачу с тем же числом задач — индекс всё равно перестраивается
+    sw.delete_task("bbbb2222-0002")
+    sw.add_task({"id": "cccc3333-0003", "status": "NEW"})
+    assert sw.resolve_short_id("bbbb2222") is None
+    assert sw.resolve_short_id("cccc3333") == "cccc3333-0003"
+
+    sw.purge_all_tasks()
+    assert sw.resolve_short_id("cccc3333") is None
+
+
+def test_finished_tasks_are_skipped(monkeypatch, tmp_path):
+    tasks = [
+        {"id": "dddd4444-0001", "status": "DONE"},
+        {"id": "dddd4444-0002", "status": "failed"},
+        {"id": "dddd4444-0003", "status": "CANCELED"},
+        {"id": "eeee5555-0001", "status": "CANCELED"},
+        {"id": "dddd4444-0004", "status": "WAIT_WINDOW"},
+        {"id": "ffff6666-0001"},
+    ]
+    _use_tmp_store(monkeypatch, tmp_path, tasks)
+    for token in ("dddd4444", "eeee5555", "ffff6666", "zzzz"):
+        assert sw.resolve_short_id(token) == _scan(token)
+    assert sw.resolve_short_id("dddd4444") == "dddd4444-0004"
+    assert sw.resolve_short_id("eeee5555") is None
+
+    # Статус меняется на месте (без save_tasks) — фильтр применяется при поиске, не при сборке индекса
+    tasks[4]["status"] = "DONE"
+    sw.mark_dirty(tasks[4])
+    assert sw.resolve_short_id("dddd4444") is None
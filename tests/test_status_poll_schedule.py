@@ -0,0 +1,38 @@
+import random
+import statistics
+
+import httpx_timeslot_patch as tp
+
+
+def _simulate(done_at, key=7):
+    # Один опрос supply/create/status: операция готова к done_at секундам от первого запроса
+    t = miss = 0.0
+    for delay in tp._status_poll_delays(key):
+        t += delay
+        if t >= done_at:
+            tp._record_status_done(key, miss, t)
+            return t - done_at
+        miss = t
+    return None
+
+
+def test_schedule_converges_to_fixed_completion_time(monkeypatch):
+    monkeypatch.setattr(tp, "_status_done_samples", {})
+    random.seed(12345)
+    lags = [_simulate(10.0) for _ in range(300)]
+    assert None not in lags
+    assert abs(statistics.median(tp._status_done_samples[7]) - 10.0) < 1.0
+    assert statistics.mean(lags[-50:]) < 1.5
+
+
+def test_schedule_learns_faster_completions(monkeypatch):
+    # Выборка набрана на медленных операциях; потом они ускорились до 5 с.
+    # Момент удачного опроса стоит в старом квантиле — без интервальной оценки
+    # расписание так и продолжало бы ждать ~18 с
+    monkeypatch.setattr(tp, "_status_done_samples", {})
+    random.seed(12345)
+    for _ in range(60):
+        _simulate(20.0)
+    lags = [_simulate(5.0) for _ in range(300)]
+    assert abs(statistics.median(tp._status_done_samples[7]) - 5.0) < 1.0
+    assert statistics.mean(lags[-50:]) < 1.5
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+
+import httpx_timeslot_patch as tp
+
+
+def _use_tasks(monkeypatch, tasks):
+    monkeypatch.setattr(tp, "_get_sw", lambda: SimpleNamespace(list_tasks=lambda: tasks))
+    monkeypatch.setattr(tp, "_tasks_by_draft", (0.0, {}))
+
+
+def _window(draft_id):
+    return {"draft_id": draft_id, "desired_from_iso": f"F{draft_id!r}", "desired_to_iso": "T"}
+
+
+def test_to_int_or_none_accepts_integral_floats_only():
+    assert tp._to_int_or_none(123.0) == 123
+    assert tp._to_int_or_none(123.5) is None
+    assert tp._to_int_or_none(float("nan")) is None
+    assert tp._to_int_or_none(float("inf")) is None
+    assert tp._to_int_or_none(" +123 ") == 123
+    assert tp._to_int_or_none("123.0") is None
+    assert tp._to_int_or_none("²") is None
+    assert tp._to_int_or_none(True) is None
+
+
+def test_target_window_matches_like_int_compare(monkeypatch):
+    # Прежняя сверка — int(t["draft_id"]) == int(draft_id)
+    for draft_id in (123, "123", 123.0, "+123", " 123 "):
+        _use_tasks(monkeypatch, [{"draft_id": "x"}, {"draft_id": "²"}, _window(draft_id)])
+        assert tp._target_from_sw_by_draft(123) == (f"F{draft_id!r}", "T")
+    _use_tasks(monkeypatch, [_window("123.0"), _window(123.5), _window(None)])
+    assert tp._target_from_sw_by_draft(123) == (None, None)
+
+
+def test_find_task_by_draft_keeps_digit_only_match(monkeypatch):
+    # _find_task_by_draft сверял только str(draft_id).isdigit() — так и остаётся
+    signed, exact = {"draft_id": "+123"}, {"draft_id": 123}
+    _use_tasks(monkeypatch, [signed, {"draft_id": 123.0}, exact])
+    assert tp._find_task_by_draft(123) is exact
+    _use_tasks(monkeypatch, [signed])
+    assert tp._find_task_by_draft(123) is None
@@ -0,0 +1,60 @@
+import asyncio
+import json
+
+import supply_watch as sw
+
+
+def _use_tmp_store(monkeypatch, tmp_path, tasks):
+    monkeypatch.setattr(sw, "SUPPLY_TASK_FILE", tmp_path / "supply_tasks.json")
+    monkeypatch.setattr(sw, "_tasks", tasks)
+    monkeypatch.setattr(sw, "_tasks_loaded", True)
+    monkeypatch.setattr(sw, "_flush_handle", None)
+    monkeypatch.setattr(sw, "_flush_loop", None)
+    monkeypatch.setattr(sw, "TASKS_FLUSH_DELAY_MS", 60_000)
+
+
+def _on_disk(tmp_path):
+    return json.loads((tmp_path / "supply_tasks.json").read_text(encoding="utf-8"))
+
+
+def test_close_flushes_pending_write(monkeypatch, tmp_path):
+    task = {"id": "a-1", "status": "NEW"}
+    _use_tmp_store(monkeypatch, tmp_path, [task])
+
+    async def main():
+        task["vehicle"] = "A123BC"
+        sw.mark_dirty(task)
+        assert sw._flush_handle is not None
+        await sw.close_http_client()
+
+    asyncio.run(main())
+    assert _on_disk(tmp_path)[0]["vehicle"] == "A123BC"
+    assert sw._flush_handle is None
+
+
+def test_timer_from_closed_loop_does_not_block_later_writes(monkeypatch, tmp_path):
+    task = {"id": "a-1", "status": "NEW"}
+    _use_tmp_store(monkeypatch, tmp_path, [task])
+
+    async def edit(value):
+        task["contact"] = value
+        sw.mark_dirty(task)
+
+    # Loop закрылся с взведённым таймером — запись потеряна, но хэндл остался
+    asyncio.run(edit("first"))
+    assert sw._flush_handle is not None
+
+    # Следующая правка без loop пишет сразу, а не упирается в старый хэндл
+    task["contact"] = "second"
+    sw.mark_dirty(task)
+    assert _on_disk(tmp_path)[0]["contact"] == "second"
+    assert sw._flush_handle is None
+
+    # В новом loop планируется свой таймер
+    async def edit_and_close(value):
+        await edit(value)
+        assert sw._flush_loop is asyncio.get_running_loop()
+        await sw.close_http_client()
+
+    asyncio.run(edit_and_close("third"))
+    assert _on_disk(tmp_path)[0]["contact"] == "third"